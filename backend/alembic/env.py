@@ -30,9 +30,29 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 
 from src.db.models import CodeCrunchrBase  # noqa: E402
+from src.db.partitions import is_partition_name  # noqa: E402
 
 target_metadata = CodeCrunchrBase.metadata
 
+
+def include_object(object, name, type_, reflected, compare_to):
+    # The monthly partitions get made by the app as it goes, they aren't in the models
+    # so autogenerate would want to drop them otherwise.
+    if type_ == "table" and reflected and is_partition_name(name):
+        return False
+
+    # Postgres also makes a copy of the language -> duration foreign key for every one
+    # of the duration partitions, those belong to postgres, not us.
+    if (
+        type_ == "foreign_key_constraint"
+        and reflected
+        and is_partition_name(object.referred_table.name)
+    ):
+        return False
+
+    return True
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -41,7 +61,11 @@ target_metadata = CodeCrunchrBase.metadata
 
 def run_migrations(connectable):
     # Modify the context and let it know what we've got
-    context.configure(connection=connectable, target_metadata=target_metadata)
+    context.configure(
+        connection=connectable,
+        target_metadata=target_metadata,
+        include_object=include_object,
+    )
 
     # Run the migrations
     with context.begin_transaction():
@@ -81,6 +105,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -0,0 +1,46 @@
+"""add shared cache table
+
+Revision ID: 3f6c2a9d81b4
+Revises: e3a4766e6992
+Create Date: 2026-10-17 14:02:11.503114
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op  # noqa: F401
+import sqlalchemy as sa  # noqa: F401
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3f6c2a9d81b4"
+down_revision: Union[str, Sequence[str], None] = "e3a4766e6992"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # NOTE: UNLOGGED skips the WAL, the table gets truncated if postgres crashes,
+    #       which is fine since it only ever holds cached data.
+    op.create_table(
+        "codecrunchr_shared_cache",
+        sa.Column("namespace", sa.String(), nullable=False),
+        sa.Column("key", sa.String(), nullable=False),
+        sa.Column("value", sa.String(), nullable=False),
+        sa.Column("expires_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("namespace", "key"),
+        prefixes=["UNLOGGED"],
+    )
+    op.create_index(
+        "idx_shared_cache_expires_at",
+        "codecrunchr_shared_cache",
+        ["expires_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("idx_shared_cache_expires_at", table_name="codecrunchr_shared_cache")
+    op.drop_table("codecrunchr_shared_cache")
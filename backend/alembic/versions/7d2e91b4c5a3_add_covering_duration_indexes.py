@@ -0,0 +1,68 @@
+"""add covering duration indexes
+
+Revision ID: 7d2e91b4c5a3
+Revises: 3f6c2a9d81b4
+Create Date: 2026-10-17 16:41:37.218604
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op  # noqa: F401
+import sqlalchemy as sa  # noqa: F401
+
+
+# revision identifiers, used by Alembic.
+revision: str = "7d2e91b4c5a3"
+down_revision: Union[str, Sequence[str], None] = "3f6c2a9d81b4"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The (user_id, date) constraint already covers everything the user_id index was used for
+    op.drop_index(
+        op.f("ix_codecrunchr_wakatime_durations_user_id"),
+        table_name="codecrunchr_wakatime_durations",
+    )
+
+    # NOTE: The constraint keeps its name, since the duration upserts refer to it by name
+    op.drop_constraint(
+        "unique_date_user_id", "codecrunchr_wakatime_durations", type_="unique"
+    )
+    # NOTE: This is raw SQL because alembic only knows about the constrained columns
+    #       when it builds the constraint, so it can't find the INCLUDE columns
+    op.execute(
+        "ALTER TABLE codecrunchr_wakatime_durations ADD CONSTRAINT unique_date_user_id "
+        "UNIQUE (user_id, date) INCLUDE (id, total_seconds, last_cached_at)"
+    )
+
+    op.create_index(
+        "idx_durations_date_user_id",
+        "codecrunchr_wakatime_durations",
+        ["date", "user_id"],
+        unique=False,
+        postgresql_include=["total_seconds", "last_cached_at"],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(
+        "idx_durations_date_user_id", table_name="codecrunchr_wakatime_durations"
+    )
+
+    op.drop_constraint(
+        "unique_date_user_id", "codecrunchr_wakatime_durations", type_="unique"
+    )
+    op.create_unique_constraint(
+        "unique_date_user_id", "codecrunchr_wakatime_durations", ["user_id", "date"]
+    )
+
+    op.create_index(
+        op.f("ix_codecrunchr_wakatime_durations_user_id"),
+        "codecrunchr_wakatime_durations",
+        ["user_id"],
+        unique=False,
+    )
@@ -0,0 +1,235 @@
+"""partition durations by month
+
+Revision ID: b84f0c7e2d19
+Revises: 7d2e91b4c5a3
+Create Date: 2026-10-17 18:12:54.630271
+
+"""
+
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op  # noqa: F401
+import sqlalchemy as sa  # noqa: F401
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b84f0c7e2d19"
+down_revision: Union[str, Sequence[str], None] = "7d2e91b4c5a3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+DURATIONS = "codecrunchr_wakatime_durations"
+LANGUAGES = "codecrunchr_wakatime_language_durations"
+
+# The id sequence gets handed over to the new table, so ids keep counting up from where they were
+DURATIONS_ID_SEQ = "codecrunchr_wakatime_durations_id_seq"
+
+# Everything from before this many months ago goes into one big `_history` partition,
+# and everything after gets a partition per month (up to a few months from now, the
+# app makes the rest as it needs them).
+MONTHS_BACK = 12
+MONTHS_AHEAD = 3
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + (month.month - 1) + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def rename_old_tables() -> None:
+    """
+    Moves the existing tables (and anything with a schema-wide name) out of the way.
+    """
+    op.execute(f"ALTER TABLE {LANGUAGES} RENAME TO {LANGUAGES}_old")
+    op.execute(
+        f"ALTER TABLE {LANGUAGES}_old RENAME CONSTRAINT pk_parent_id_language TO pk_parent_id_language_old"
+    )
+    op.execute(
+        f"ALTER INDEX ix_{LANGUAGES}_language RENAME TO ix_{LANGUAGES}_language_old"
+    )
+
+    op.execute(f"ALTER TABLE {DURATIONS} RENAME TO {DURATIONS}_old")
+    op.execute(
+        f"ALTER TABLE {DURATIONS}_old RENAME CONSTRAINT {DURATIONS}_pkey TO {DURATIONS}_pkey_old"
+    )
+    op.execute(
+        f"ALTER TABLE {DURATIONS}_old RENAME CONSTRAINT unique_date_user_id TO unique_date_user_id_old"
+    )
+    op.execute(
+        "ALTER INDEX idx_durations_date_user_id RENAME TO idx_durations_date_user_id_old"
+    )
+
+    # Otherwise the sequence gets dropped along with the old table
+    op.execute(f"ALTER SEQUENCE {DURATIONS_ID_SEQ} OWNED BY NONE")
+
+
+def drop_old_tables() -> None:
+    op.execute(f"DROP TABLE {LANGUAGES}_old")
+    op.execute(f"DROP TABLE {DURATIONS}_old")
+    op.execute(f"ALTER SEQUENCE {DURATIONS_ID_SEQ} OWNED BY {DURATIONS}.id")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    rename_old_tables()
+
+    # NOTE: Postgres needs the partition key in every unique constraint on a partitioned
+    #       table, so `date` is part of the primary key now, and the language rows keep
+    #       a copy of their parent's date to reference it by.
+    op.create_table(
+        DURATIONS,
+        sa.Column(
+            "id",
+            sa.Integer(),
+            server_default=sa.text(f"nextval('{DURATIONS_ID_SEQ}'::regclass)"),
+            autoincrement=False,
+            nullable=False,
+        ),
+        sa.Column("user_id", sa.UUID(), nullable=False),
+        sa.Column("date", sa.Date(), nullable=False),
+        sa.Column("total_seconds", sa.Float(), nullable=False),
+        sa.Column(
+            "last_cached_at",
+            sa.DateTime(),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"], ["codecrunchr_users.id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("id", "date"),
+        sa.UniqueConstraint(
+            "user_id",
+            "date",
+            name="unique_date_user_id",
+            postgresql_include=["id", "total_seconds", "last_cached_at"],
+        ),
+        postgresql_partition_by="RANGE (date)",
+    )
+    op.create_index(
+        "idx_durations_date_user_id",
+        DURATIONS,
+        ["date", "user_id"],
+        unique=False,
+        postgresql_include=["total_seconds", "last_cached_at"],
+    )
+
+    op.create_table(
+        LANGUAGES,
+        sa.Column("parent_id", sa.Integer(), nullable=False),
+        sa.Column("date", sa.Date(), nullable=False),
+        sa.Column("language", sa.String(), nullable=False),
+        sa.Column("total_seconds", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["parent_id", "date"],
+            [f"{DURATIONS}.id", f"{DURATIONS}.date"],
+            ondelete="CASCADE",
+        ),
+        sa.PrimaryKeyConstraint(
+            "parent_id", "language", "date", name="pk_parent_id_language"
+        ),
+        postgresql_partition_by="RANGE (date)",
+    )
+    op.create_index(
+        op.f(f"ix_{LANGUAGES}_language"), LANGUAGES, ["language"], unique=False
+    )
+
+    # Make the partitions, the history one first and then one per month after that
+    first_month = add_months(date.today().replace(day=1), -MONTHS_BACK)
+
+    for table in (DURATIONS, LANGUAGES):
+        op.execute(
+            f"CREATE TABLE {table}_history PARTITION OF {table} "
+            f"FOR VALUES FROM (MINVALUE) TO ('{first_month}')"
+        )
+
+        for offset in range(MONTHS_BACK + MONTHS_AHEAD + 1):
+            month = add_months(first_month, offset)
+
+            op.execute(
+                f"CREATE TABLE {table}_{month:%Y_%m} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+            )
+
+    # Copy everything over, the language rows pick up their parent's date on the way
+    op.execute(
+        f"INSERT INTO {DURATIONS} (id, user_id, date, total_seconds, last_cached_at) "
+        f"SELECT id, user_id, date, total_seconds, last_cached_at FROM {DURATIONS}_old"
+    )
+    op.execute(
+        f"INSERT INTO {LANGUAGES} (parent_id, date, language, total_seconds) "
+        f"SELECT l.parent_id, d.date, l.language, l.total_seconds "
+        f"FROM {LANGUAGES}_old l JOIN {DURATIONS}_old d ON d.id = l.parent_id"
+    )
+
+    drop_old_tables()
+
+    op.execute(f"ANALYZE {DURATIONS}")
+    op.execute(f"ANALYZE {LANGUAGES}")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    rename_old_tables()
+
+    op.create_table(
+        DURATIONS,
+        sa.Column(
+            "id",
+            sa.Integer(),
+            server_default=sa.text(f"nextval('{DURATIONS_ID_SEQ}'::regclass)"),
+            autoincrement=False,
+            nullable=False,
+        ),
+        sa.Column("user_id", sa.UUID(), nullable=False),
+        sa.Column("date", sa.Date(), nullable=False),
+        sa.Column("total_seconds", sa.Float(), nullable=False),
+        sa.Column(
+            "last_cached_at",
+            sa.DateTime(),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"], ["codecrunchr_users.id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint(
+            "user_id",
+            "date",
+            name="unique_date_user_id",
+            postgresql_include=["id", "total_seconds", "last_cached_at"],
+        ),
+    )
+    op.create_index(
+        "idx_durations_date_user_id",
+        DURATIONS,
+        ["date", "user_id"],
+        unique=False,
+        postgresql_include=["total_seconds", "last_cached_at"],
+    )
+
+    op.create_table(
+        LANGUAGES,
+        sa.Column("parent_id", sa.Integer(), nullable=False),
+        sa.Column("language", sa.String(), nullable=False),
+        sa.Column("total_seconds", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(["parent_id"], [f"{DURATIONS}.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("parent_id", "language", name="pk_parent_id_language"),
+    )
+    op.create_index(
+        op.f(f"ix_{LANGUAGES}_language"), LANGUAGES, ["language"], unique=False
+    )
+
+    op.execute(
+        f"INSERT INTO {DURATIONS} (id, user_id, date, total_seconds, last_cached_at) "
+        f"SELECT id, user_id, date, total_seconds, last_cached_at FROM {DURATIONS}_old"
+    )
+    op.execute(
+        f"INSERT INTO {LANGUAGES} (parent_id, language, total_seconds) "
+        f"SELECT parent_id, language, total_seconds FROM {LANGUAGES}_old"
+    )
+
+    # Dropping the old (partitioned) tables drops all of their partitions too
+    drop_old_tables()
@@ -0,0 +1,90 @@
+"""add duration rollups
+
+Revision ID: c5a8e3f1d604
+Revises: b84f0c7e2d19
+Create Date: 2026-10-17 20:27:03.584912
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op  # noqa: F401
+import sqlalchemy as sa  # noqa: F401
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c5a8e3f1d604"
+down_revision: Union[str, Sequence[str], None] = "b84f0c7e2d19"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "codecrunchr_weekly_duration_rollups",
+        sa.Column("week_start", sa.Date(), nullable=False),
+        sa.Column("user_id", sa.UUID(), nullable=False),
+        sa.Column("total_seconds", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["user_id"], ["codecrunchr_users.id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("week_start", "user_id"),
+    )
+    op.create_table(
+        "codecrunchr_monthly_duration_rollups",
+        sa.Column("month_start", sa.Date(), nullable=False),
+        sa.Column("user_id", sa.UUID(), nullable=False),
+        sa.Column("total_seconds", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["user_id"], ["codecrunchr_users.id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("month_start", "user_id"),
+    )
+    op.create_table(
+        "codecrunchr_weekly_language_rollups",
+        sa.Column("week_start", sa.Date(), nullable=False),
+        sa.Column("user_id", sa.UUID(), nullable=False),
+        sa.Column("language", sa.String(), nullable=False),
+        sa.Column("total_seconds", sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["user_id"], ["codecrunchr_users.id"], ondelete="CASCADE"
+        ),
+        sa.PrimaryKeyConstraint("week_start", "user_id", "language"),
+    )
+
+    # Fill them in from everything we already have, from here on out
+    # `update_user_durations` keeps them up to date.
+    # NOTE: date_trunc('week', ...) lands on monday, same as the ISO weeks we use everywhere else
+    op.execute(
+        """
+        INSERT INTO codecrunchr_weekly_duration_rollups (week_start, user_id, total_seconds)
+        SELECT date_trunc('week', date)::date, user_id, sum(total_seconds)
+        FROM codecrunchr_wakatime_durations
+        GROUP BY 1, 2
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO codecrunchr_monthly_duration_rollups (month_start, user_id, total_seconds)
+        SELECT date_trunc('month', date)::date, user_id, sum(total_seconds)
+        FROM codecrunchr_wakatime_durations
+        GROUP BY 1, 2
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO codecrunchr_weekly_language_rollups (week_start, user_id, language, total_seconds)
+        SELECT date_trunc('week', l.date)::date, d.user_id, l.language, sum(l.total_seconds)
+        FROM codecrunchr_wakatime_language_durations l
+        JOIN codecrunchr_wakatime_durations d ON d.id = l.parent_id AND d.date = l.date
+        GROUP BY 1, 2, 3
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("codecrunchr_weekly_language_rollups")
+    op.drop_table("codecrunchr_monthly_duration_rollups")
+    op.drop_table("codecrunchr_weekly_duration_rollups")
@@ -0,0 +1,317 @@
+"""
+Compares how long it takes to write a user's durations with the old write path (a
+statement for each step, so about 8 round trips) against the two ways that
+`update_user_durations` writes them now: a single upsert statement, and COPYing into
+staging tables first (which it uses for big batches, like backfills).
+
+This needs a migrated database to write to (any rows it makes are rolled back).
+Run it from the backend directory with:
+    python -m benchmarks.duration_upserts [--days 1 7 365 3650] [--repeat 10] [--db-url URL]
+
+NOTE: A local database hides most of the difference, since each round trip is almost
+      free. Point it at one across a network to see what production sees.
+"""
+
+from argparse import ArgumentParser
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from functools import partial
+from uuid import uuid4
+import asyncio
+import random
+import statistics
+import time
+import tracemalloc
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from sqlalchemy import select, func as db_funcs  # noqa: E402
+from sqlalchemy.dialects.postgresql import insert  # noqa: E402
+from sqlalchemy.exc import DBAPIError  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession  # noqa: E402
+
+from src.db import get_session, start_database_engine  # noqa: E402
+from src.db.helpers import (  # noqa: E402
+    get_month_start,
+    get_summary_days,
+    get_week_start,
+    update_user_durations,
+)
+from src.db.models import (  # noqa: E402
+    MonthlyDurationRollup,
+    User,
+    WakatimeDuration,
+    WakatimeLanguageDuration,
+    WeeklyDurationRollup,
+    WeeklyLanguageRollup,
+)
+from src.utils.env import get_required_env  # noqa: E402
+from src.wakatime import WakatimeTokens  # noqa: E402
+from src.wakatime.summaries import LeanSummaryResponseModel  # noqa: E402
+
+LANGUAGES_PER_DAY = 10
+
+
+def fake_summary(days: int) -> LeanSummaryResponseModel:
+    """
+    Builds `days` days (ending today) of summary data, with a handful of languages each.
+    """
+    today = date.today()
+
+    return LeanSummaryResponseModel.model_validate(
+        {
+            "data": [
+                {
+                    "grand_total": {"total_seconds": random.uniform(0, 8 * 3600)},
+                    "languages": [
+                        {
+                            "name": f"language-{i}",
+                            "total_seconds": random.uniform(0, 3600),
+                        }
+                        for i in range(LANGUAGES_PER_DAY)
+                    ],
+                    "range": {"date": (today - timedelta(days=n)).isoformat()},
+                }
+                for n in reversed(range(days))
+            ],
+            "start": "",
+            "end": "",
+        }
+    )
+
+
+async def add_rollup_deltas(session: AsyncSession, model, rows: list[dict]) -> None:
+    if not rows:
+        return
+
+    stmt = insert(model).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(model.__table__.primary_key.columns),
+        set_={"total_seconds": model.total_seconds + stmt.excluded.total_seconds},
+    )
+
+    await session.execute(stmt)
+
+
+async def update_user_durations_before(
+    session: AsyncSession,
+    tokens: WakatimeTokens,
+    summary: LeanSummaryResponseModel,
+) -> None:
+    """
+    The write path from before everything was folded into one statement, trimmed down
+    to just the statements it ran.
+    """
+    days = get_summary_days(summary)
+    user_id = tokens["user_id"]
+
+    duration_data = [
+        dict(
+            user_id=user_id,
+            date=day,
+            total_seconds=section.grand_total.total_seconds,
+            last_cached_at=datetime.now(tz=None),
+        )
+        for day, section in zip(days, summary.data)
+    ]
+
+    await session.execute(
+        select(
+            db_funcs.pg_advisory_xact_lock(db_funcs.hashtextextended(str(user_id), 0))
+        )
+    )
+
+    old_totals = {
+        row.date: row.total_seconds
+        for row in await session.execute(
+            select(WakatimeDuration.date, WakatimeDuration.total_seconds)
+            .where(WakatimeDuration.user_id == user_id)
+            .where(WakatimeDuration.date.in_(days))
+        )
+    }
+    old_language_totals = {
+        (row.date, row.language): row.total_seconds
+        for row in await session.execute(
+            select(
+                WakatimeLanguageDuration.date,
+                WakatimeLanguageDuration.language,
+                WakatimeLanguageDuration.total_seconds,
+            )
+            .join(WakatimeLanguageDuration.parent)
+            .where(WakatimeDuration.user_id == user_id)
+            .where(WakatimeDuration.date.in_(days))
+        )
+    }
+
+    duration_stmt = insert(WakatimeDuration).values(duration_data)
+    duration_stmt = duration_stmt.on_conflict_do_update(
+        set_={
+            "total_seconds": duration_stmt.excluded.total_seconds,
+            "last_cached_at": duration_stmt.excluded.last_cached_at,
+        },
+        constraint="unique_date_user_id",
+    ).returning(WakatimeDuration)
+
+    new_durations = sorted(
+        (await session.scalars(duration_stmt)).all(), key=lambda d: d.date
+    )
+
+    weekly: dict[date, float] = defaultdict(float)
+    monthly: dict[date, float] = defaultdict(float)
+
+    for d in duration_data:
+        delta = d["total_seconds"] - old_totals.get(d["date"], 0)
+        weekly[get_week_start(d["date"])] += delta
+        monthly[get_month_start(d["date"])] += delta
+
+    await add_rollup_deltas(
+        session,
+        WeeklyDurationRollup,
+        [
+            dict(week_start=week, user_id=user_id, total_seconds=delta)
+            for week, delta in weekly.items()
+            if delta != 0
+        ],
+    )
+    await add_rollup_deltas(
+        session,
+        MonthlyDurationRollup,
+        [
+            dict(month_start=month, user_id=user_id, total_seconds=delta)
+            for month, delta in monthly.items()
+            if delta != 0
+        ],
+    )
+
+    language_breakdowns = [
+        dict(
+            parent_id=duration.id,
+            date=duration.date,
+            language=lang.name,
+            total_seconds=lang.total_seconds,
+        )
+        for section, duration in zip(summary.data, new_durations)
+        for lang in section.languages
+    ]
+
+    language_stmt = insert(WakatimeLanguageDuration).values(language_breakdowns)
+    language_stmt = language_stmt.on_conflict_do_update(
+        set_={"total_seconds": language_stmt.excluded.total_seconds},
+        constraint="pk_parent_id_language",
+    ).returning(WakatimeLanguageDuration)
+
+    await session.scalars(language_stmt)
+
+    language_deltas: dict[tuple[date, str], float] = defaultdict(float)
+
+    for breakdown in language_breakdowns:
+        key = (breakdown["date"], breakdown["language"])
+        language_deltas[(get_week_start(breakdown["date"]), breakdown["language"])] += (
+            breakdown["total_seconds"] - old_language_totals.get(key, 0)
+        )
+
+    await add_rollup_deltas(
+        session,
+        WeeklyLanguageRollup,
+        [
+            dict(
+                week_start=week, user_id=user_id, language=language, total_seconds=delta
+            )
+            for (week, language), delta in language_deltas.items()
+            if delta != 0
+        ],
+    )
+
+
+async def measure(write, days: int, repeat: int) -> tuple[float, float, int]:
+    """
+    Returns the median time (in seconds) for a first write of `days` days for a user,
+    and for rewriting those same days afterwards (e.g., a recache), along with the peak
+    memory (in bytes) used by a first write.
+    """
+    first_writes = []
+    rewrites = []
+    peak = 0
+
+    # The last run is only for measuring memory, tracemalloc slows everything down
+    for run in range(repeat + 1):
+        tokens = WakatimeTokens(user_id=uuid4(), access_token="", refresh_token="")
+        summary = fake_summary(days)
+        tracing = run == repeat
+
+        async with get_session() as session:
+            session.add(User(id=tokens["user_id"]))
+            await session.flush()
+
+            if tracing:
+                tracemalloc.start()
+
+            started = time.perf_counter()
+            await write(session, tokens, summary)
+            first_writes.append(time.perf_counter() - started)
+
+            if tracing:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                first_writes.pop()
+            else:
+                started = time.perf_counter()
+                await write(session, tokens, fake_summary(days))
+                rewrites.append(time.perf_counter() - started)
+
+            # Don't leave anything behind
+            await session.rollback()
+
+    return statistics.median(first_writes), statistics.median(rewrites), peak
+
+
+async def run(days_to_test: list[int], repeat: int) -> None:
+    print(
+        f"{'days':>6} {'path':>7} {'first write':>13} {'rewrite':>11} "
+        f"{'rows/s':>9} {'peak mem':>10}"
+    )
+
+    for days in days_to_test:
+        for label, write in (
+            ("before", update_user_durations_before),
+            ("upsert", partial(update_user_durations, bulk=False)),
+            ("copy", partial(update_user_durations, bulk=True)),
+        ):
+            # One untimed run first, so every path starts with warm connections and caches
+            try:
+                await measure(write, days, 1)
+            except DBAPIError as e:
+                # e.g., the old path can't send more than 32767 parameters at once
+                print(f"{days:>6} {label:>7} failed: {e.orig}")
+                continue
+
+            first_write, rewrite, peak = await measure(write, days, repeat)
+
+            # Each day is a duration row plus a row for each of its languages
+            rows = days * (1 + LANGUAGES_PER_DAY)
+
+            print(
+                f"{days:>6} {label:>7} {first_write * 1000:>11.2f}ms "
+                f"{rewrite * 1000:>9.2f}ms {rows / first_write:>9.0f} "
+                f"{peak / 1024:>8.0f}KB"
+            )
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 7, 365])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--db-url", default=None)
+    args = parser.parse_args()
+
+    random.seed(0)
+
+    start_database_engine(db_url=args.db_url or get_required_env("DATABASE_URL"))
+
+    asyncio.run(run(args.days, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
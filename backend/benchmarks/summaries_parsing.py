@@ -0,0 +1,166 @@
+"""
+Compares parsing a wakatime summaries response with the full `SummaryResponseModel`
+against the `LeanSummaryResponseModel` used when recaching durations.
+
+Run it from the backend directory with:
+    python -m benchmarks.summaries_parsing [--days 365] [--repeat 5]
+"""
+
+from argparse import ArgumentParser
+from datetime import date, timedelta
+import json
+import random
+import time
+import tracemalloc
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from src.wakatime.summaries import (  # noqa: E402
+    SummaryResponseModel,
+    LeanSummaryResponseModel,
+)
+
+
+def fake_duration(name: str, seconds: float, **extra) -> dict:
+    return {
+        "name": name,
+        "hours": int(seconds // 3600),
+        "minutes": int(seconds % 3600 // 60),
+        "seconds": int(seconds % 60),
+        "total_seconds": seconds,
+        "digital": "0:00:00",
+        "text": "0 secs",
+        "percent": 0.0,
+        **extra,
+    }
+
+
+def fake_line_changes() -> dict:
+    return {
+        "human_additions": random.randint(0, 500),
+        "human_deletions": random.randint(0, 500),
+        "ai_additions": random.randint(0, 500),
+        "ai_deletions": random.randint(0, 500),
+    }
+
+
+def fake_day(day: date) -> dict:
+    """
+    Builds a day of summary data that looks about as busy as a
+    real user's day of coding.
+    """
+    total = random.uniform(0, 8 * 3600)
+
+    def section(prefix: str, count: int, **extra) -> list[dict]:
+        return [
+            fake_duration(f"{prefix}-{i}", random.uniform(0, total), **extra)
+            for i in range(count)
+        ]
+
+    return {
+        "grand_total": {
+            "hours": int(total // 3600),
+            "minutes": int(total % 3600 // 60),
+            "total_seconds": total,
+            "digital": "0:00",
+            "decimal": "0.00",
+            "text": "0 mins",
+            **fake_line_changes(),
+        },
+        "categories": section("category", 3),
+        "projects": [{**p, **fake_line_changes()} for p in section("project", 8)],
+        "languages": section("language", 10),
+        "editors": section("editor", 3),
+        "operating_systems": section("os", 2),
+        "dependencies": section("dependency", 40),
+        "machines": section("machine", 2, machine_name_id="abc123"),
+        "range": {
+            "date": day.isoformat(),
+            "start": f"{day.isoformat()}T04:00:00Z",
+            "end": f"{(day + timedelta(days=1)).isoformat()}T03:59:59Z",
+            "text": day.isoformat(),
+            "timezone": "America/Halifax",
+        },
+    }
+
+
+def fake_summaries_response(days: int) -> bytes:
+    start = date(2025, 1, 1)
+
+    return json.dumps(
+        {
+            "data": [fake_day(start + timedelta(days=n)) for n in range(days)],
+            "cumulative_total": {
+                "seconds": 0.0,
+                "text": "",
+                "decimal": "",
+                "digital": "",
+            },
+            "daily_average": {
+                "holidays": 0,
+                "days_including_holidays": days,
+                "days_minus_holidays": days,
+                "seconds": 0.0,
+                "text": "",
+                "seconds_including_other_language": 0.0,
+                "text_including_other_language": "",
+            },
+            "start": f"{start.isoformat()}T04:00:00Z",
+            "end": f"{(start + timedelta(days=days)).isoformat()}T03:59:59Z",
+        }
+    ).encode("utf-8")
+
+
+def measure(model, payload: bytes, repeat: int) -> tuple[float, int]:
+    """
+    Returns the best parse time (in seconds) and the peak memory (in bytes)
+    used while parsing `payload` with `model`.
+    """
+    timings = []
+
+    for _ in range(repeat):
+        started = time.perf_counter()
+        model.model_validate_json(payload)
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    parsed = model.model_validate_json(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del parsed
+
+    return min(timings), peak
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 7, 365])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(0)
+
+    print(
+        f"{'days':>6} {'payload':>10} {'model':>6} {'best time':>12} {'peak mem':>12}"
+    )
+
+    for days in args.days:
+        payload = fake_summaries_response(days)
+
+        for label, model in (
+            ("full", SummaryResponseModel),
+            ("lean", LeanSummaryResponseModel),
+        ):
+            best, peak = measure(model, payload, args.repeat)
+
+            print(
+                f"{days:>6} {len(payload) / 1024:>8.0f}KB {label:>6} "
+                f"{best * 1000:>10.2f}ms {peak / 1024:>10.0f}KB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from contextlib import asynccontextmanager
+from datetime import datetime
 import sys
 from fastapi import FastAPI
 from dotenv import load_dotenv
@@ -8,8 +9,12 @@ load_dotenv()
 
 from .db import run_migrations, start_database_engine, shutdown_database_engine  # noqa: E402
 from .jobs.scheduler import init_job_scheduler, kill_job_scheduler, JobScheduler  # noqa: E402
-from .jobs.leaderboards import leaderboard_job  # noqa: E402
-from .utils.env import get_required_env  # noqa: E402
+from .jobs.leaderboards import leaderboard_job, cancel_leaderboard_jobs  # noqa: E402
+from .jobs.oauth import oauth_renewal_job  # noqa: E402
+from .jobs.partitions import partition_maintenance_job  # noqa: E402
+from .wakatime.client import start_wakatime_client, shutdown_wakatime_client  # noqa: E402
+from .caching.backends import start_cache_backend, shutdown_cache_backend  # noqa: E402
+from .utils.env import get_required_env, get_optional_env  # noqa: E402
 
 from .routers import (  # noqa: E402
     ping_router,
@@ -38,6 +43,17 @@ def add_presceduled_jobs(js: JobScheduler) -> None:
     # Rebuilds the leaderboard
     js.add_job(leaderboard_job, trigger="cron", hour="*/1", minute="0")
 
+    # Renews wakatime tokens before they expire
+    js.add_job(oauth_renewal_job, trigger="interval", minutes=10)
+
+    # Makes the duration partitions for the next few months (once now, then daily)
+    js.add_job(
+        partition_maintenance_job,
+        trigger="interval",
+        days=1,
+        next_run_time=datetime.now(),
+    )
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -51,11 +67,19 @@ async def lifespan(app: FastAPI):
 
     # Start the database engine
     DB_URL = get_required_env("DATABASE_URL")
-    start_database_engine(db_url=DB_URL)
+    start_database_engine(
+        db_url=DB_URL, replica_url=get_optional_env("DATABASE_REPLICA_URL")
+    )
 
     # Run any pending migrations
     await run_migrations()
 
+    # Start whichever cache backend the caches should share items through
+    await start_cache_backend(get_optional_env("CACHE_BACKEND", "memory"))
+
+    # Start the shared http client that all requests to wakatime go through
+    start_wakatime_client()
+
     # Start the job scheduler and add any prescheduled jobs to it
     job_scheduler = init_job_scheduler()
     add_presceduled_jobs(js=job_scheduler)
@@ -70,6 +94,14 @@ async def lifespan(app: FastAPI):
     # GRACEFUL SHUTDOWN     -------------------------
     kill_job_scheduler(wait=False)
 
+    # Stopping the scheduler doesn't stop a job that's already running, and the
+    # leaderboard job needs the wakatime client and database that are about to go away
+    await cancel_leaderboard_jobs()
+
+    await shutdown_wakatime_client()
+
+    await shutdown_cache_backend()
+
     await shutdown_database_engine()
 
     LOGGER.info("Bye!")
@@ -1,5 +1,6 @@
-from typing import Generic, TypeVar
-from datetime import datetime
+from typing import Awaitable, Callable, Generic, TypedDict, TypeVar
+from collections import OrderedDict
+from datetime import datetime, timedelta
 
 T = TypeVar("T")
 
@@ -10,6 +11,8 @@ class CachedItem(Generic[T]):
     checks to make sure that the value actually still needs to be cached.
     """
 
+    __slots__ = ("item", "expires_at")
+
     item: T
     expires_at: datetime | None
 
@@ -18,51 +21,197 @@ class CachedItem(Generic[T]):
         self.item = item
         self.expires_at = expires_at
 
-    def is_valid(self) -> bool:
-        return not any([self.has_expired()])
+    def is_valid(self, now: datetime | None = None) -> bool:
+        return not any([self.has_expired(now)])
 
-    def has_expired(self) -> bool:
+    def has_expired(self, now: datetime | None = None) -> bool:
         if self.expires_at is None:
             return False
 
-        return self.expires_at >= datetime.now()
+        return self.expires_at <= (now or datetime.now())
+
+
+class CacheStats(TypedDict):
+    size: int
+    max_size: int | None
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
 
 
 class Cache(Generic[T]):
     """
-    A very overcomplicated cache thing that caches an item `T` with
-    additional validation checks.
+    A size-bounded LRU cache that caches an item `T` with a per-item expiry.
+
+    - `max_size` caps how many items are kept, the least recently used item
+      gets evicted to make room for new ones. (None means unbounded)
+    - `default_ttl` is how long an item lives for if `add` isn't given an expiry.
+    - Expired items are dropped when they're looked up, and the whole cache gets
+      swept for them at most once every `sweep_interval` while items are added,
+      so items nobody asks for again don't just sit around forever.
+    - `loader` is an optional async function used by `get_or_load` to fill in misses.
     """
 
-    cached_items: dict[str, CachedItem[T]]
+    cached_items: "OrderedDict[str, CachedItem[T]]"
+
+    max_size: int | None
+    default_ttl: timedelta | None
+    sweep_interval: timedelta
+    loader: Callable[[str], Awaitable[T | None]] | None
+
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+
+    _next_sweep_at: datetime
+
+    def __init__(
+        self,
+        *,
+        max_size: int | None = None,
+        default_ttl: timedelta | None = None,
+        sweep_interval: timedelta = timedelta(minutes=1),
+        loader: Callable[[str], Awaitable[T | None]] | None = None,
+    ) -> None:
+        if max_size is not None and max_size <= 0:
+            raise ValueError("max_size must be greater than 0")
+
+        self.cached_items = OrderedDict()
+
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.sweep_interval = sweep_interval
+        self.loader = loader
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._next_sweep_at = datetime.now() + sweep_interval
+
+    def add(
+        self,
+        key: str,
+        item: T,
+        *,
+        expires_at: datetime | None = None,
+        ttl: timedelta | None = None,
+    ) -> None:
+        now = datetime.now()
+
+        if expires_at is None:
+            ttl = ttl if ttl is not None else self.default_ttl
+            expires_at = (now + ttl) if ttl is not None else None
+
+        # No point in holding onto something that's already expired
+        if expires_at is not None and expires_at <= now:
+            self.remove(key)
+            return
 
-    def __init__(self) -> None:
-        self.cached_items = {}
-
-    def add(self, key: str, item: T, *, expires_at: datetime | None = None) -> None:
         self.cached_items[key] = CachedItem(item, expires_at=expires_at)
+        self.cached_items.move_to_end(key)
+
+        # Piggyback the expiry sweep on writes so we don't need a job for it
+        if now >= self._next_sweep_at:
+            self.clean(now)
+
+        # Make room by evicting whatever was used the longest time ago
+        if self.max_size is not None:
+            while len(self.cached_items) > self.max_size:
+                self.cached_items.popitem(last=False)
+                self.evictions += 1
 
     def get(self, key: str) -> T | None:
         tmp = self.cached_items.get(key, None)
 
-        if not tmp:
+        if tmp is None:
+            self.misses += 1
             return None
 
         if not tmp.is_valid():
-            return tmp.item
-        else:
             del self.cached_items[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        # Mark it as the most recently used
+        self.cached_items.move_to_end(key)
+        self.hits += 1
+
+        return tmp.item
+
+    async def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[str], Awaitable[T | None]] | None = None,
+        *,
+        expires_at: datetime | None = None,
+        ttl: timedelta | None = None,
+    ) -> T | None:
+        """
+        Gets the item for `key`, calling the loader (either the one passed in, or
+        the cache's own) to fill it in on a miss. If the loader returns None then
+        nothing is cached.
+        """
+        item = self.get(key)
+
+        if item is not None:
+            return item
+
+        loader = loader or self.loader
+
+        if loader is None:
+            return None
 
-        return None
+        item = await loader(key)
 
-    def clean(self) -> None:
-        for k, v in self.cached_items.items():
-            if not v.is_valid():
-                del self.cached_items[k]
+        if item is not None:
+            self.add(key, item, expires_at=expires_at, ttl=ttl)
+
+        return item
+
+    def clean(self, now: datetime | None = None) -> int:
+        """
+        Drops every expired item from the cache, and returns how many there were.
+        """
+        now = now or datetime.now()
+
+        # Collect the keys first, we can't delete from the dict while looping over it
+        expired = [k for k, v in self.cached_items.items() if not v.is_valid(now)]
+
+        for k in expired:
+            del self.cached_items[k]
+
+        self.expirations += len(expired)
+        self._next_sweep_at = now + self.sweep_interval
+
+        return len(expired)
 
     def remove(self, key: str) -> None:
-        if key in self.cached_items:
-            del self.cached_items[key]
+        self.cached_items.pop(key, None)
+
+    def clear(self) -> None:
+        self.cached_items.clear()
+
+    def stats(self) -> CacheStats:
+        return CacheStats(
+            size=len(self.cached_items),
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            expirations=self.expirations,
+        )
+
+    def __contains__(self, key: str) -> bool:
+        tmp = self.cached_items.get(key, None)
+        return tmp is not None and tmp.is_valid()
+
+    def __len__(self) -> int:
+        return len(self.cached_items)
 
 
-__all__ = ["Cache", "CachedItem"]
+__all__ = ["Cache", "CachedItem", "CacheStats"]
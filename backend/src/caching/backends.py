@@ -0,0 +1,421 @@
+from abc import ABC, abstractmethod
+from typing import Any, Callable, TypedDict
+from datetime import datetime, timedelta
+from logging import getLogger
+import asyncio
+import json
+
+from sqlalchemy import delete, func as db_funcs, or_, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from ..db import get_connection, get_database_singleton
+from ..db.models import SharedCacheEntry
+from ..utils.env import get_optional_env
+
+LOGGER = getLogger(__name__)
+
+# The postgres channel that cache invalidations get broadcast on
+INVALIDATION_CHANNEL = "codecrunchr_cache_invalidation"
+
+
+class CacheInvalidation(TypedDict):
+    namespace: str
+    key: str
+    is_prefix: bool
+
+
+InvalidationCallback = Callable[[CacheInvalidation], None]
+
+# The namespace that means "every cache". Sent when a worker might have missed some
+# invalidations, so that it forgets everything it was holding on to.
+ALL_NAMESPACES = "*"
+EVERYTHING = CacheInvalidation(namespace=ALL_NAMESPACES, key="", is_prefix=True)
+
+
+class CacheBackend(ABC):
+    """
+    Somewhere for caches to keep items so that every worker can see them, and to
+    tell every worker when something's been removed from a cache.
+
+    Every cache still keeps its own in-process copy of whatever it's looked up,
+    the backend is just what sits behind that.
+    """
+
+    name: str
+
+    # Everyone who wants to hear about invalidations, no matter which backend
+    # is actually in use. (i.e., the caches themselves)
+    subscribers: list[InvalidationCallback] = []
+
+    @classmethod
+    def subscribe(cls, callback: InvalidationCallback) -> None:
+        cls.subscribers.append(callback)
+
+    def notify_subscribers(self, invalidation: CacheInvalidation) -> None:
+        for callback in self.subscribers:
+            try:
+                callback(invalidation)
+            except Exception:
+                LOGGER.exception("Cache invalidation callback failed")
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def get(self, namespace: str, key: str) -> tuple[str, datetime | None] | None:
+        """
+        Returns the serialized value and expiry for `key`, or None if it isn't
+        there (or has expired).
+        """
+
+    @abstractmethod
+    async def set(
+        self, namespace: str, key: str, value: str, expires_at: datetime | None
+    ) -> None: ...
+
+    @abstractmethod
+    async def delete(
+        self, namespace: str, key: str, *, is_prefix: bool = False
+    ) -> None:
+        """
+        Removes `key` (or every key starting with it, if `is_prefix`) everywhere.
+        """
+
+
+class InProcessCacheBackend(CacheBackend):
+    """
+    Doesn't share anything, every worker only has its own in-process caches.
+
+    Good enough for a single worker (or local development).
+    """
+
+    name = "memory"
+
+    async def get(self, namespace: str, key: str) -> tuple[str, datetime | None] | None:
+        return None
+
+    async def set(
+        self, namespace: str, key: str, value: str, expires_at: datetime | None
+    ) -> None:
+        pass
+
+    async def delete(
+        self, namespace: str, key: str, *, is_prefix: bool = False
+    ) -> None:
+        pass
+
+
+class PostgresCacheBackend(CacheBackend):
+    """
+    Keeps cached items in an UNLOGGED postgres table, and uses LISTEN/NOTIFY to
+    tell every worker when something's been removed.
+
+    NOTE: LISTEN doesn't work through pgbouncer in transaction pooling mode (the
+          notifications go to whichever server connection it was sent on, not us), so
+          with `DB_PGBOUNCER` set the listener needs a direct url of its own in
+          `CACHE_LISTEN_DATABASE_URL`.
+    """
+
+    name = "postgres"
+
+    # How often expired rows get swept out of the table (piggybacked on writes)
+    sweep_interval: timedelta = timedelta(minutes=5)
+
+    # How often the listening connection gets checked on (in case it died without
+    # anyone telling us), and how long to wait between attempts to reconnect it
+    listen_check_interval: timedelta = timedelta(seconds=30)
+    reconnect_delay: timedelta = timedelta(seconds=5)
+
+    # A direct (not through pgbouncer) url to listen for invalidations on, otherwise
+    # the listener comes from the usual engine
+    listen_url: str | None
+
+    _listen_engine: AsyncEngine | None
+    _listen_connection: AsyncConnection | None
+    _listen_driver_connection: Any
+    _listener_lost: asyncio.Event
+    _watch_task: asyncio.Task | None
+    _next_sweep_at: datetime
+
+    def __init__(self) -> None:
+        self.listen_url = get_optional_env("CACHE_LISTEN_DATABASE_URL")
+
+        self._listen_engine = None
+        self._listen_connection = None
+        self._listen_driver_connection = None
+        self._listener_lost = asyncio.Event()
+        self._watch_task = None
+        self._next_sweep_at = datetime.now() + self.sweep_interval
+
+    async def start(self) -> None:
+        database = get_database_singleton()
+
+        if self.listen_url is not None:
+            # Only ever one connection at a time, so there's nothing to pool
+            self._listen_engine = create_async_engine(
+                self.listen_url, poolclass=NullPool
+            )
+        elif database.settings.pgbouncer:
+            # Everything would look like it works, but no invalidation would ever arrive
+            raise ValueError(
+                "Cannot start postgres cache backend: LISTEN doesn't work through "
+                "pgbouncer, set CACHE_LISTEN_DATABASE_URL to a direct database url"
+            )
+        else:
+            self._listen_engine = database.engine
+
+        await self._listen()
+
+        self._watch_task = asyncio.create_task(self._watch_listener())
+
+    async def close(self) -> None:
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+
+        await self._stop_listening()
+
+        # The listener's own engine (if it has one) isn't used by anything else
+        if self.listen_url is not None and self._listen_engine is not None:
+            await self._listen_engine.dispose()
+
+        self._listen_engine = None
+
+    async def _listen(self) -> None:
+        """
+        Checks out a connection that just sits there listening for invalidations.
+        """
+        engine = self._listen_engine
+
+        if engine is None:
+            raise ValueError(
+                "Cannot start postgres cache backend: database is not initialized"
+            )
+
+        self._listen_connection = await engine.connect()
+        raw_connection = await self._listen_connection.get_raw_connection()
+
+        # NOTE: Everything on this connection goes straight through the driver, since
+        #       SQLAlchemy would leave a transaction open on it.
+        self._listen_driver_connection = raw_connection.driver_connection
+        self._listen_driver_connection.add_termination_listener(self._on_termination)
+        await self._listen_driver_connection.add_listener(
+            INVALIDATION_CHANNEL, self._on_notification
+        )
+
+        self._listener_lost.clear()
+
+    async def _stop_listening(self) -> None:
+        connection = self._listen_connection
+        driver_connection = self._listen_driver_connection
+
+        if connection is None:
+            return
+
+        self._listen_connection = None
+        self._listen_driver_connection = None
+
+        # We're the ones closing it, this isn't the connection being lost
+        driver_connection.remove_termination_listener(self._on_termination)
+
+        try:
+            if driver_connection.is_closed():
+                # Make sure a dead connection never goes back into the pool
+                await connection.invalidate()
+            else:
+                await driver_connection.remove_listener(
+                    INVALIDATION_CHANNEL, self._on_notification
+                )
+                await connection.close()
+        except Exception:
+            LOGGER.exception("Failed to close the cache invalidation listener")
+
+    async def _watch_listener(self) -> None:
+        """
+        Reconnects the listening connection whenever it's lost, for as long as the
+        backend is running.
+
+        Any invalidations sent while it was gone are missed, so every worker's local
+        caches get emptied whenever that happens.
+        """
+        check_interval = self.listen_check_interval.total_seconds()
+
+        while True:
+            try:
+                await asyncio.wait_for(self._listener_lost.wait(), check_interval)
+            except TimeoutError:
+                # Connections can die without us finding out (e.g., the network going
+                # away), so make sure it still works every so often
+                try:
+                    await asyncio.wait_for(
+                        self._listen_driver_connection.execute("SELECT 1"),
+                        check_interval,
+                    )
+                    continue
+                except Exception:
+                    pass
+
+            LOGGER.error(
+                "Lost the cache invalidation listener, reconnecting... (nothing that's "
+                "cached locally can be trusted until it's back)"
+            )
+
+            # Nothing's going to tell us what's been invalidated until we're listening
+            # again, so don't hold on to anything until then
+            self.notify_subscribers(EVERYTHING)
+
+            await self._stop_listening()
+
+            while True:
+                try:
+                    await self._listen()
+                    break
+                except Exception:
+                    LOGGER.exception(
+                        "Failed to reconnect the cache invalidation listener"
+                    )
+                    await asyncio.sleep(self.reconnect_delay.total_seconds())
+
+            # ... and anything that was cached in between could already be out of date
+            self.notify_subscribers(EVERYTHING)
+
+            LOGGER.info("Cache invalidation listener reconnected")
+
+    def _on_termination(self, connection) -> None:
+        self._listener_lost.set()
+
+    def _on_notification(
+        self, connection, pid: int, channel: str, payload: str
+    ) -> None:
+        self.notify_subscribers(json.loads(payload))
+
+    async def get(self, namespace: str, key: str) -> tuple[str, datetime | None] | None:
+        stmt = (
+            select(SharedCacheEntry.value, SharedCacheEntry.expires_at)
+            .where(SharedCacheEntry.namespace == namespace)
+            .where(SharedCacheEntry.key == key)
+            .where(
+                or_(
+                    SharedCacheEntry.expires_at.is_(None),
+                    SharedCacheEntry.expires_at > datetime.now(),
+                )
+            )
+        )
+
+        async with get_connection() as connection:
+            row = (await connection.execute(stmt)).one_or_none()
+
+        if row is None:
+            return None
+
+        return row.value, row.expires_at
+
+    async def set(
+        self, namespace: str, key: str, value: str, expires_at: datetime | None
+    ) -> None:
+        stmt = insert(SharedCacheEntry).values(
+            namespace=namespace, key=key, value=value, expires_at=expires_at
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SharedCacheEntry.namespace, SharedCacheEntry.key],
+            set_={"value": stmt.excluded.value, "expires_at": stmt.excluded.expires_at},
+        )
+
+        now = datetime.now()
+
+        async with get_connection() as connection:
+            await connection.execute(stmt)
+
+            # Nobody's going to read the expired rows ever again, so get rid of them
+            if now >= self._next_sweep_at:
+                self._next_sweep_at = now + self.sweep_interval
+
+                await connection.execute(
+                    delete(SharedCacheEntry).where(SharedCacheEntry.expires_at <= now)
+                )
+
+    async def delete(
+        self, namespace: str, key: str, *, is_prefix: bool = False
+    ) -> None:
+        stmt = delete(SharedCacheEntry).where(SharedCacheEntry.namespace == namespace)
+
+        if is_prefix:
+            stmt = stmt.where(SharedCacheEntry.key.startswith(key, autoescape=True))
+        else:
+            stmt = stmt.where(SharedCacheEntry.key == key)
+
+        payload = json.dumps(
+            CacheInvalidation(namespace=namespace, key=key, is_prefix=is_prefix)
+        )
+
+        # The notification only goes out once the transaction commits, so nobody
+        # can go and re-read the row we're deleting from under us.
+        async with get_connection() as connection:
+            await connection.execute(stmt)
+            await connection.execute(
+                select(db_funcs.pg_notify(INVALIDATION_CHANNEL, payload))
+            )
+
+
+CACHE_BACKENDS: dict[str, type[CacheBackend]] = {
+    InProcessCacheBackend.name: InProcessCacheBackend,
+    PostgresCacheBackend.name: PostgresCacheBackend,
+}
+
+# What gets used if a backend was never started (e.g., in tests or scripts)
+DEFAULT_CACHE_BACKEND = InProcessCacheBackend()
+
+
+def get_cache_backend() -> CacheBackend:
+    return getattr(CacheBackend, "instance", DEFAULT_CACHE_BACKEND)
+
+
+async def start_cache_backend(name: str) -> None:
+    """
+    Starts the cache backend called `name` and makes every cache use it.
+    """
+
+    if hasattr(CacheBackend, "instance"):
+        raise ValueError("Cannot start cache backend: it's already started")
+
+    backend_cls = CACHE_BACKENDS.get(name)
+
+    if backend_cls is None:
+        raise ValueError(
+            f"Unknown cache backend `{name}`, expected one of: {', '.join(CACHE_BACKENDS)}"
+        )
+
+    LOGGER.info(f"Starting the `{name}` cache backend...")
+
+    backend = backend_cls()
+    await backend.start()
+
+    setattr(CacheBackend, "instance", backend)
+
+
+async def shutdown_cache_backend() -> None:
+    backend = getattr(CacheBackend, "instance", None)
+
+    if backend is None:
+        return
+
+    await backend.close()
+
+    delattr(CacheBackend, "instance")
+
+
+__all__ = [
+    "ALL_NAMESPACES",
+    "CacheBackend",
+    "CacheInvalidation",
+    "InProcessCacheBackend",
+    "PostgresCacheBackend",
+    "get_cache_backend",
+    "start_cache_backend",
+    "shutdown_cache_backend",
+]
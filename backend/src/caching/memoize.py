@@ -0,0 +1,170 @@
+from typing import Awaitable, Callable, Generic, ParamSpec, TypeVar, get_type_hints
+from datetime import timedelta
+from functools import update_wrapper
+
+from .shared import SharedCache, SharedCacheStats, pydantic_codec
+from ..utils.singleflight import SingleFlight
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+class MemoizedStats(SharedCacheStats):
+    hit_ratio: float
+    in_flight: int
+
+
+class Memoized(Generic[P, R]):
+    """
+    Wraps an async function so that its results are cached by argument for `ttl`.
+
+    Concurrent calls that miss on the same key are collapsed into a single call
+    of the wrapped function, everyone else just waits on its result.
+
+    Results are shared with the other workers through the cache backend (serialized
+    using the function's return annotation), and so are invalidations.
+
+    NOTE: A result of `None` is never cached, so functions that return None for
+    "not found" will get called again every time.
+    """
+
+    fn: Callable[P, Awaitable[R]]
+    key: Callable[P, str]
+    cache: SharedCache[R]
+
+    _flights: SingleFlight[str, R]
+
+    def __init__(
+        self,
+        fn: Callable[P, Awaitable[R]],
+        *,
+        ttl: timedelta,
+        max_size: int | None = None,
+        key: Callable[P, str] | None = None,
+        shared: bool = True,
+    ) -> None:
+        self.fn = fn
+        self.key = key or default_memoize_key
+
+        return_type = get_type_hints(fn).get("return")
+
+        self.cache = SharedCache(
+            f"{fn.__module__}.{fn.__qualname__}",
+            codec=pydantic_codec(return_type) if shared and return_type else None,
+            max_size=max_size,
+            default_ttl=ttl,
+        )
+
+        self._flights = SingleFlight()
+
+        update_wrapper(self, fn)
+
+    async def __call__(self, *args: P.args, **kwargs: P.kwargs) -> R:
+        key = self.key(*args, **kwargs)
+
+        cached = await self.cache.get(key)
+
+        if cached is not None:
+            return cached
+
+        async def load() -> R:
+            # If anything gets invalidated while we're loading (on any worker), our
+            # result could be out of date, so it shouldn't go into the cache.
+            generation = self.cache.generation
+
+            # Someone else may have filled this in while we were getting scheduled
+            if key in self.cache:
+                return self.cache.local.get(key)  # type: ignore[return-value]
+
+            result = await self.fn(*args, **kwargs)
+
+            if result is not None and generation == self.cache.generation:
+                await self.cache.add(key, result)
+
+            return result
+
+        return await self._flights.do(key, load)
+
+    async def refresh(self, *args: P.args, **kwargs: P.kwargs) -> R:
+        """
+        Calls the function right away (skipping the cache), and caches what it returns
+        in place of whatever was cached before. (on every worker)
+        """
+        key = self.key(*args, **kwargs)
+
+        # Anything that was already in flight is out of date now (removing the key
+        # makes sure it doesn't get cached)
+        await self.cache.remove(key)
+
+        result = await self.fn(*args, **kwargs)
+
+        if result is not None:
+            await self.cache.add(key, result)
+
+        return result
+
+    async def invalidate(self, key_prefix: str = "") -> int:
+        """
+        Drops every cached result whose key starts with `key_prefix` (or everything,
+        if no prefix is given) from every worker, and returns how many were dropped
+        from this one.
+        """
+        return await self.cache.remove_prefix(key_prefix)
+
+    def stats(self) -> MemoizedStats:
+        cache_stats = self.cache.stats()
+
+        # A miss locally that was a hit in the backend still saved us a call
+        hits = cache_stats["hits"] + cache_stats["shared_hits"]
+        lookups = cache_stats["hits"] + cache_stats["misses"]
+
+        return MemoizedStats(
+            **cache_stats,
+            hit_ratio=(hits / lookups) if lookups else 0.0,
+            in_flight=len(self._flights),
+        )
+
+
+# Every memoized function, by name, so their stats can be looked at in one place
+MEMOIZED_FUNCTIONS: dict[str, Memoized] = {}
+
+
+def default_memoize_key(*args, **kwargs) -> str:
+    """
+    Builds a cache key out of the string form of every argument.
+    """
+    parts = [str(a) for a in args]
+    parts.extend(f"{k}={v}" for k, v in sorted(kwargs.items()))
+
+    return ":".join(parts)
+
+
+def memoize(
+    *,
+    ttl: timedelta,
+    max_size: int | None = 1_000,
+    key: Callable[..., str] | None = None,
+    shared: bool = True,
+) -> Callable[[Callable[P, Awaitable[R]]], Memoized[P, R]]:
+    """
+    Decorator that memoizes an async function for `ttl`.
+
+    By default the key is made up of every argument, pass `key` to pick out the
+    ones that actually matter. (e.g., so a user's tokens don't end up in the key)
+    Keep whatever you want to invalidate by at the *start* of the key, since
+    `invalidate` works by key prefix.
+
+    Pass `shared=False` to keep results out of the cache backend. (they'll still be
+    invalidated across workers)
+    """
+
+    def decorator(fn: Callable[P, Awaitable[R]]) -> Memoized[P, R]:
+        memoized = Memoized(fn, ttl=ttl, max_size=max_size, key=key, shared=shared)
+        MEMOIZED_FUNCTIONS[f"{fn.__module__}.{fn.__qualname__}"] = memoized
+
+        return memoized
+
+    return decorator
+
+
+__all__ = ["memoize", "Memoized", "MemoizedStats", "MEMOIZED_FUNCTIONS"]
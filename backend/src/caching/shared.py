@@ -0,0 +1,236 @@
+from typing import Any, Callable, Generic, TypeVar
+from datetime import datetime, timedelta
+from logging import getLogger
+
+from pydantic import TypeAdapter
+
+from . import Cache, CacheStats
+from .backends import (
+    ALL_NAMESPACES,
+    CacheBackend,
+    CacheInvalidation,
+    get_cache_backend,
+)
+from ..utils import tokens as tokens_utils
+
+LOGGER = getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class CacheCodec(Generic[T]):
+    """
+    Turns cached items into strings (and back) so they can be stored in a
+    cache backend.
+    """
+
+    dumps: Callable[[T], str]
+    loads: Callable[[str], T]
+
+    def __init__(self, dumps: Callable[[T], str], loads: Callable[[str], T]) -> None:
+        self.dumps = dumps
+        self.loads = loads
+
+
+def pydantic_codec(type_: Any) -> CacheCodec:
+    """
+    A codec for anything pydantic knows how to (de)serialize. (models, UUIDs, lists of those, etc.)
+    """
+    adapter = TypeAdapter(type_)
+
+    return CacheCodec(
+        dumps=lambda item: adapter.dump_json(item).decode("utf-8"),
+        loads=adapter.validate_json,
+    )
+
+
+def encrypted_codec(codec: CacheCodec[T]) -> CacheCodec[T]:
+    """
+    Wraps another codec so that whatever gets put in the cache backend is encrypted.
+    Use this for anything secret (e.g., tokens)
+    """
+    return CacheCodec(
+        dumps=lambda item: tokens_utils.encrypt(codec.dumps(item)),
+        loads=lambda s: codec.loads(tokens_utils.decrypt(s)),
+    )
+
+
+class SharedCacheStats(CacheStats):
+    shared_hits: int
+    shared_misses: int
+
+
+# Every shared cache by namespace, so invalidations from other workers can be routed to them
+SHARED_CACHES: dict[str, "SharedCache"] = {}
+
+
+class SharedCache(Generic[T]):
+    """
+    An in-process LRU cache (see `Cache`) that sits in front of the configured
+    cache backend, so that items cached by one worker can be used by all of them.
+
+    Removing an item removes it from every worker. If `codec` is None, items are never
+    written to the backend, but removals still reach every worker.
+
+    If the backend has a problem, it's treated as a miss, since the cache being down
+    shouldn't take everything else down with it.
+    """
+
+    namespace: str
+    codec: CacheCodec[T] | None
+    local: Cache[T]
+
+    shared_hits: int
+    shared_misses: int
+
+    # Bumped whenever anything is removed (by us, or by another worker), so whoever is
+    # in the middle of loading an item can tell that it went out of date while they were.
+    generation: int
+
+    def __init__(
+        self,
+        namespace: str,
+        *,
+        codec: CacheCodec[T] | None = None,
+        max_size: int | None = None,
+        default_ttl: timedelta | None = None,
+    ) -> None:
+        if namespace in SHARED_CACHES:
+            raise ValueError(f"There is already a shared cache called `{namespace}`")
+
+        self.namespace = namespace
+        self.codec = codec
+        self.local = Cache(max_size=max_size, default_ttl=default_ttl)
+
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.generation = 0
+
+        SHARED_CACHES[namespace] = self
+
+    async def get(self, key: str) -> T | None:
+        item = self.local.get(key)
+
+        if item is not None or self.codec is None:
+            return item
+
+        try:
+            entry = await get_cache_backend().get(self.namespace, key)
+        except Exception:
+            LOGGER.exception(f"Failed to get `{key}` from the `{self.namespace}` cache")
+            entry = None
+
+        if entry is None:
+            self.shared_misses += 1
+            return None
+
+        value, expires_at = entry
+        item = self.codec.loads(value)
+
+        # Keep a copy of it here too, so next time we don't have to go to the backend
+        self.local.add(key, item, expires_at=expires_at)
+        self.shared_hits += 1
+
+        return item
+
+    async def add(
+        self,
+        key: str,
+        item: T,
+        *,
+        expires_at: datetime | None = None,
+        ttl: timedelta | None = None,
+    ) -> None:
+        # Work out the expiry here so the backend's copy expires at the same time
+        if expires_at is None:
+            ttl = ttl if ttl is not None else self.local.default_ttl
+            expires_at = (datetime.now() + ttl) if ttl is not None else None
+
+        self.local.add(key, item, expires_at=expires_at)
+
+        if self.codec is None:
+            return
+
+        try:
+            await get_cache_backend().set(
+                self.namespace, key, self.codec.dumps(item), expires_at
+            )
+        except Exception:
+            LOGGER.exception(f"Failed to add `{key}` to the `{self.namespace}` cache")
+
+    async def remove(self, key: str) -> None:
+        self.local.remove(key)
+
+        try:
+            await get_cache_backend().delete(self.namespace, key)
+        except Exception:
+            LOGGER.exception(
+                f"Failed to remove `{key}` from the `{self.namespace}` cache"
+            )
+
+    async def remove_prefix(self, prefix: str) -> int:
+        """
+        Removes every item whose key starts with `prefix` (from every worker), and
+        returns how many were removed from this one.
+        """
+        removed = self.remove_locally(prefix, is_prefix=True)
+
+        try:
+            await get_cache_backend().delete(self.namespace, prefix, is_prefix=True)
+        except Exception:
+            LOGGER.exception(
+                f"Failed to remove `{prefix}*` from the `{self.namespace}` cache"
+            )
+
+        return removed
+
+    def remove_locally(self, key: str, *, is_prefix: bool = False) -> int:
+        # Every removal ends up here, including the ones from other workers
+        self.generation += 1
+
+        if not is_prefix:
+            removed = int(key in self.local.cached_items)
+            self.local.remove(key)
+            return removed
+
+        # Collect the keys first, we can't delete from the dict while looping over it
+        keys = [k for k in self.local.cached_items if k.startswith(key)]
+
+        for k in keys:
+            self.local.remove(k)
+
+        return len(keys)
+
+    def stats(self) -> SharedCacheStats:
+        return SharedCacheStats(
+            **self.local.stats(),
+            shared_hits=self.shared_hits,
+            shared_misses=self.shared_misses,
+        )
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.local
+
+
+def _on_invalidation(invalidation: CacheInvalidation) -> None:
+    if invalidation["namespace"] == ALL_NAMESPACES:
+        caches = list(SHARED_CACHES.values())
+    else:
+        cache = SHARED_CACHES.get(invalidation["namespace"])
+        caches = [cache] if cache is not None else []
+
+    for cache in caches:
+        cache.remove_locally(invalidation["key"], is_prefix=invalidation["is_prefix"])
+
+
+CacheBackend.subscribe(_on_invalidation)
+
+
+__all__ = [
+    "CacheCodec",
+    "SharedCache",
+    "SharedCacheStats",
+    "SHARED_CACHES",
+    "pydantic_codec",
+    "encrypted_codec",
+]
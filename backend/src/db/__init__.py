@@ -1,5 +1,5 @@
 from contextlib import asynccontextmanager
-from typing import AsyncIterator
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
 import alembic.config
 import alembic.command
 from sqlalchemy.ext.asyncio import (
@@ -12,9 +12,15 @@ from sqlalchemy.ext.asyncio import (
 from logging import getLogger
 
 from . import models
+from sqlalchemy.exc import DBAPIError
+
+from .pool import DatabaseEngineSettings, DatabasePoolStats, InstrumentedAsyncPool
+from .replica import ReadReplica, ReplicaStats, is_connection_error
 
 LOGGER = getLogger(__name__)
 
+T = TypeVar("T")
+
 #
 #       DATABASE ENGINE SINGLETON WRAPPER THINGY
 #
@@ -28,17 +34,31 @@ class DatabaseSingleton(object):
 
     engine: AsyncEngine | None
     sessionmaker: async_sessionmaker[AsyncSession] | None
+    settings: DatabaseEngineSettings
+    replica: ReadReplica | None
+
+    def __init__(
+        self,
+        db_url: str,
+        settings: DatabaseEngineSettings | None = None,
+        *,
+        replica_url: str | None = None,
+    ) -> None:
+        self.settings = settings or DatabaseEngineSettings.from_env()
 
-    def __init__(self, db_url: str) -> None:
         # Create the engine:
-        #   The engine is responsible for the connection to the database.
-        self.engine = create_async_engine(url=db_url)
+        #   The engine is responsible for the connection to the database. It also
+        #   holds the pool of connections, which is set up from the settings.
+        self.engine = create_async_engine(url=db_url, **self.settings.engine_kwargs())
 
         # Create the session maker:
         #   The session maker is responsible for creating individual sessions
         #   for transactions.
         self.sessionmaker = async_sessionmaker(bind=self.engine)
 
+        # The read replica (if there is one) gets its own engine and pool
+        self.replica = ReadReplica(replica_url, self.settings) if replica_url else None
+
     async def die(self) -> None:
         """
         Closes the connections and whatnot for the singleton.
@@ -61,6 +81,34 @@ class DatabaseSingleton(object):
         # Set the sessionmaker to none because it relies on the engine.
         self.sessionmaker = None
 
+        if self.replica is not None:
+            await self.replica.die()
+            self.replica = None
+
+    def pool_stats(self) -> DatabasePoolStats:
+        """
+        Returns how many connections are in use, and how long it's been taking
+        to get one out of the pool.
+        """
+        if self.engine is None:
+            raise ValueError("Failed to get pool stats: engine is not initialized")
+
+        pool = self.engine.sync_engine.pool
+
+        if not isinstance(pool, InstrumentedAsyncPool):
+            raise ValueError(
+                "Failed to get pool stats: engine isn't using an instrumented pool"
+            )
+
+        return pool.stats()
+
+    def replica_stats(self) -> ReplicaStats | None:
+        """
+        Returns how far behind the read replica is and its pool stats, or None
+        if there isn't a replica.
+        """
+        return None if self.replica is None else self.replica.stats()
+
     @asynccontextmanager
     async def connect(self) -> AsyncIterator[AsyncConnection]:
         """
@@ -107,6 +155,77 @@ class DatabaseSingleton(object):
             finally:
                 await session.close()
 
+    @asynccontextmanager
+    async def read_session(self) -> AsyncIterator[AsyncSession]:
+        """
+        Returns a context manager for an async db session that's only used for reading.
+
+        This goes to the read replica if there is one and it's caught up enough, otherwise
+        it goes to the primary like `.session` does.
+
+        NOTE: A write that was just made might not have made it to the replica yet, so
+              don't use this for anything that has to see its own writes.
+        """
+        replica = self.replica
+
+        if replica is None or not await replica.is_usable():
+            async with self.session() as session:
+                yield session
+
+            return
+
+        async with replica.sessionmaker.begin() as session:
+            try:
+                yield session
+            except (DBAPIError, OSError) as e:
+                await session.rollback()
+
+                # If the replica went away on us, stop using it until it's checked again
+                if is_connection_error(e):
+                    replica.mark_unavailable()
+
+                raise
+            except Exception as _:
+                await session.rollback()
+                raise
+            finally:
+                await session.close()
+
+    async def read(
+        self, fn: Callable[[AsyncSession], Awaitable[T]], *, primary: bool = False
+    ) -> T:
+        """
+        Runs `fn` in a read session (see `.read_session`) and returns what it returns.
+
+        If the replica goes away part way through, `fn` is run again on the primary,
+        so nobody gets an error just because the replica picked a bad time to go down.
+        Pass `primary` to skip the replica altogether.
+
+        NOTE: `fn` can be run twice, so it should only ever read.
+        """
+        replica = self.replica
+
+        if primary or replica is None or not await replica.is_usable():
+            async with self.session() as session:
+                return await fn(session)
+
+        try:
+            async with self.read_session() as session:
+                return await fn(session)
+        except (DBAPIError, OSError) as e:
+            # Anything else is a problem with the read itself, it'd fail on the primary too
+            if not is_connection_error(e):
+                raise
+
+            LOGGER.warning(
+                "Lost the read replica part way through a read, retrying it on the primary"
+            )
+
+            replica.mark_unavailable()
+
+            async with self.session() as session:
+                return await fn(session)
+
 
 def get_database_singleton() -> DatabaseSingleton:
     singleton = getattr(DatabaseSingleton, "instance", None)
@@ -122,9 +241,17 @@ def get_database_singleton() -> DatabaseSingleton:
 #
 
 
-def start_database_engine(*, db_url: str) -> None:
+def start_database_engine(
+    *,
+    db_url: str,
+    settings: DatabaseEngineSettings | None = None,
+    replica_url: str | None = None,
+) -> None:
     """
     Makes the database functional by creating the singleton wrapper.
+
+    If no `settings` are given, they're loaded from the environment. If a `replica_url`
+    is given, reads from `get_read_session()` can be sent to it.
     """
 
     LOGGER.info("Initializing database...")
@@ -134,7 +261,9 @@ def start_database_engine(*, db_url: str) -> None:
             "Cannot init database singleton: it's already initialized, what???"
         )
 
-    new_singleton = DatabaseSingleton(db_url=db_url)
+    new_singleton = DatabaseSingleton(
+        db_url=db_url, settings=settings, replica_url=replica_url
+    )
 
     setattr(DatabaseSingleton, "instance", new_singleton)
 
@@ -166,6 +295,24 @@ async def get_session() -> AsyncIterator[AsyncSession]:
         yield session
 
 
+@asynccontextmanager
+async def get_read_session() -> AsyncIterator[AsyncSession]:
+    """
+    Shorthand for get_database_singleton().read_session() context manager
+    """
+    async with get_database_singleton().read_session() as session:
+        yield session
+
+
+async def run_read(
+    fn: Callable[[AsyncSession], Awaitable[T]], *, primary: bool = False
+) -> T:
+    """
+    Shorthand for get_database_singleton().read(fn)
+    """
+    return await get_database_singleton().read(fn, primary=primary)
+
+
 @asynccontextmanager
 async def get_connection() -> AsyncIterator[AsyncConnection]:
     """
@@ -212,11 +359,14 @@ async def run_migrations() -> None:
 
 __all__ = [
     "DatabaseSingleton",
+    "DatabaseEngineSettings",
     "start_database_engine",
     "shutdown_database_engine",
     "get_database_singleton",
     "get_connection",
     "get_session",
+    "get_read_session",
+    "run_read",
     "run_migrations",
     "models",
 ]
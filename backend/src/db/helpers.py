@@ -1,13 +1,33 @@
 from datetime import datetime, timedelta, date
 from typing import AsyncGenerator, Literal, Union
 from uuid import UUID
-from sqlalchemy import and_, or_, select, asc
+from sqlalchemy import (
+    CTE,
+    ColumnElement,
+    Date,
+    DateTime,
+    Float,
+    FromClause,
+    String,
+    any_,
+    asc,
+    bindparam,
+    cast,
+    column,
+    literal,
+    select,
+    update,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm import joinedload
 from sqlalchemy import func as db_funcs
+from collections import defaultdict
 from logging import getLogger
+import asyncio
 
 from ..wakatime import (
     WakatimeStartEndTimeframe,
@@ -16,18 +36,40 @@ from ..wakatime import (
     WakatimeTimeframeType,
 )
 from ..wakatime import user as waka_user_funcs
+from ..wakatime.auth import refresh_access_token
 from ..wakatime import summaries
+from ..wakatime.ratelimit import request_priority, RequestPriority
 from ..utils import tokens as tokens_utils
+from ..utils.singleflight import SingleFlight
+from ..db import get_session
+from ..db.partitions import missing_partitions_are_fatal
+from ..db.staging import (
+    DURATION_STAGING_TABLE,
+    LANGUAGE_STAGING_TABLE,
+    copy_into_staging,
+    prepare_staging_tables,
+)
 from ..db.models import (
     OAuth2Credentials,
     WakatimeUserProfile,
     WakatimeDuration,
     WakatimeLanguageDuration,
+    WeeklyDurationRollup,
+    MonthlyDurationRollup,
+    WeeklyLanguageRollup,
 )
 
 OAUTH_EARLY_EXPIRY_DELTA = timedelta(minutes=5)
 DEFAULT_DURATION_REFRESH_THRESHOLD = timedelta(minutes=10)
 
+# How many chunks (ISO weeks) of a long recache can be fetched from wakatime at once
+MAX_CONCURRENT_RECACHE_CHUNKS = 4
+
+# How many users' credentials get loaded per query when looking up tokens in bulk,
+# and how many users' worth of tokens it takes before decryption is done in a thread
+CREDENTIAL_LOOKUP_BATCH_SIZE = 500
+THREADED_DECRYPTION_THRESHOLD = 64
+
 LOGGER = getLogger(__name__)
 
 
@@ -85,6 +127,138 @@ def is_oauth_expired(
     return is_expired
 
 
+# One refresh per user at a time, anyone else who needs the user's tokens refreshed
+# just waits on the one that's already happening.
+OAUTH_REFRESH_FLIGHTS: SingleFlight[UUID, tuple[WakatimeTokens, datetime]] = (
+    SingleFlight()
+)
+
+
+async def refresh_oauth_credentials(
+    user_id: UUID, *, pos_offset: timedelta = OAUTH_EARLY_EXPIRY_DELTA
+) -> tuple[WakatimeTokens, datetime]:
+    """
+    Refreshes the user's wakatime tokens if they expire within `pos_offset`, and returns
+    the (decrypted) tokens along with when they expire.
+
+    Concurrent calls for the same user are collapsed into one refresh. If another worker
+    refreshes the same tokens at the same time, whichever one saves theirs first wins
+    and everyone uses those.
+
+    Raises a ValueError if the user has no credentials or wakatime won't refresh them.
+    """
+    return await OAUTH_REFRESH_FLIGHTS.do(
+        user_id, lambda: _refresh_oauth_credentials(user_id, pos_offset=pos_offset)
+    )
+
+
+async def _refresh_oauth_credentials(
+    user_id: UUID, *, pos_offset: timedelta
+) -> tuple[WakatimeTokens, datetime]:
+    creds = await get_oauth_credentials(user_id)
+
+    if creds is None:
+        raise ValueError(f"User id {user_id} does not have wakatime credentials")
+
+    # Another worker might have refreshed them already
+    if not is_oauth_expired(creds, pos_offset=pos_offset):
+        return decrypt_oauth_credentials(creds), creds.expires_at
+
+    LOGGER.debug(f"Refreshing wakatime tokens for user: {user_id}")
+
+    # NOTE: Nothing is held open in the database while we wait on wakatime, which can
+    #       take a while. (e.g., if the rate limiter is backed up)
+    # NOTE: The refresh token is stored encrypted, wakatime needs the real thing
+    new_tokens = await refresh_access_token(tokens_utils.decrypt(creds.refresh_token))
+
+    if new_tokens.status_code >= 300:
+        # If another worker beat us to it, the refresh token we sent is used up already
+        current = await get_oauth_credentials(user_id)
+
+        if (
+            current is not None
+            and current.refresh_token != creds.refresh_token
+            and not is_oauth_expired(current, pos_offset=pos_offset)
+        ):
+            return decrypt_oauth_credentials(current), current.expires_at
+
+        raise ValueError(
+            f"Failed to refresh wakatime tokens for user id {user_id}: "
+            f"wakatime returned status {new_tokens.status_code}"
+        )
+
+    refreshed = new_tokens.unwrap()
+
+    # Only save the new tokens if nobody else has refreshed them since we read them,
+    # otherwise theirs are the ones everybody's using already
+    stmt = (
+        update(OAuth2Credentials)
+        .where(OAuth2Credentials.user_id == user_id)
+        .where(OAuth2Credentials.provider == "wakatime")
+        .where(OAuth2Credentials.refresh_token == creds.refresh_token)
+        .values(
+            access_token=tokens_utils.encrypt(refreshed["access_token"]),
+            refresh_token=tokens_utils.encrypt(refreshed["refresh_token"]),
+            expires_at=refreshed["expires_at"],
+            updated_at=datetime.now().replace(tzinfo=None),
+        )
+        .returning(OAuth2Credentials.user_id)
+    )
+
+    async with get_session() as session:
+        updated = await session.scalar(stmt)
+        await session.commit()
+
+    if updated is None:
+        LOGGER.info(
+            f"Wakatime tokens for user {user_id} were refreshed somewhere else first, "
+            "using those instead"
+        )
+
+        current = await get_oauth_credentials(user_id)
+
+        if current is None:
+            raise ValueError(f"User id {user_id} does not have wakatime credentials")
+
+        return decrypt_oauth_credentials(current), current.expires_at
+
+    tokens = WakatimeTokens(
+        user_id=user_id,
+        access_token=refreshed["access_token"],
+        refresh_token=refreshed["refresh_token"],
+    )
+
+    return tokens, refreshed["expires_at"]
+
+
+async def get_oauth_credentials(user_id: UUID) -> OAuth2Credentials | None:
+    """
+    Reads the user's (encrypted) wakatime credentials in a session of its own.
+    """
+    stmt = (
+        select(OAuth2Credentials)
+        .where(OAuth2Credentials.user_id == user_id)
+        .where(OAuth2Credentials.provider == "wakatime")
+    )
+
+    async with get_session() as session:
+        creds = await session.scalar(stmt)
+
+        # Keep it usable once the session's gone
+        if creds is not None:
+            session.expunge(creds)
+
+    return creds
+
+
+def decrypt_oauth_credentials(creds: OAuth2Credentials) -> WakatimeTokens:
+    return WakatimeTokens(
+        user_id=creds.user_id,
+        access_token=tokens_utils.decrypt(creds.access_token),
+        refresh_token=tokens_utils.decrypt(creds.refresh_token),
+    )
+
+
 async def recache_wakatime_profile(
     session: AsyncSession,
     tokens: WakatimeTokens,
@@ -126,6 +300,14 @@ async def recache_wakatime_profile(
             is_photo_public=user_resp.is_photo_public,
             email=user_resp.email,
             timezone=user_resp.timezone,
+            # Wakatime sends this in UTC, but everything else is stored in local time
+            last_heartbeat_at=(
+                datetime.fromisoformat(user_resp.last_heartbeat_at)
+                .astimezone()
+                .replace(tzinfo=None)
+                if user_resp.last_heartbeat_at
+                else None
+            ),
             last_cached_at=datetime.now(tz=None),
         )
     )
@@ -177,16 +359,293 @@ async def force_oauth_tokens_to_expire(
     user.expires_at = datetime.min
 
 
-async def update_user_durations(
-    session: AsyncSession,
-    tokens: WakatimeTokens,
-    summary: summaries.SummaryResponseModel,
-) -> list[WakatimeDuration]:
+def get_week_start(day: date) -> date:
     """
-    Pushes the summary data provided into the database for the provided user
+    Returns the monday of the (ISO) week that `day` is in.
+    """
+    return day - timedelta(days=day.weekday())
+
+
+def get_month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def truncate_date(field: Literal["week", "month"], day: ColumnElement[date]):
+    """
+    The SQL version of `get_week_start` and `get_month_start`.
+    """
+    return cast(db_funcs.date_trunc(field, day), Date)
+
+
+def build_rollup_delta_upsert(
+    model: type[WeeklyDurationRollup | MonthlyDurationRollup | WeeklyLanguageRollup],
+    user_id: UUID,
+    keys: dict[str, ColumnElement],
+    delta: ColumnElement[float],
+):
+    """
+    Builds an insert that sums up `delta` for each of the `keys` (e.g., each week), and
+    adds it on to whatever the rollup already has for it (or inserts it, if there's
+    nothing there yet).
+
+    Sums that come out to zero still get a row if there isn't one yet (e.g., a week
+    with no coding at all, which still gets ranked on the leaderboard), but rows that
+    are already there aren't touched for them.
+
+    Adding the difference (instead of overwriting with a fresh total) means we never
+    have to go back and re-sum the daily rows to keep a rollup up to date.
+    """
+    stmt = insert(model).from_select(
+        [*keys, "user_id", "total_seconds"],
+        select(
+            *keys.values(), literal(user_id, postgresql.UUID), db_funcs.sum(delta)
+        ).group_by(*keys.values()),
+    )
+
+    return stmt.on_conflict_do_update(
+        index_elements=list(model.__table__.primary_key.columns),
+        set_={"total_seconds": model.total_seconds + stmt.excluded.total_seconds},
+        where=stmt.excluded.total_seconds != 0,
+    )
+
+
+def unnest_incoming_rows(
+    duration_data: list[dict], language_breakdowns: list[dict]
+) -> tuple[CTE, CTE]:
+    """
+    Turns the rows being written into the (durations, languages) that
+    `build_duration_upsert_stmt` reads from.
+
+    The rows get passed in as one array per column, so the statement is the same no
+    matter how many days are being written. (so postgres only has to plan it once)
+    """
+    incoming_durations = (
+        select(
+            db_funcs.unnest(
+                bindparam(
+                    "dates", [d["date"] for d in duration_data], type_=ARRAY(Date)
+                ),
+                bindparam(
+                    "total_seconds",
+                    [d["total_seconds"] for d in duration_data],
+                    type_=ARRAY(Float),
+                ),
+            )
+            .table_valued(column("date", Date), column("total_seconds", Float))
+            .render_derived()
+        )
+    ).cte("incoming_durations")
+
+    incoming_languages = (
+        select(
+            db_funcs.unnest(
+                bindparam(
+                    "language_dates",
+                    [lang["date"] for lang in language_breakdowns],
+                    type_=ARRAY(Date),
+                ),
+                bindparam(
+                    "languages",
+                    [lang["language"] for lang in language_breakdowns],
+                    type_=ARRAY(String),
+                ),
+                bindparam(
+                    "language_total_seconds",
+                    [lang["total_seconds"] for lang in language_breakdowns],
+                    type_=ARRAY(Float),
+                ),
+            )
+            .table_valued(
+                column("date", Date),
+                column("language", String),
+                column("total_seconds", Float),
+            )
+            .render_derived()
+        )
+    ).cte("incoming_languages")
+
+    return incoming_durations, incoming_languages
+
+
+def build_duration_upsert_stmt(
+    user_id: UUID,
+    incoming_durations: FromClause,
+    incoming_languages: FromClause,
+    *,
+    start_date: date,
+    end_date: date,
+    include_languages: bool = True,
+):
+    """
+    Builds a single statement that upserts a user's durations and their language
+    breakdowns, and pushes whatever changed into the rollups. It selects each upserted
+    duration joined with its upserted languages (one row per language, ordered by date),
+    or just the durations if `include_languages` is False.
+
+    The incoming rows are read from `incoming_durations` (date, total_seconds) and
+    `incoming_languages` (date, language, total_seconds), which should only have days
+    between `start_date` and `end_date` (inclusive) in them. These can be anything with
+    those columns, e.g., `unnest_incoming_rows()` or the bulk ingestion staging tables.
+
+    NOTE: Every part of the statement sees the tables as they were *before* it ran, which
+          is how the old totals get read for the rollups. Nothing else can be allowed to
+          change this user's durations in the meantime, see `update_user_durations`.
     """
 
-    # Get the start and end dates for the provided summary
+    # What we had before this write, so we know how much each day changed by
+    old_durations = (
+        select(WakatimeDuration.date, WakatimeDuration.total_seconds)
+        .where(WakatimeDuration.user_id == user_id)
+        .where(WakatimeDuration.date.between(start_date, end_date))
+    ).cte("old_durations")
+
+    old_languages = (
+        select(
+            WakatimeLanguageDuration.date,
+            WakatimeLanguageDuration.language,
+            WakatimeLanguageDuration.total_seconds,
+        )
+        .join(WakatimeLanguageDuration.parent)
+        .where(WakatimeDuration.user_id == user_id)
+        .where(WakatimeLanguageDuration.date.between(start_date, end_date))
+    ).cte("old_languages")
+
+    duration_insert_stmt = insert(WakatimeDuration).from_select(
+        ["user_id", "date", "total_seconds", "last_cached_at"],
+        select(
+            literal(user_id, postgresql.UUID),
+            incoming_durations.c.date,
+            incoming_durations.c.total_seconds,
+            literal(datetime.now(tz=None), DateTime),
+        ),
+    )
+
+    # Adding on a conflict statement to make sure that we can call this function even
+    # if we already have data, we can just update it (this is important when the user
+    # queries the data for "today", as it should be updated, not ignored :/)
+    upserted_durations = (
+        duration_insert_stmt.on_conflict_do_update(
+            set_={
+                "total_seconds": duration_insert_stmt.excluded.total_seconds,
+                "last_cached_at": duration_insert_stmt.excluded.last_cached_at,
+            },
+            constraint="unique_date_user_id",
+        )
+        .returning(WakatimeDuration)
+        .cte("upserted_durations")
+    )
+
+    # The languages get their parent's id straight from the durations we just upserted
+    language_insert_stmt = insert(WakatimeLanguageDuration).from_select(
+        ["parent_id", "date", "language", "total_seconds"],
+        select(
+            upserted_durations.c.id,
+            incoming_languages.c.date,
+            incoming_languages.c.language,
+            incoming_languages.c.total_seconds,
+        ).join_from(
+            incoming_languages,
+            upserted_durations,
+            upserted_durations.c.date == incoming_languages.c.date,
+        ),
+    )
+
+    upserted_languages = (
+        language_insert_stmt.on_conflict_do_update(
+            set_={
+                "total_seconds": language_insert_stmt.excluded.total_seconds,
+            },
+            constraint="pk_parent_id_language",
+        )
+        .returning(WakatimeLanguageDuration)
+        .cte("upserted_languages")
+    )
+
+    duration_deltas = (
+        select(
+            incoming_durations.c.date,
+            (
+                incoming_durations.c.total_seconds
+                - db_funcs.coalesce(old_durations.c.total_seconds, 0)
+            ).label("delta"),
+        ).outerjoin_from(
+            incoming_durations,
+            old_durations,
+            old_durations.c.date == incoming_durations.c.date,
+        )
+    ).cte("duration_deltas")
+
+    language_deltas = (
+        select(
+            incoming_languages.c.date,
+            incoming_languages.c.language,
+            (
+                incoming_languages.c.total_seconds
+                - db_funcs.coalesce(old_languages.c.total_seconds, 0)
+            ).label("delta"),
+        ).outerjoin_from(
+            incoming_languages,
+            old_languages,
+            (old_languages.c.date == incoming_languages.c.date)
+            & (old_languages.c.language == incoming_languages.c.language),
+        )
+    ).cte("language_deltas")
+
+    # Nothing selects from these, but postgres still runs every insert in a WITH
+    rollup_upserts = [
+        build_rollup_delta_upsert(
+            WeeklyDurationRollup,
+            user_id,
+            {"week_start": truncate_date("week", duration_deltas.c.date)},
+            duration_deltas.c.delta,
+        ).cte("weekly_rollup_upserts"),
+        build_rollup_delta_upsert(
+            MonthlyDurationRollup,
+            user_id,
+            {"month_start": truncate_date("month", duration_deltas.c.date)},
+            duration_deltas.c.delta,
+        ).cte("monthly_rollup_upserts"),
+        build_rollup_delta_upsert(
+            WeeklyLanguageRollup,
+            user_id,
+            {
+                "week_start": truncate_date("week", language_deltas.c.date),
+                "language": language_deltas.c.language,
+            },
+            language_deltas.c.delta,
+        ).cte("weekly_language_rollup_upserts"),
+    ]
+
+    if not include_languages:
+        return (
+            select(upserted_durations)
+            .order_by(upserted_durations.c.date)
+            .add_cte(upserted_languages, *rollup_upserts)
+        )
+
+    return (
+        select(upserted_durations, upserted_languages)
+        .outerjoin_from(
+            upserted_durations,
+            upserted_languages,
+            upserted_languages.c.parent_id == upserted_durations.c.id,
+        )
+        .order_by(upserted_durations.c.date)
+        .add_cte(*rollup_upserts)
+    )
+
+
+def get_summary_days(summary: summaries.SummaryResponseType) -> list[date]:
+    """
+    Returns the date that each section of `summary.data` is for.
+    """
+
+    # Each day in the summary tells us which (local) date it is for, so we
+    # trust that whenever it's there.
+    if summary.data and all(section.range.date for section in summary.data):
+        return [date.fromisoformat(section.range.date) for section in summary.data]
+
+    # Otherwise, we work it out from the start and end of the whole summary
     start_date = datetime.strptime(summary.start, r"%Y-%m-%dT%H:%M:%SZ").date()
     end_date = datetime.strptime(summary.end, r"%Y-%m-%dT%H:%M:%SZ").date()
 
@@ -194,116 +653,219 @@ async def update_user_durations(
     date_diff = end_date - start_date
 
     # Then, generate an array of date objects
-    days = [start_date + (timedelta(days=1) * n) for n in range(date_diff.days)]
+    return [start_date + (timedelta(days=1) * n) for n in range(date_diff.days)]
 
-    # Then using that array of sorted date objects, and the sorted summary data,
-    # we zip() then, and iterate through them to build out the values for the
-    # top-most coding time duration model
-    duration_data = [
-        dict(
-            user_id=tokens["user_id"],
-            date=duration_date,
-            total_seconds=duration.grand_total.total_seconds,
-            last_cached_at=datetime.now(tz=None),
-        )
-        for duration_date, duration in zip(days, summary.data)
-    ]
+
+async def update_user_durations(
+    session: AsyncSession,
+    tokens: WakatimeTokens,
+    summary: summaries.SummaryResponseType,
+    *,
+    bulk: bool = False,
+) -> list[WakatimeDuration]:
+    """
+    Pushes the summary data provided into the database for the provided user
+
+    With `bulk`, the summary gets copied into staging tables and merged from there,
+    instead of being sent as one huge statement. That's only worth it for really big
+    summaries (e.g., a user's whole history being backfilled), and nothing in the app
+    sends those right now, so it's opt-in.
+
+    NOTE: In bulk mode, the languages *aren't* loaded onto the durations that get returned
+          (otherwise every single language row would end up in memory as well).
+
+    Raises a `MissingPartitionError` if any of the days don't have a partition to go in.
+    """
+
+    # Get the date of each day in the provided summary, then pair each one up with its
+    # section of the summary data
+    days = list(zip(get_summary_days(summary), summary.data))
 
     # If we didn't actually get any duration_data for the user (for instance, if they didnt
     # program that day) then we shouldnt try to add duration data.
     # This fixes that weird (null, null, null) pkey violation error
-    if len(duration_data) == 0:
+    if len(days) == 0:
         LOGGER.info(f"No duration data to add for user {tokens['user_id']}")
         return []
 
-    duration_insert_stmt = insert(WakatimeDuration).values(duration_data)
-
-    # Adding on a conflict statement to make sure that we can call this function even
-    # if we already have data, we can just update it (this is important when the user
-    # queries the data for "today", as it should be updated, not ignored :/)
-    duration_insert_stmt_with_conflict = duration_insert_stmt.on_conflict_do_update(
-        set_={
-            "total_seconds": duration_insert_stmt.excluded.total_seconds,
-            "last_cached_at": duration_insert_stmt.excluded.last_cached_at,
-        },
-        constraint="unique_date_user_id",
-    ).returning(WakatimeDuration)
+    user_id = tokens["user_id"]
+    start_date = min(day for day, _ in days)
+    end_date = max(day for day, _ in days)
 
-    # Get the new durations we just made, because we need the ids from them in order to assign the
-    # languages to their associated parent durations
-    new_durations = await session.scalars(duration_insert_stmt_with_conflict)
-    new_durations_sorted_by_date = sorted(
-        new_durations.all(), key=lambda d: d.date, reverse=False
+    # The rollups get the difference between the old and new totals added to them, so
+    # make sure nobody else changes this user's durations in between us reading the old
+    # totals and writing the new ones. (This is released when the transaction ends)
+    # NOTE: This has to be its own statement, the upsert can only see what was committed
+    #       before it started. (it also makes sure the transaction has started before
+    #       any staging tables get made)
+    await session.execute(
+        select(
+            db_funcs.pg_advisory_xact_lock(db_funcs.hashtextextended(str(user_id), 0))
+        )
     )
 
-    LOGGER.info(
-        f"Added new durations: {len(new_durations_sorted_by_date)} for user {tokens['user_id']}"
-    )
+    incoming_durations: FromClause
+    incoming_languages: FromClause
 
-    language_breakdowns = []
+    if bulk:
+        # The rows get streamed straight out of the summary and into the staging tables,
+        # so there's never a giant list of parameters (or a giant statement) in memory
+        connection = await session.connection()
 
-    for summary_section, duration_model in zip(
-        summary.data, new_durations_sorted_by_date
-    ):
-        language_breakdowns.extend(
+        await prepare_staging_tables(connection)
+        await copy_into_staging(
+            connection,
+            DURATION_STAGING_TABLE,
+            ((day, section.grand_total.total_seconds) for day, section in days),
+        )
+        await copy_into_staging(
+            connection,
+            LANGUAGE_STAGING_TABLE,
+            (
+                (day, lang.name, lang.total_seconds)
+                for day, section in days
+                for lang in section.languages
+            ),
+        )
+
+        incoming_durations = DURATION_STAGING_TABLE
+        incoming_languages = LANGUAGE_STAGING_TABLE
+    else:
+        # The languages find their parent by date, since the parent ids don't exist yet
+        incoming_durations, incoming_languages = unnest_incoming_rows(
             [
-                dict(
-                    parent_id=duration_model.id,
-                    language=lang.name,
-                    total_seconds=lang.total_seconds,
-                )
-                for lang in summary_section.languages
-            ]
+                dict(date=day, total_seconds=section.grand_total.total_seconds)
+                for day, section in days
+            ],
+            [
+                dict(date=day, language=lang.name, total_seconds=lang.total_seconds)
+                for day, section in days
+                for lang in section.languages
+            ],
         )
 
-    # Likewise, if there's no language breakdowns for the user, don't try and insert
-    # null data.
-    if len(language_breakdowns) == 0:
-        LOGGER.info(f"No language breakdowns to add for user {tokens['user_id']}")
-        return new_durations_sorted_by_date
+    # Everything else happens in one go, see `build_duration_upsert_stmt`.
+    # (the durations may already be loaded in the session, so they need to be refreshed)
+    upsert_stmt = build_duration_upsert_stmt(
+        user_id,
+        incoming_durations,
+        incoming_languages,
+        start_date=start_date,
+        end_date=end_date,
+        include_languages=not bulk,
+    )
 
-    language_insert_stmt = insert(WakatimeLanguageDuration).values(language_breakdowns)
+    if bulk:
+        with missing_partitions_are_fatal(start_date, end_date):
+            new_bulk_durations = (
+                await session.scalars(
+                    select(WakatimeDuration)
+                    .from_statement(upsert_stmt)
+                    .execution_options(populate_existing=True)
+                )
+            ).all()
 
-    language_insert_stmt_with_conflict = language_insert_stmt.on_conflict_do_update(
-        set_={
-            "total_seconds": language_insert_stmt.excluded.total_seconds,
-        },
-        constraint="pk_parent_id_language",
-    ).returning(WakatimeLanguageDuration)
+        LOGGER.info(
+            f"Bulk ingested new durations: {len(new_bulk_durations)} "
+            f"for user {tokens['user_id']}"
+        )
 
-    new_language_durations = (
-        await session.scalars(language_insert_stmt_with_conflict)
-    ).all()
+        return list(new_bulk_durations)
 
-    LOGGER.info(
-        f"Added new language breakdowns: {len(new_language_durations)} for user {tokens['user_id']}"
+    with missing_partitions_are_fatal(start_date, end_date):
+        upserted_rows = await session.execute(
+            select(WakatimeDuration, WakatimeLanguageDuration)
+            .from_statement(upsert_stmt)
+            .execution_options(populate_existing=True)
+        )
+
+    # We get a row for each language, so group them back up under their parent durations
+    new_durations: dict[int, WakatimeDuration] = {}
+    languages_grouped_by_parent: dict[int, list[WakatimeLanguageDuration]] = (
+        defaultdict(list)
     )
 
-    # This nonsense takes the newly created and returned `WakatimeLanguageDuration` objects and
-    # groups them based on their parent.
-    languages_grouped_by_parent = {}
-    for lang_duration in new_language_durations:
-        pid = lang_duration.parent_id
+    for duration, lang_duration in upserted_rows:
+        new_durations[duration.id] = duration
 
-        if pid not in languages_grouped_by_parent:
-            languages_grouped_by_parent[pid] = []
+        if lang_duration is not None:
+            languages_grouped_by_parent[duration.id].append(lang_duration)
 
-        languages_grouped_by_parent[pid].append(lang_duration)
+    LOGGER.info(
+        f"Added new durations: {len(new_durations)} and language breakdowns: "
+        f"{sum(len(langs) for langs in languages_grouped_by_parent.values())} "
+        f"for user {tokens['user_id']}"
+    )
 
     # We use the grouped durations to propogate the "languages" relationship in the parent model,
     # which saves us manually querying the languages again for every single new parent duration
     # we just created (We literally just made the data, just return it lol)
-    for duration in new_durations_sorted_by_date:
+    for duration in new_durations.values():
         set_committed_value(
             duration, "languages", languages_grouped_by_parent.get(duration.id, [])
         )
 
     # Now hopefully, SQLAlchemy's stupid lifetime bs with the sessions or whatever don't completely
     # mangle the new durations I'm returning, just let me use them PLEASE
-    return new_durations_sorted_by_date
+    # (these are already sorted by date, since the upsert orders them)
+    return list(new_durations.values())
 
 
-DurationRecacheType = tuple[date, date] | None
+# A list of inclusive (start, end) ranges of days that need to be recached
+DurationRecacheType = list[tuple[date, date]]
+
+
+def group_into_date_ranges(days: list[date]) -> DurationRecacheType:
+    """
+    Groups a sorted list of days into inclusive (start, end) ranges of
+    consecutive days.
+
+    e.g., [Mon, Tue, Thu] -> [(Mon, Tue), (Thu, Thu)]
+    """
+    ranges: DurationRecacheType = []
+
+    for day in days:
+        # If this day carries on from the end of the last range, stretch that range
+        if ranges and ranges[-1][1] + timedelta(days=1) == day:
+            ranges[-1] = (ranges[-1][0], day)
+        else:
+            ranges.append((day, day))
+
+    return ranges
+
+
+def select_user_durations(
+    user_id: UUID,
+    start_date: date,
+    end_date: date,
+    *,
+    eager_load: bool = False,
+    populate_existing: bool = False,
+):
+    """
+    Builds a statement which selects a user's durations between the start and end
+    dates (inclusive), ordered by date.
+
+    `populate_existing` should be set when the durations may already be loaded in
+    the session, otherwise SQLAlchemy will hand back the old (stale) objects.
+    """
+
+    stmt = (
+        select(WakatimeDuration)
+        .where(WakatimeDuration.user_id == user_id)
+        .where(WakatimeDuration.date >= start_date)
+        .where(WakatimeDuration.date <= end_date)
+        .order_by(asc(WakatimeDuration.date))
+    )
+
+    # If the eager load kwarg is true then we also load `WakatimeDuration.languages` here
+    if eager_load:
+        stmt = stmt.options(joinedload(WakatimeDuration.languages))
+
+    if populate_existing:
+        stmt = stmt.execution_options(populate_existing=True)
+
+    return stmt
 
 
 async def get_cached_user_durations(
@@ -325,18 +887,10 @@ async def get_cached_user_durations(
         start_date = datetime.strptime(duration_timeframe.start, r"%Y-%m-%d").date()
         end_date = datetime.strptime(duration_timeframe.end, r"%Y-%m-%d").date()
 
-        stmt = (
-            select(WakatimeDuration)
-            .where(WakatimeDuration.user_id == user_id)
-            .where(WakatimeDuration.date >= start_date)
-            .where(WakatimeDuration.date <= end_date)
-            .order_by(asc(WakatimeDuration.date))
+        stmt = select_user_durations(
+            user_id, start_date, end_date, eager_load=eager_load
         )
 
-        # If the eager load kwarg is true then we also load `WakatimeDuration.languages` here
-        if eager_load:
-            stmt = stmt.options(joinedload(WakatimeDuration.languages))
-
     elif isinstance(duration_timeframe, WakatimeRangeTimeframe):
         # We probably will never use this function for this :/
         raise NotImplementedError(
@@ -362,10 +916,9 @@ async def get_cached_user_durations(
     else:
         max_day_count = (end_date - start_date).days + 1
 
-    # NOTE: I know, this is gross.
-    # A tuple representing a bool (if a recache is needed), and a tuple
-    # denoting the inclusive range of days (start/end)
-    needs_recache = None
+    # Every run of consecutive days that we're missing (or that are stale),
+    # an empty list means we have everything.
+    needs_recache: DurationRecacheType = []
 
     # We need a recache if either:
     # * The number of days for which we have durations for does not match the number of
@@ -391,70 +944,34 @@ async def get_cached_user_durations(
             f"Days needing recaching: {len(days_needing_recaching)} vs not: {len(days_not_needing_recaching)}"
         )
 
-        # Sanity check, we dont need to return a timeframe if there are no
-        # days to recache in the array.
-        if days_needing_recaching:
-            # Get the min and max values for the dates which need recaching
-            recache_start_date = min(days_needing_recaching)
-            recache_end_date = max(days_needing_recaching)
-
-            needs_recache = (recache_start_date, recache_end_date)
+        # Only the gaps get recached, so if we're only missing monday and today
+        # we don't end up pulling (and rewriting) the whole week.
+        needs_recache = group_into_date_ranges(days_needing_recaching)
 
     return (list(durations), needs_recache)
 
 
-# TODO: find a more appropriate name for this function
-# It literally does so many things
-async def evil_duration_fetching_function(
-    session: AsyncSession,
-    tokens: WakatimeTokens,
-    timeframe: WakatimeStartEndTimeframe,
-    *,
-    today_refresh_threshold: timedelta | None = DEFAULT_DURATION_REFRESH_THRESHOLD,
-) -> list[WakatimeDuration]:
+async def recache_user_durations(
+    tokens: WakatimeTokens, start_date: date, end_date: date
+) -> None:
     """
-    This is the evil duration fetching function.
+    Pulls the user's durations between the start and end dates (inclusive) from
+    wakatime, and pushes them into the database.
 
-    It tries to fetch all the durations within the timeframe provided from
-    the database. If it can't, it will try to query wakatime and stitch together
-    what exists of the pre-existing duration data with the new duration data in
-    order to fulfill the request of the timeframe provided.
+    This uses its own session and commits on its own, because its result gets
+    shared between everybody waiting on the same recache (see
+    `recache_user_durations_once()`).
 
-    This function will also attempt to update "today" if it has not been refreshed
-    in the last `today_refresh_threshold` delta.
+    NOTE: This means a request that triggers a recache checks out another connection
+          (one per chunk being written) on top of its own request session.
     """
 
-    # We gather what information we currently have in the database
-    # This function also returns the smallest range of what we *don't* have
-    cached_durations, needs_recache = await get_cached_user_durations(
-        session=session,
-        duration_timeframe=timeframe,
-        user_id=tokens["user_id"],
-        eager_load=True,
-    )
-
-    # If we don't need a recache, then we have all of the data.
-    # We can just end the function here
-    if needs_recache is None:
-        return cached_durations
-
-    LOGGER.debug(
-        f"User {tokens['user_id']} needs recache of durations between {timeframe.start}-{timeframe.end}..."
-    )
-
-    # Unpack the tuple given to us when needs_recache is non-null.
-    recache_start, recache_end = needs_recache
-
-    # Then, take those values and pipe them into a timeframe object
-    # to pass throughout other functions
     recache_timeframe = WakatimeStartEndTimeframe(
-        start=recache_start.strftime(r"%Y-%m-%d"), end=recache_end.strftime(r"%Y-%m-%d")
+        start=start_date.strftime(r"%Y-%m-%d"), end=end_date.strftime(r"%Y-%m-%d")
     )
 
-    # Now we grab all the durations within the recache timeframe,
-    # this should "complete" the data for the originally requested
-    # `timeframe`.
-    new_summary_resp = await summaries.get_summaries(
+    # We only need the fields that get stored, so use the lean parser
+    new_summary_resp = await summaries.get_lean_summaries(
         tokens=tokens, user="current", timeframe=recache_timeframe
     )
 
@@ -463,116 +980,266 @@ async def evil_duration_fetching_function(
     if new_summary_resp.status_code != 200:
         raise ValueError("Failed to get durations")
 
-    # Otherwise, we can continue by pushing the new durations into the
-    # database.
     # NOTE: We can call ".unwrap()" here because if the status code was 200
     # then we must have a valid response.
-    new_durations = await update_user_durations(
-        session=session, tokens=tokens, summary=new_summary_resp.unwrap()
-    )
+    async with get_session() as session:
+        new_durations = await update_user_durations(
+            session=session, tokens=tokens, summary=new_summary_resp.unwrap()
+        )
+
+        await session.commit()
 
     LOGGER.debug(
         f"Successfully recached {len(new_durations)} for user {tokens['user_id']}!"
     )
 
-    today = date.today()
 
-    # Now we need to build a complete replacement for `cached_durations`
-    # incorporating the data from `new_durations` (ugh)
-    tmp_cached_durations = []
-
-    # Get the number of days that the original timeframe contains
-    max_days_in_week = timeframe.get_days_inclusive()
-
-    # If the timeframe includes today, that means we likely do not have a
-    # full week's worth of data, so we need to figure out the difference
-    # between the original timeframe's start and today (plus 1 to include today)
-    if timeframe.includes_date(today):
-        max_days_in_week = (today - timeframe.start_date).days + 1
-
-    # This while-loop builds a new `cached_durations` by doing some weird
-    # indexing nonsense and figuring out which date comes "next" while prioritizing
-    # the new durations over the old
-    # Assume:
-    # * Xn == Yn == None is impossible
-    # * Yn is always prioritized (most recent data)
-    xn, yn = 0, 0
-    while len(tmp_cached_durations) < max_days_in_week:
-        # These should both be sorted.
-        duration_y = new_durations[yn]
-        duration_x = None if xn >= len(cached_durations) else cached_durations[xn]
-
-        if duration_x is not None and duration_x.date < duration_y.date:
-            xn += 1
-            tmp_cached_durations.append(duration_x)
-        else:
-            yn += 1
-            tmp_cached_durations.append(duration_y)
+# Every recache that is currently running, keyed by (user_id, start_date, end_date)
+DURATION_RECACHE_FLIGHTS: SingleFlight[tuple[UUID, date, date], None] = SingleFlight()
+
+
+def subtract_date_range(
+    date_range: tuple[date, date], others: list[tuple[date, date]]
+) -> list[tuple[date, date]]:
+    """
+    Returns what is left of the inclusive `date_range` once every (inclusive)
+    range in `others` has been cut out of it.
+    """
+    remaining = [date_range]
+
+    for other_start, other_end in others:
+        next_remaining = []
+
+        for start, end in remaining:
+            # No overlap, nothing to cut out
+            if other_end < start or other_start > end:
+                next_remaining.append((start, end))
+                continue
+
+            # Keep whatever hangs off either side of the overlap
+            if start < other_start:
+                next_remaining.append((start, other_start - timedelta(days=1)))
+            if end > other_end:
+                next_remaining.append((other_end + timedelta(days=1), end))
+
+        remaining = next_remaining
 
-    # We return the newly built tmp_cached_durations
-    return tmp_cached_durations
+    return remaining
 
 
-async def get_user_ids_with_incomplete_durations(
+def split_into_iso_weeks(start_date: date, end_date: date) -> DurationRecacheType:
+    """
+    Splits the inclusive range of days into chunks that each sit inside of a
+    single ISO week (monday to sunday).
+    """
+    chunks: DurationRecacheType = []
+    chunk_start = start_date
+
+    while chunk_start <= end_date:
+        # weekday() is 0 for monday and 6 for sunday
+        end_of_week = chunk_start + timedelta(days=6 - chunk_start.weekday())
+        chunk_end = min(end_of_week, end_date)
+
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end + timedelta(days=1)
+
+    return chunks
+
+
+async def recache_user_durations_once(
+    tokens: WakatimeTokens, date_ranges: DurationRecacheType
+) -> None:
+    """
+    Recaches the user's durations for each of the inclusive (start, end) date ranges,
+    without doubling up on work that's already happening.
+
+    Any part of a range that is already being recached for the user (e.g., the
+    home screen asking for the day and the week at the same time, or the leaderboard
+    job refreshing them) is waited on instead of fetched again, and only what's left
+    over is fetched from wakatime.
+
+    What's left over is fetched one ISO week at a time, with up to
+    `MAX_CONCURRENT_RECACHE_CHUNKS` weeks being fetched at once. Each week gets pushed
+    into the database as soon as it arrives, so long ranges don't end up stuck
+    behind one giant (or one slow) request.
+    """
+    user_id = tokens["user_id"]
+
+    # Find everything that's already in flight for this user and overlaps with our ranges
+    overlapping = [
+        ((flight_start, flight_end), task)
+        for (flight_user_id, flight_start, flight_end), task in list(
+            DURATION_RECACHE_FLIGHTS.items()
+        )
+        if flight_user_id == user_id
+        and any(
+            flight_start <= end_date and flight_end >= start_date
+            for start_date, end_date in date_ranges
+        )
+    ]
+
+    # Then we figure out the bits that nobody is fetching yet, and break them up into weeks
+    chunks = [
+        chunk
+        for date_range in date_ranges
+        for leftover_start, leftover_end in subtract_date_range(
+            date_range, [flight_range for flight_range, _ in overlapping]
+        )
+        for chunk in split_into_iso_weeks(leftover_start, leftover_end)
+    ]
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_RECACHE_CHUNKS)
+
+    async def recache_chunk(chunk_start: date, chunk_end: date) -> None:
+        async with semaphore:
+            await recache_user_durations(tokens, chunk_start, chunk_end)
+
+    waiting_on = [task for _, task in overlapping] + [
+        DURATION_RECACHE_FLIGHTS.start(
+            (user_id, chunk_start, chunk_end),
+            lambda s=chunk_start, e=chunk_end: recache_chunk(s, e),
+        )
+        for chunk_start, chunk_end in chunks
+    ]
+
+    LOGGER.debug(
+        f"User {user_id} joined {len(overlapping)} in-flight recache(s), starting {len(chunks)} more"
+    )
+
+    # Shielded so that if we get cancelled, whoever else is waiting still gets their data
+    await asyncio.shield(asyncio.gather(*waiting_on))
+
+
+# Today-refreshes that are happening in the background, keyed by user id
+BACKGROUND_TODAY_REFRESHES: SingleFlight[UUID, None] = SingleFlight()
+
+
+def schedule_background_today_refresh(tokens: WakatimeTokens) -> None:
+    """
+    Starts recaching the user's durations for today in the background, unless
+    that's already happening for the user.
+    """
+
+    async def refresh_today() -> None:
+        today = date.today()
+
+        # Nobody is sitting there waiting on this, so let requests that
+        # do have someone waiting go first
+        with request_priority(RequestPriority.BACKGROUND):
+            try:
+                await recache_user_durations_once(tokens, [(today, today)])
+            except Exception:
+                LOGGER.exception(
+                    f"Background refresh of today's durations failed for user {tokens['user_id']}"
+                )
+
+    BACKGROUND_TODAY_REFRESHES.start(tokens["user_id"], refresh_today)
+
+
+def is_duration_stale(
+    duration: WakatimeDuration,
+    *,
+    today_refresh_threshold: timedelta | None = DEFAULT_DURATION_REFRESH_THRESHOLD,
+) -> bool:
+    """
+    Returns whether the duration is for today, and hasn't been refreshed
+    within the `today_refresh_threshold`.
+    """
+    if today_refresh_threshold is None:
+        today_refresh_threshold = timedelta(seconds=0)
+
+    now = datetime.now(tz=None)
+
+    return (
+        duration.date == now.date()
+        and duration.last_cached_at + today_refresh_threshold <= now
+    )
+
+
+# TODO: find a more appropriate name for this function
+# It literally does so many things
+async def evil_duration_fetching_function(
     session: AsyncSession,
+    tokens: WakatimeTokens,
     timeframe: WakatimeStartEndTimeframe,
     *,
-    incomplete_today_check: bool = False,
     today_refresh_threshold: timedelta | None = DEFAULT_DURATION_REFRESH_THRESHOLD,
-) -> list[UUID]:
+    stale_while_revalidate: bool = False,
+) -> list[WakatimeDuration]:
     """
-    Returns a list of all the user uuids which do not have complete
-    duration data for the given start/end timeframe
+    This is the evil duration fetching function.
+
+    It tries to fetch all the durations within the timeframe provided from
+    the database. If it can't, it will query wakatime for what's missing, push
+    that into the database and then hand back the complete set of durations for
+    the timeframe provided.
+
+    This function will also attempt to update "today" if it has not been refreshed
+    in the last `today_refresh_threshold` delta.
+
+    Concurrent calls for the same user share a single wakatime fetch (and upsert)
+    for any days they have in common.
+
+    If `stale_while_revalidate` is true and we already have *something* cached for
+    today, the cached (stale) version of today is returned straight away and the
+    refresh happens in the background instead (use `is_duration_stale()` to tell).
+    Days we don't have at all are still fetched before returning.
     """
 
-    where_clause = WakatimeDuration.date.between(
-        timeframe.start_date, timeframe.end_date
+    # We gather what information we currently have in the database
+    # This function also returns the ranges of days that we *don't* have
+    cached_durations, needs_recache = await get_cached_user_durations(
+        session=session,
+        duration_timeframe=timeframe,
+        user_id=tokens["user_id"],
+        eager_load=True,
+        today_refresh_threshold=today_refresh_threshold,
     )
 
-    # If we need to check if "today" is incomplete, we must first check that we actually need to...
-    # (tf includes today?)
-    if incomplete_today_check and timeframe.includes_date(date.today()):
-        # If it includes today, then we must only need to cache up to today,
-        # so we modify the timeframe to reflect that
-        timeframe = WakatimeStartEndTimeframe(
-            start=timeframe.start_date.strftime(r"%Y-%m-%d"),
-            end=date.today().strftime(r"%Y-%m-%d"),
-        )
+    today = date.today()
 
-        # We then modify the where_clause to include durations which:
-        # 1. Are between the start and end dates (inclusive)
-        # 2. Either isn't today or if it was today, was cached within
-        #    the threshold provided in args
-        where_clause = and_(
-            WakatimeDuration.date.between(timeframe.start_date, timeframe.end_date),
-            or_(
-                WakatimeDuration.date != timeframe.end_date,
-                WakatimeDuration.last_cached_at + today_refresh_threshold
-                > datetime.now(),
-            ),
-        )
+    # If the only problem with today is that it's a bit old, we can hand back what we
+    # have and let the refresh happen in the background.
+    if (
+        stale_while_revalidate
+        and any(start <= today <= end for start, end in needs_recache)
+        and any(d.date == today for d in cached_durations)
+    ):
+        schedule_background_today_refresh(tokens)
 
-    # Get the number of days included within the timeframe
-    timeframe_day_span = timeframe.get_days_inclusive()
+        needs_recache = [
+            leftover
+            for date_range in needs_recache
+            for leftover in subtract_date_range(date_range, [(today, today)])
+        ]
 
-    # The breakdown of this query goes as follows:
-    # 1. Fetch the user ids ...
-    # 2. Where the date is between the start and end timeframe dates ...
-    # 3. Grouped by user ids (so we can perform an aggregate function) ...
-    # 4. Where a user_id is associated with less than the required number
-    #    of days within the provided timeframe. (count() is the agg. func.)
-    stmt = (
-        select(WakatimeDuration.user_id)
-        .where(where_clause)
-        .group_by(WakatimeDuration.user_id)
-        .having(db_funcs.count() < timeframe_day_span)
+    # If we don't need a recache, then we have all of the data.
+    # We can just end the function here
+    if not needs_recache:
+        return cached_durations
+
+    LOGGER.debug(
+        f"User {tokens['user_id']} needs recache of {len(needs_recache)} range(s) of durations between {timeframe.start}-{timeframe.end}..."
     )
 
-    # Fetch those user ids ...
-    user_ids = await session.scalars(stmt)
+    # Pull each of the missing ranges into the database (or wait for whoever is
+    # already doing that). The ranges are fetched in parallel, a week at a time, and
+    # the wakatime client's rate limiter keeps this from turning into a flood of requests.
+    await recache_user_durations_once(tokens, needs_recache)
+
+    # ... and then read the whole timeframe back out. `populate_existing` makes sure
+    # we don't get handed back the stale durations we loaded above.
+    refreshed_durations = await session.scalars(
+        select_user_durations(
+            tokens["user_id"],
+            timeframe.start_date,
+            timeframe.end_date,
+            eager_load=True,
+            populate_existing=True,
+        )
+    )
 
-    # Return them.
-    return list(user_ids.all())
+    return list(refreshed_durations.unique().all())
 
 
 async def wakatime_token_lookup_generator(
@@ -581,60 +1248,118 @@ async def wakatime_token_lookup_generator(
     *,
     skip_missing_credentials: bool = False,
     expired_oauth_behaviour: Literal["skip", "error", "refresh"] = "error",
+    batch_size: int = CREDENTIAL_LOOKUP_BATCH_SIZE,
 ) -> AsyncGenerator[WakatimeTokens, None]:
     """
     A generator which yields wakatime tokens retrieved from the database
     for the provided user UUIDs.
+
+    Credentials are loaded `batch_size` users at a time, and each batch is yielded
+    as soon as it's loaded, so whoever's using the tokens can get started before
+    everyone's credentials have been loaded.
     """
-    # This is probably such a stupidly excessive way to do this.
 
-    for uuid in user_ids:
-        creds = await session.get(OAuth2Credentials, (uuid, "wakatime"))
+    for i in range(0, len(user_ids), batch_size):
+        batch = user_ids[i : i + batch_size]
 
-        # If we don't get any credentials back from the database
-        if creds is None:
-            # Throw an error if we aren't just skipping these problems.
-            if not skip_missing_credentials:
-                raise ValueError(
-                    f"User id {uuid} does not have wakatime credentials in the database."
-                )
+        # Grab the whole batch's credentials in one go
+        stmt = (
+            select(OAuth2Credentials)
+            .where(OAuth2Credentials.provider == "wakatime")
+            .where(
+                OAuth2Credentials.user_id
+                == any_(bindparam("user_ids", batch, type_=ARRAY(postgresql.UUID)))
+            )
+        )
 
-            # If we *are* just skipping these problems, then we can just go to
-            # the next iteration
-            continue
-
-        # Next, check that the tokens are actually valid (by expiry time)
-        if is_oauth_expired(creds):
-            # If they are expired, then we either throw an error, skip this user, or
-            # trigger a refresh for the user's tokens.
-            if expired_oauth_behaviour == "error":
-                raise ValueError(
-                    f"User id {uuid} has expired credentials, and we're not refreshing them!"
-                )
+        creds_by_user = {creds.user_id: creds for creds in await session.scalars(stmt)}
+
+        # Credentials that are still good, and everyone we'll be handing back tokens for
+        # (in the same order as `user_ids`, including anyone who needs a refresh first)
+        valid_creds: list[OAuth2Credentials] = []
+        yield_order: list[UUID] = []
+
+        for uuid in batch:
+            creds = creds_by_user.get(uuid)
 
-            # TODO: Refresh them
-            elif expired_oauth_behaviour == "refresh":
-                raise NotImplementedError()
+            # If we don't get any credentials back from the database
+            if creds is None:
+                # Throw an error if we aren't just skipping these problems.
+                if not skip_missing_credentials:
+                    raise ValueError(
+                        f"User id {uuid} does not have wakatime credentials in the database."
+                    )
 
-            # Skip behaviour
-            else:
+                # If we *are* just skipping these problems, then we can just go to
+                # the next user
                 continue
 
-        # At the point, the access token MUST be valid, so we can decrypt them
-        # and yield them through the generator
-        decrypted_access_token = tokens_utils.decrypt(creds.access_token)
-        decrypted_refresh_token = tokens_utils.decrypt(creds.refresh_token)
+            # Next, check that the tokens are actually valid (by expiry time)
+            if is_oauth_expired(creds):
+                # If they are expired, then we either throw an error, skip this user, or
+                # trigger a refresh for the user's tokens.
+                if expired_oauth_behaviour == "error":
+                    raise ValueError(
+                        f"User id {uuid} has expired credentials, and we're not refreshing them!"
+                    )
+
+                elif expired_oauth_behaviour == "refresh":
+                    yield_order.append(uuid)
+
+                # Skip behaviour
+                continue
+
+            valid_creds.append(creds)
+            yield_order.append(uuid)
+
+        # At the point, the access tokens MUST be valid, so we can decrypt them. (Both tokens
+        # for every user go into one flat list, access token first)
+        encrypted = [
+            token
+            for creds in valid_creds
+            for token in (creds.access_token, creds.refresh_token)
+        ]
+
+        # Decrypting a big batch can hog the event loop for a bit, so it gets pushed
+        # off into a thread.
+        if len(valid_creds) >= THREADED_DECRYPTION_THRESHOLD:
+            decrypted = await asyncio.to_thread(tokens_utils.decrypt_many, encrypted)
+        else:
+            decrypted = tokens_utils.decrypt_many(encrypted)
 
         # FIXME: In most places, we do not need the refresh token, so refactoring
         # some of the codebase to only require it where necessary may be an ideal
         # task for future polish.
         # We're returning this whole object here because *most* functions in this
         # codebase use the object.
-        yield WakatimeTokens(
-            user_id=uuid,
-            access_token=decrypted_access_token,
-            refresh_token=decrypted_refresh_token,
-        )
+        valid_tokens = {
+            creds.user_id: WakatimeTokens(
+                user_id=creds.user_id,
+                access_token=decrypted[n * 2],
+                refresh_token=decrypted[n * 2 + 1],
+            )
+            for n, creds in enumerate(valid_creds)
+        }
+
+        for uuid in yield_order:
+            if uuid in valid_tokens:
+                yield valid_tokens[uuid]
+                continue
+
+            # One user's refresh going wrong shouldn't stop everyone after them from
+            # getting their tokens, so they just get left out.
+            try:
+                tokens, _ = await refresh_oauth_credentials(uuid)
+            except Exception:
+                LOGGER.exception(f"Failed to refresh wakatime tokens for user {uuid}")
+                continue
+
+            yield tokens
 
 
-__all__ = ["is_oauth_expired", "update_oauth_tokens", "recache_wakatime_profile"]
+__all__ = [
+    "is_oauth_expired",
+    "update_oauth_tokens",
+    "refresh_oauth_credentials",
+    "recache_wakatime_profile",
+]
@@ -0,0 +1,147 @@
+from datetime import date, timedelta
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import run_read
+from .models import WeeklyLeaderboard, WakatimeUserProfile
+from ..caching.memoize import memoize
+from ..models.leaderboards import (
+    LeaderboardRanking,
+    LeaderboardResponse,
+    WakatimeProfile,
+)
+
+# The leaderboard only gets rebuilt by the leaderboard job (which invalidates these
+# when it's done), so this is mostly here as a backstop.
+LEADERBOARD_CACHE_TTL = timedelta(minutes=5)
+
+
+def build_wakatime_profile(
+    profile: WakatimeUserProfile | None,
+) -> WakatimeProfile | None:
+    if profile is None:
+        return None
+
+    return WakatimeProfile(
+        user_id=str(profile.user_id),
+        display_name=profile.display_name,
+        full_name=profile.full_name,
+        username=profile.username,
+        is_photo_public=profile.is_photo_public,
+        photo_url=profile.photo_url,
+        last_cached_at=profile.last_cached_at,
+    )
+
+
+@memoize(
+    ttl=LEADERBOARD_CACHE_TTL,
+    max_size=8,
+    key=lambda week_start, **_: str(week_start),
+)
+async def get_weekly_leaderboard(
+    week_start: date, *, from_primary: bool = False
+) -> LeaderboardResponse:
+    """
+    Gets the top 100 of the leaderboard for the week starting on `week_start`.
+
+    This reads from the read replica (if there is one), unless `from_primary` is set.
+    """
+
+    stmt = (
+        select(WeeklyLeaderboard, WakatimeUserProfile)
+        .where(WeeklyLeaderboard.week_start == week_start)
+        .order_by(WeeklyLeaderboard.rank)
+        .limit(100)
+        .join(
+            WakatimeUserProfile,
+            WakatimeUserProfile.user_id == WeeklyLeaderboard.user_id,
+            isouter=True,
+        )
+    )
+
+    async def read(session: AsyncSession) -> LeaderboardResponse:
+        res = await session.execute(stmt)
+
+        return LeaderboardResponse(
+            leaderboard=[
+                LeaderboardRanking(
+                    user_id=leaderboard_placement.user_id,
+                    rank=leaderboard_placement.rank,
+                    total_seconds=leaderboard_placement.total,
+                    profile=build_wakatime_profile(profile),
+                )
+                for leaderboard_placement, profile in res
+            ]
+        )
+
+    return await run_read(read, primary=from_primary)
+
+
+@memoize(ttl=LEADERBOARD_CACHE_TTL, max_size=10_000)
+async def get_weekly_leaderboard_placement(
+    week_start: date, user_id: UUID
+) -> LeaderboardRanking | None:
+    """
+    Gets the user's placement on the leaderboard for the week starting on `week_start`,
+    or None if they haven't been ranked yet.
+    """
+
+    # Select the user's current leaderboard placement for this week,
+    # as well as their profile
+    stmt = (
+        select(WeeklyLeaderboard, WakatimeUserProfile)
+        .where(WeeklyLeaderboard.week_start == week_start)
+        .where(WeeklyLeaderboard.user_id == user_id)
+        .join(
+            WakatimeUserProfile,
+            WakatimeUserProfile.user_id == user_id,
+            isouter=True,
+        )
+    )
+
+    async def read(session: AsyncSession) -> LeaderboardRanking | None:
+        # NOTE: Can use scalars() here because the join() gets voided
+        res = (await session.execute(stmt)).one_or_none()
+
+        if res is None:
+            return None
+
+        # Unpack the response (it is basically a tuple)
+        leaderboard_placement, profile = res
+        profile: WakatimeUserProfile
+
+        # Build the leaderboard ranking response and return it
+        return LeaderboardRanking(
+            user_id=leaderboard_placement.user_id,
+            rank=leaderboard_placement.rank,
+            total_seconds=leaderboard_placement.total,
+            profile=build_wakatime_profile(profile),
+        )
+
+    return await run_read(read)
+
+
+async def invalidate_leaderboard_caches() -> None:
+    """
+    Drops every cached leaderboard read, call this after the leaderboard changes.
+    """
+    await get_weekly_leaderboard.invalidate()
+    await get_weekly_leaderboard_placement.invalidate()
+
+    # Pull this week's leaderboard back in from the primary, otherwise the first read
+    # might get an outdated one from a replica that hasn't caught up yet (and cache it).
+    today = date.today()
+
+    await get_weekly_leaderboard.refresh(
+        date.fromisocalendar(year=today.year, week=today.isocalendar().week, day=1),
+        from_primary=True,
+    )
+
+
+__all__ = [
+    "get_weekly_leaderboard",
+    "get_weekly_leaderboard_placement",
+    "invalidate_leaderboard_caches",
+]
@@ -1,5 +1,6 @@
 from sqlalchemy import (
     ForeignKey,
+    ForeignKeyConstraint,
     Index,
     PrimaryKeyConstraint,
     DateTime,
@@ -137,24 +138,33 @@ class WakatimeUserProfile(CodeCrunchrBase):
     # Could be useful, in America/Halifax format I believe
     timezone: Mapped[str]
 
+    # When wakatime last heard from any of the user's editors (as of `last_cached_at`),
+    # the refresh planner uses this to tell who's actively coding
+    last_heartbeat_at: Mapped[datetime | None] = mapped_column(nullable=True)
+
     last_cached_at: Mapped[datetime] = mapped_column(server_default=db_funcs.now())
 
 
 class WakatimeDuration(CodeCrunchrBase):
     """
     Responsible for holding the cumulative duration data
+
+    NOTE: This table is partitioned by month on `date` (see `src/db/partitions.py`), and
+          postgres needs the partition key in every unique constraint, which is why
+          `date` is part of the primary key.
     """
 
     __tablename__ = "codecrunchr_wakatime_durations"
 
-    id: Mapped[int] = mapped_column(primary_key=True)
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
 
+    # NOTE: This doesn't need its own index, `unique_date_user_id` starts with it
     user_id: Mapped[UUID] = mapped_column(
-        ForeignKey("codecrunchr_users.id", ondelete="CASCADE"), index=True
+        ForeignKey("codecrunchr_users.id", ondelete="CASCADE")
     )
     user = relationship("User", back_populates="wakatime_durations")
 
-    date: Mapped["date"]
+    date: Mapped["date"] = mapped_column(primary_key=True)
 
     total_seconds: Mapped[float]
 
@@ -166,7 +176,25 @@ class WakatimeDuration(CodeCrunchrBase):
         cascade="all, delete-orphan",
     )
 
-    __table_args__ = (UniqueConstraint("user_id", "date", name="unique_date_user_id"),)
+    __table_args__ = (
+        # Covers looking up one user's durations by date (and the upserts), the rest of the
+        # columns are included so those lookups never have to touch the table itself.
+        UniqueConstraint(
+            "user_id",
+            "date",
+            name="unique_date_user_id",
+            postgresql_include=["id", "total_seconds", "last_cached_at"],
+        ),
+        # Covers scanning a range of dates across every user (e.g., for the leaderboard
+        # and for planning whose durations are due a refresh)
+        Index(
+            "idx_durations_date_user_id",
+            "date",
+            "user_id",
+            postgresql_include=["total_seconds", "last_cached_at"],
+        ),
+        {"postgresql_partition_by": "RANGE (date)"},
+    )
 
 
 class WakatimeLanguageDuration(CodeCrunchrBase):
@@ -176,13 +204,16 @@ class WakatimeLanguageDuration(CodeCrunchrBase):
 
     The aggregation of all language durations total_seconds should equal the
     parent duration's total_seconds.
+
+    NOTE: This table is partitioned by month on `date` too, which is why it keeps
+          a copy of its parent's date. (It's also needed to reference the parent,
+          since that's part of the parent's primary key)
     """
 
     __tablename__ = "codecrunchr_wakatime_language_durations"
 
-    parent_id: Mapped[int] = mapped_column(
-        ForeignKey("codecrunchr_wakatime_durations.id", ondelete="CASCADE")
-    )
+    parent_id: Mapped[int]
+    date: Mapped["date"]
     parent = relationship("WakatimeDuration", back_populates="languages")
 
     language: Mapped[str] = mapped_column(index=True)
@@ -190,10 +221,71 @@ class WakatimeLanguageDuration(CodeCrunchrBase):
     total_seconds: Mapped[float]
 
     __table_args__ = (
-        PrimaryKeyConstraint("parent_id", "language", name="pk_parent_id_language"),
+        ForeignKeyConstraint(
+            ["parent_id", "date"],
+            [
+                "codecrunchr_wakatime_durations.id",
+                "codecrunchr_wakatime_durations.date",
+            ],
+            ondelete="CASCADE",
+        ),
+        PrimaryKeyConstraint(
+            "parent_id", "language", "date", name="pk_parent_id_language"
+        ),
+        {"postgresql_partition_by": "RANGE (date)"},
     )
 
 
+class WeeklyDurationRollup(CodeCrunchrBase):
+    """
+    Responsible for holding each user's total coding time for a week (starting on monday),
+    so it doesn't need to be summed up from the daily durations every time.
+
+    Kept up to date by `update_user_durations`.
+    """
+
+    __tablename__ = "codecrunchr_weekly_duration_rollups"
+
+    week_start: Mapped[date] = mapped_column(primary_key=True)
+    user_id: Mapped[UUID] = mapped_column(
+        ForeignKey("codecrunchr_users.id", ondelete="CASCADE"), primary_key=True
+    )
+    total_seconds: Mapped[float]
+
+
+class MonthlyDurationRollup(CodeCrunchrBase):
+    """
+    Responsible for holding each user's total coding time for a month.
+
+    Kept up to date by `update_user_durations`.
+    """
+
+    __tablename__ = "codecrunchr_monthly_duration_rollups"
+
+    month_start: Mapped[date] = mapped_column(primary_key=True)
+    user_id: Mapped[UUID] = mapped_column(
+        ForeignKey("codecrunchr_users.id", ondelete="CASCADE"), primary_key=True
+    )
+    total_seconds: Mapped[float]
+
+
+class WeeklyLanguageRollup(CodeCrunchrBase):
+    """
+    Responsible for holding each user's total coding time per language for a week.
+
+    Kept up to date by `update_user_durations`.
+    """
+
+    __tablename__ = "codecrunchr_weekly_language_rollups"
+
+    week_start: Mapped[date] = mapped_column(primary_key=True)
+    user_id: Mapped[UUID] = mapped_column(
+        ForeignKey("codecrunchr_users.id", ondelete="CASCADE"), primary_key=True
+    )
+    language: Mapped[str] = mapped_column(primary_key=True)
+    total_seconds: Mapped[float]
+
+
 class WeeklyLeaderboard(CodeCrunchrBase):
     """
     Responsible for holding a snapshot of the coding time
@@ -244,6 +336,31 @@ class Goals(CodeCrunchrBase):
     minutes: Mapped[int] = mapped_column(nullable=False)
 
 
+class SharedCacheEntry(CodeCrunchrBase):
+    """
+    Holds cached items that every worker can see (see `src.caching.backends`).
+
+    This table is UNLOGGED, so it's quick to write to but gets wiped if postgres
+    crashes. That's fine, it's just a cache.
+    """
+
+    __tablename__ = "codecrunchr_shared_cache"
+
+    # Which cache the entry belongs to, and its key in that cache
+    namespace: Mapped[str] = mapped_column(primary_key=True)
+    key: Mapped[str] = mapped_column(primary_key=True)
+
+    value: Mapped[str] = mapped_column(nullable=False)
+
+    # NULL means the entry never expires
+    expires_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("idx_shared_cache_expires_at", "expires_at"),
+        {"prefixes": ["UNLOGGED"]},
+    )
+
+
 __all__ = [
     "CodeCrunchrBase",
     "User",
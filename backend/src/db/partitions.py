@@ -0,0 +1,144 @@
+from contextlib import contextmanager
+from datetime import date
+from logging import getLogger
+from typing import Iterator
+import re
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+LOGGER = getLogger(__name__)
+
+# The tables that are range partitioned by month on their `date` column. The order matters,
+# the language rows reference the durations so their partitions get made second.
+MONTHLY_PARTITIONED_TABLES = [
+    "codecrunchr_wakatime_durations",
+    "codecrunchr_wakatime_language_durations",
+]
+
+# How many months past the current one get their partitions made ahead of time. Rows
+# for a month without a partition can't be inserted at all, so there's some slack here
+# in case the job doesn't get to run for a while. (there's no DEFAULT partition to catch
+# them either, see `MissingPartitionError`)
+PARTITION_MONTHS_AHEAD = 3
+
+# What postgres says when a row doesn't fit in any partition (a check_violation)
+NO_PARTITION_SQLSTATE = "23514"
+NO_PARTITION_MESSAGE = "no partition of relation"
+
+# Only one worker should be creating partitions at a time (any number for the lock is fine,
+# as long as nothing else uses it)
+PARTITION_LOCK_ID = 48_151_623
+
+# Matches the names of the partitions themselves, e.g., `codecrunchr_wakatime_durations_2026_10`
+# (or the `_history` partition that holds everything from before partitioning)
+PARTITION_NAME_PATTERN = re.compile(
+    rf"^({'|'.join(MONTHLY_PARTITIONED_TABLES)})_(\d{{4}}_\d{{2}}|history)$"
+)
+
+
+class MissingPartitionError(Exception):
+    """
+    Raised when rows are written for a month that doesn't have a partition. This means
+    the partition maintenance job hasn't been running (or the dates are way off), so
+    it's on purpose that nothing tries to recover from it.
+    """
+
+
+@contextmanager
+def missing_partitions_are_fatal(start: date, end: date) -> Iterator[None]:
+    """
+    Turns the database error from writing rows between `start` and `end` (inclusive)
+    into a `MissingPartitionError`, if it's because a partition is missing.
+    """
+
+    try:
+        yield
+    except DBAPIError as e:
+        if getattr(e.orig, "sqlstate", None) != NO_PARTITION_SQLSTATE or (
+            NO_PARTITION_MESSAGE not in str(e.orig)
+        ):
+            raise
+
+        LOGGER.critical(
+            f"Tried to write durations from {start} to {end}, but a partition for "
+            "them doesn't exist. Is the partition maintenance job running?"
+        )
+
+        raise MissingPartitionError(
+            f"No partition exists for some of the dates from {start} to {end}"
+        ) from e
+
+
+def add_months(month: date, months: int) -> date:
+    """
+    Returns the first day of the month that is `months` after the one `month` is in.
+    """
+    index = month.year * 12 + (month.month - 1) + months
+
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_{month:%Y_%m}"
+
+
+def is_partition_name(name: str) -> bool:
+    return PARTITION_NAME_PATTERN.match(name) is not None
+
+
+async def create_monthly_partitions(
+    connection: AsyncConnection, *, start: date, months: int
+) -> list[str]:
+    """
+    Makes sure every partitioned table has a partition for each of the `months` months
+    starting with the one `start` is in, and returns the names of any that were created.
+
+    Partitions that already exist are left alone.
+    """
+
+    # Hold the lock until the transaction ends, so no other worker can try to create
+    # the same partitions in between us checking for them and creating them.
+    await connection.execute(
+        text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": PARTITION_LOCK_ID}
+    )
+
+    created = []
+
+    for table in MONTHLY_PARTITIONED_TABLES:
+        for offset in range(months):
+            month = add_months(start, offset)
+            name = partition_name(table, month)
+
+            exists = await connection.scalar(
+                text("SELECT to_regclass(:name)"), {"name": name}
+            )
+
+            if exists is not None:
+                continue
+
+            # NOTE: These are all names and dates we made ourselves, nothing from outside
+            await connection.execute(
+                text(
+                    f"CREATE TABLE {name} PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+                )
+            )
+
+            created.append(name)
+
+    if created:
+        LOGGER.info(f"Created partitions: {', '.join(created)}")
+
+    return created
+
+
+__all__ = [
+    "MONTHLY_PARTITIONED_TABLES",
+    "PARTITION_MONTHS_AHEAD",
+    "MissingPartitionError",
+    "create_monthly_partitions",
+    "is_partition_name",
+    "missing_partitions_are_fatal",
+]
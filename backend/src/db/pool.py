@@ -0,0 +1,199 @@
+from typing import Any, TypedDict
+from uuid import uuid4
+import time
+
+from pydantic import BaseModel, Field
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, PoolProxiedConnection
+
+from ..utils.env import get_optional_env
+
+# Maps the settings on `DatabaseEngineSettings` to the environment variables
+# that can be used to override them.
+SETTINGS_ENV_VARS = {
+    "pool_size": "DB_POOL_SIZE",
+    "max_overflow": "DB_MAX_OVERFLOW",
+    "pool_timeout": "DB_POOL_TIMEOUT",
+    "pool_recycle": "DB_POOL_RECYCLE",
+    "pool_pre_ping": "DB_POOL_PRE_PING",
+    "statement_cache_size": "DB_STATEMENT_CACHE_SIZE",
+    "command_timeout": "DB_COMMAND_TIMEOUT",
+    "pgbouncer": "DB_PGBOUNCER",
+    "replica_max_lag": "DB_REPLICA_MAX_LAG",
+    "replica_check_interval": "DB_REPLICA_CHECK_INTERVAL",
+}
+
+
+class DatabaseEngineSettings(BaseModel):
+    """
+    Everything that can be tuned on the database engine and its connection pool.
+    """
+
+    # How many connections are kept open, and how many more can be opened on top
+    # of that when things get busy
+    pool_size: int = Field(default=5, gt=0)
+    max_overflow: int = Field(default=10, ge=0)
+
+    # How long (in seconds) to wait for a connection from the pool before giving up
+    pool_timeout: float = Field(default=30.0, gt=0)
+
+    # Connections older than this (in seconds) get replaced, -1 to never replace them
+    pool_recycle: int = Field(default=1800, ge=-1)
+
+    # Checks that a connection is still alive before handing it out
+    pool_pre_ping: bool = True
+
+    # How many prepared statements asyncpg keeps around per connection (0 turns it off)
+    statement_cache_size: int = Field(default=100, ge=0)
+
+    # How long (in seconds) a single query can run before it's cancelled (None for no limit)
+    command_timeout: float | None = Field(default=None, gt=0)
+
+    # Set this when connecting through pgbouncer (in transaction pooling mode), which
+    # can't deal with server-side prepared statements. (or LISTEN, so the postgres cache
+    # backend needs a direct url to listen on)
+    pgbouncer: bool = False
+
+    # How far behind (in seconds) the read replica can get before reads go back
+    # to the primary, and how often (in seconds) that gets checked
+    replica_max_lag: float = Field(default=5.0, ge=0)
+    replica_check_interval: float = Field(default=5.0, gt=0)
+
+    @classmethod
+    def from_env(cls, **overrides: Any) -> "DatabaseEngineSettings":
+        """
+        Builds the settings from any environment variables that are set,
+        `overrides` take priority over the environment.
+        """
+        values: dict[str, Any] = {}
+
+        for setting, env_key in SETTINGS_ENV_VARS.items():
+            env_value = get_optional_env(env_key)
+
+            if env_value is not None:
+                values[setting] = env_value
+
+        values.update(overrides)
+
+        return cls.model_validate(values)
+
+    def engine_kwargs(self) -> dict[str, Any]:
+        """
+        The keyword arguments to pass to `create_async_engine` for these settings.
+        """
+        connect_args: dict[str, Any] = {
+            "statement_cache_size": self.statement_cache_size,
+        }
+
+        if self.command_timeout is not None:
+            connect_args["command_timeout"] = self.command_timeout
+
+        if self.pgbouncer:
+            # pgbouncer can hand each transaction to a different server connection, so
+            # no prepared statements can be cached (by asyncpg or sqlalchemy), and the
+            # ones we do make need unique names so they don't clash with each other.
+            connect_args["statement_cache_size"] = 0
+            connect_args["prepared_statement_cache_size"] = 0
+            connect_args["prepared_statement_name_func"] = lambda: (
+                f"__asyncpg_{uuid4()}__"
+            )
+
+        return dict(
+            poolclass=InstrumentedAsyncPool,
+            pool_size=self.pool_size,
+            max_overflow=self.max_overflow,
+            pool_timeout=self.pool_timeout,
+            pool_recycle=self.pool_recycle,
+            pool_pre_ping=self.pool_pre_ping,
+            connect_args=connect_args,
+        )
+
+
+class DatabasePoolStats(TypedDict):
+    pool_size: int
+    max_overflow: int
+    checked_out: int
+    checked_in: int
+    overflow: int
+    total_checkouts: int
+    checkout_timeouts: int
+    avg_checkout_wait_ms: float
+    max_checkout_wait_ms: float
+
+
+class PoolMetrics(object):
+    """
+    Keeps track of how long it takes to get a connection out of the pool.
+    """
+
+    total_checkouts: int
+    checkout_timeouts: int
+    total_wait: float
+    max_wait: float
+
+    def __init__(self) -> None:
+        self.total_checkouts = 0
+        self.checkout_timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_checkout(self, waited: float) -> None:
+        self.total_checkouts += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+
+class InstrumentedAsyncPool(AsyncAdaptedQueuePool):
+    """
+    The usual async connection pool, but it times every checkout.
+    """
+
+    metrics: PoolMetrics
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def connect(self) -> PoolProxiedConnection:
+        started = time.perf_counter()
+
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            self.metrics.checkout_timeouts += 1
+            raise
+        finally:
+            self.metrics.record_checkout(time.perf_counter() - started)
+
+    def recreate(self) -> "InstrumentedAsyncPool":
+        # Keep the same metrics when the pool gets swapped out (e.g., after a disconnect)
+        new_pool = super().recreate()
+        new_pool.metrics = self.metrics
+
+        return new_pool  # type: ignore[return-value]
+
+    def stats(self) -> DatabasePoolStats:
+        metrics = self.metrics
+
+        return DatabasePoolStats(
+            pool_size=self.size(),
+            max_overflow=self._max_overflow,
+            checked_out=self.checkedout(),
+            checked_in=self.checkedin(),
+            overflow=max(self.overflow(), 0),
+            total_checkouts=metrics.total_checkouts,
+            checkout_timeouts=metrics.checkout_timeouts,
+            avg_checkout_wait_ms=(
+                metrics.total_wait / metrics.total_checkouts * 1000
+                if metrics.total_checkouts
+                else 0.0
+            ),
+            max_checkout_wait_ms=metrics.max_wait * 1000,
+        )
+
+
+__all__ = [
+    "DatabaseEngineSettings",
+    "DatabasePoolStats",
+    "InstrumentedAsyncPool",
+]
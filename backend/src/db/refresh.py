@@ -0,0 +1,197 @@
+from datetime import date, datetime, timedelta
+from enum import Enum
+from typing import TypedDict
+from uuid import UUID
+
+from sqlalchemy import DateTime, and_, case, cast, or_, select, func as db_funcs
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import OAuth2Credentials, User, WakatimeDuration, WakatimeUserProfile
+from ..wakatime import WakatimeStartEndTimeframe
+
+
+class RefreshTier(Enum):
+    # Coded recently, their totals are probably still going up
+    ACTIVE = "active"
+
+    # Hasn't coded in a while, their totals are probably not going anywhere
+    IDLE = "idle"
+
+
+# How long a user's durations are left alone after being refreshed, for each tier.
+# NOTE: These are a bit under an hour/day, so a job that starts a few seconds later
+#       than the last one doesn't skip a whole run.
+DEFAULT_REFRESH_INTERVALS = {
+    RefreshTier.ACTIVE: timedelta(minutes=50),
+    RefreshTier.IDLE: timedelta(hours=23, minutes=50),
+}
+
+# Anyone who has coded (going by their last heartbeat, or the last day with any time on
+# it) within this long counts as active.
+# NOTE: Days only have a date, so they count as the very start of that day.
+DEFAULT_ACTIVE_WITHIN = timedelta(days=2)
+
+
+class PlannedRefresh(TypedDict):
+    user_id: UUID
+    tier: RefreshTier
+
+    # The most recent sign of the user coding (None if we've never seen any)
+    last_active_at: datetime | None
+
+
+def select_planned_refreshes(
+    timeframe: WakatimeStartEndTimeframe,
+    *,
+    now: datetime | None = None,
+    active_within: timedelta = DEFAULT_ACTIVE_WITHIN,
+    refresh_intervals: dict[RefreshTier, timedelta] = DEFAULT_REFRESH_INTERVALS,
+    after: PlannedRefresh | None = None,
+):
+    """
+    Builds a statement which selects every user with wakatime credentials whose durations
+    in `timeframe` are due a refresh, along with their tier and when they were last active.
+
+    Everyone is due as soon as their tier's interval has passed since their durations were
+    last cached (or straight away if they don't have any in the timeframe). The most
+    recently active users come first.
+
+    Pass the last refresh of the previous page as `after` to get the next page.
+    """
+    now = now or datetime.now()
+    today = now.date()
+
+    # Everything we need from the durations comes from one pass over (roughly) the last
+    # week of them, which is served straight out of the (date, user_id) covering index.
+    activity_start: date = min(timeframe.start_date, today - active_within)
+
+    activity = (
+        select(
+            WakatimeDuration.user_id,
+            # When we last refreshed anything in the timeframe
+            db_funcs.max(WakatimeDuration.last_cached_at)
+            .filter(
+                WakatimeDuration.date.between(timeframe.start_date, timeframe.end_date)
+            )
+            .label("last_refreshed_at"),
+            # The last day they actually coded on
+            db_funcs.max(WakatimeDuration.date)
+            .filter(WakatimeDuration.total_seconds > 0)
+            .label("last_active_day"),
+        )
+        .where(WakatimeDuration.date >= activity_start)
+        .group_by(WakatimeDuration.user_id)
+        .subquery()
+    )
+
+    # greatest() skips over nulls, so either one on its own is enough
+    last_active_at = db_funcs.greatest(
+        WakatimeUserProfile.last_heartbeat_at,
+        cast(activity.c.last_active_day, DateTime),
+    )
+
+    is_active = last_active_at >= now - active_within
+
+    tier = case(
+        (is_active, RefreshTier.ACTIVE.value),
+        else_=RefreshTier.IDLE.value,
+    )
+
+    # Anything cached before this is out of date (for the user's tier)
+    # (cast, otherwise postgres has nothing to go on for what type the case is)
+    refresh_cutoff = case(
+        (is_active, cast(now - refresh_intervals[RefreshTier.ACTIVE], DateTime)),
+        else_=cast(now - refresh_intervals[RefreshTier.IDLE], DateTime),
+    )
+
+    # The breakdown of this query goes as follows:
+    # 1. Start from every user with wakatime credentials (so users without any durations
+    #    this week still get picked up) ...
+    # 2. Along with their profile and recent durations, if they have any ...
+    # 3. Where nothing in the timeframe was cached, or it was cached before the cutoff ...
+    # 4. With the most recently active users first.
+    stmt = (
+        select(
+            User.id.label("user_id"),
+            tier.label("tier"),
+            last_active_at.label("last_active_at"),
+        )
+        .join(
+            OAuth2Credentials,
+            and_(
+                OAuth2Credentials.user_id == User.id,
+                OAuth2Credentials.provider == "wakatime",
+            ),
+        )
+        .outerjoin(WakatimeUserProfile, WakatimeUserProfile.user_id == User.id)
+        .outerjoin(activity, activity.c.user_id == User.id)
+        .where(
+            or_(
+                activity.c.last_refreshed_at.is_(None),
+                activity.c.last_refreshed_at < refresh_cutoff,
+            )
+        )
+        .order_by(last_active_at.desc().nulls_last(), User.id)
+    )
+
+    # Pick up right after the previous page, in the same order as above
+    if after is not None and after["last_active_at"] is None:
+        stmt = stmt.where(last_active_at.is_(None), User.id > after["user_id"])
+    elif after is not None:
+        stmt = stmt.where(
+            or_(
+                last_active_at < after["last_active_at"],
+                and_(
+                    last_active_at == after["last_active_at"],
+                    User.id > after["user_id"],
+                ),
+                last_active_at.is_(None),
+            )
+        )
+
+    return stmt
+
+
+async def plan_duration_refreshes(
+    session: AsyncSession,
+    timeframe: WakatimeStartEndTimeframe,
+    *,
+    now: datetime | None = None,
+    active_within: timedelta = DEFAULT_ACTIVE_WITHIN,
+    refresh_intervals: dict[RefreshTier, timedelta] = DEFAULT_REFRESH_INTERVALS,
+    after: PlannedRefresh | None = None,
+    limit: int | None = None,
+) -> list[PlannedRefresh]:
+    """
+    Returns everyone whose durations in `timeframe` are due a refresh, most recently
+    active first. (see `select_planned_refreshes`)
+
+    Pass `limit` to only get that many at a time, and the last one of each page as
+    `after` to get the next. Keep `now` the same for every page.
+    """
+    stmt = select_planned_refreshes(
+        timeframe,
+        now=now,
+        active_within=active_within,
+        refresh_intervals=refresh_intervals,
+        after=after,
+    ).limit(limit)
+
+    return [
+        PlannedRefresh(
+            user_id=row.user_id,
+            tier=RefreshTier(row.tier),
+            last_active_at=row.last_active_at,
+        )
+        for row in await session.execute(stmt)
+    ]
+
+
+__all__ = [
+    "DEFAULT_ACTIVE_WITHIN",
+    "DEFAULT_REFRESH_INTERVALS",
+    "PlannedRefresh",
+    "RefreshTier",
+    "plan_duration_refreshes",
+    "select_planned_refreshes",
+]
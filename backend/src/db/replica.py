@@ -0,0 +1,162 @@
+from datetime import datetime, timedelta
+from typing import TypedDict
+from logging import getLogger
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import (
+    create_async_engine,
+    async_sessionmaker,
+    AsyncSession,
+    AsyncEngine,
+)
+
+from .pool import DatabaseEngineSettings, DatabasePoolStats, InstrumentedAsyncPool
+
+LOGGER = getLogger(__name__)
+
+# How far behind (in seconds) the replica is from the primary. If it has replayed
+# everything it's received, it isn't behind at all (even if nothing's been written
+# in a while). This comes back NULL if the "replica" isn't actually a replica.
+REPLICATION_LAG_QUERY = text(
+    """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+    """
+)
+
+
+# SQLSTATEs that mean the connection itself is the problem, not the query. (class 08 is
+# connection exceptions, the 57P0x ones are the server shutting down or starting up)
+CONNECTION_ERROR_SQLSTATES = ("08", "57P01", "57P02", "57P03")
+
+
+def is_connection_error(error: BaseException) -> bool:
+    """
+    Whether `error` came from losing (or not being able to get) a connection, rather
+    than from the query that was being run.
+    """
+    if isinstance(error, OSError):
+        return True
+
+    if not isinstance(error, DBAPIError):
+        return False
+
+    if error.connection_invalidated or isinstance(error.orig.__cause__, OSError):
+        return True
+
+    sqlstate = getattr(error.orig, "sqlstate", None) or ""
+
+    return sqlstate.startswith(CONNECTION_ERROR_SQLSTATES)
+
+
+class ReplicaStats(TypedDict):
+    usable: bool
+    lag_seconds: float | None
+    last_checked_at: str | None
+    pool: DatabasePoolStats
+
+
+class ReadReplica(object):
+    """
+    A read-only copy of the database that reads can be sent to instead of the primary.
+
+    Its lag gets checked at most once every `replica_check_interval`, and it's only
+    used while it's reachable and no more than `replica_max_lag` behind the primary.
+    """
+
+    engine: AsyncEngine
+    sessionmaker: async_sessionmaker[AsyncSession]
+
+    max_lag: timedelta
+    check_interval: timedelta
+
+    usable: bool
+    lag: timedelta | None
+    last_checked_at: datetime | None
+
+    _check_lock: asyncio.Lock
+
+    def __init__(self, replica_url: str, settings: DatabaseEngineSettings) -> None:
+        self.engine = create_async_engine(url=replica_url, **settings.engine_kwargs())
+        self.sessionmaker = async_sessionmaker(bind=self.engine)
+
+        self.max_lag = timedelta(seconds=settings.replica_max_lag)
+        self.check_interval = timedelta(seconds=settings.replica_check_interval)
+
+        self.usable = False
+        self.lag = None
+        self.last_checked_at = None
+
+        self._check_lock = asyncio.Lock()
+
+    async def is_usable(self) -> bool:
+        """
+        Whether reads can be sent to the replica right now, checking its lag
+        first if it hasn't been checked in a while.
+        """
+        if not self._needs_check():
+            return self.usable
+
+        # Only one check at a time, everyone else can wait on its answer
+        async with self._check_lock:
+            if self._needs_check():
+                await self._check()
+
+        return self.usable
+
+    def mark_unavailable(self) -> None:
+        """
+        Stops reads going to the replica until it's next checked.
+        """
+        self.usable = False
+        self.last_checked_at = datetime.now()
+
+    def _needs_check(self) -> bool:
+        return (
+            self.last_checked_at is None
+            or datetime.now() - self.last_checked_at >= self.check_interval
+        )
+
+    async def _check(self) -> None:
+        try:
+            async with self.engine.connect() as connection:
+                lag_seconds = await connection.scalar(REPLICATION_LAG_QUERY)
+        except Exception:
+            LOGGER.warning("Read replica is unreachable, reading from the primary")
+            self.lag = None
+            self.mark_unavailable()
+            return
+
+        self.lag = timedelta(seconds=float(lag_seconds or 0))
+        self.usable = self.lag <= self.max_lag
+        self.last_checked_at = datetime.now()
+
+        if not self.usable:
+            LOGGER.warning(
+                f"Read replica is {self.lag.total_seconds():.1f}s behind, reading from the primary"
+            )
+
+    def stats(self) -> ReplicaStats:
+        pool = self.engine.sync_engine.pool
+        assert isinstance(pool, InstrumentedAsyncPool)
+
+        return ReplicaStats(
+            usable=self.usable,
+            lag_seconds=None if self.lag is None else self.lag.total_seconds(),
+            last_checked_at=(
+                None
+                if self.last_checked_at is None
+                else self.last_checked_at.isoformat()
+            ),
+            pool=pool.stats(),
+        )
+
+    async def die(self) -> None:
+        await self.engine.dispose(close=True)
+
+
+__all__ = ["ReadReplica", "ReplicaStats", "is_connection_error"]
@@ -0,0 +1,84 @@
+from typing import Any, Iterable
+
+from sqlalchemy import Column, Date, Float, MetaData, String, Table, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.schema import CreateTable
+
+# The staging tables aren't part of the models (so alembic never sees them), they only
+# ever exist as temporary tables for the length of a transaction.
+STAGING_METADATA = MetaData()
+
+DURATION_STAGING_TABLE = Table(
+    "codecrunchr_duration_staging",
+    STAGING_METADATA,
+    Column("date", Date, nullable=False),
+    Column("total_seconds", Float, nullable=False),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+LANGUAGE_STAGING_TABLE = Table(
+    "codecrunchr_language_duration_staging",
+    STAGING_METADATA,
+    Column("date", Date, nullable=False),
+    Column("language", String, nullable=False),
+    Column("total_seconds", Float, nullable=False),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+STAGING_TABLES = [DURATION_STAGING_TABLE, LANGUAGE_STAGING_TABLE]
+
+
+async def prepare_staging_tables(connection: AsyncConnection) -> None:
+    """
+    Makes sure the (temporary) staging tables exist and are empty.
+
+    NOTE: They get dropped when the transaction ends, so the transaction has to have
+          started before this is called, otherwise they'd be gone straight away.
+    """
+    for table in STAGING_TABLES:
+        await connection.execute(CreateTable(table, if_not_exists=True))
+
+    # They might already have something in them from earlier in the same transaction
+    await connection.execute(
+        text(f"TRUNCATE {', '.join(table.name for table in STAGING_TABLES)}")
+    )
+
+
+async def copy_into_staging(
+    connection: AsyncConnection, table: Table, records: Iterable[tuple[Any, ...]]
+) -> int:
+    """
+    Streams `records` (tuples in the same order as the table's columns) into a staging
+    table with asyncpg's binary COPY, and returns how many rows were copied.
+
+    The records get encoded as they're sent, so pass a generator to avoid holding all
+    of them in memory at once.
+    """
+
+    # COPY isn't something SQLAlchemy can do, so we go straight to asyncpg for it.
+    # (it's the same connection, so it's still part of the same transaction)
+    raw_connection = await connection.get_raw_connection()
+    driver_connection = raw_connection.driver_connection
+
+    # le sanity check
+    if driver_connection is None:
+        raise ValueError("Failed to copy into staging: connection is not open")
+
+    status = await driver_connection.copy_records_to_table(
+        table.name,
+        records=records,
+        columns=[column.name for column in table.columns],
+    )
+
+    # The status looks like "COPY 365"
+    return int(status.split()[-1])
+
+
+__all__ = [
+    "DURATION_STAGING_TABLE",
+    "LANGUAGE_STAGING_TABLE",
+    "copy_into_staging",
+    "prepare_staging_tables",
+]
@@ -1,3 +1,5 @@
 from . import auth
+from . import database
+from . import freshness
 
-__all__ = ["auth"]
+__all__ = ["auth", "database", "freshness"]
@@ -1,20 +1,27 @@
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi import Depends, HTTPException
 from typing import Annotated, TypedDict
+from datetime import datetime, timedelta
+from functools import cache
 from uuid import UUID
+import hashlib
+import json
 import jwt as pyjwt
 
 from sqlalchemy import select
 
-from ..caching import Cache
+from ..caching.shared import SharedCache, CacheCodec, pydantic_codec, encrypted_codec
 from ..utils.env import get_required_env
 from ..utils import tokens as tokens_utils
 from ..db.models import OAuth2Credentials
-from ..db.helpers import is_oauth_expired, OAUTH_EARLY_EXPIRY_DELTA, update_oauth_tokens
-from ..db import get_session as get_db_session
+from ..db.helpers import (
+    is_oauth_expired,
+    refresh_oauth_credentials,
+    OAUTH_EARLY_EXPIRY_DELTA,
+)
+from .database import SessionDependencyType
 
 from ..wakatime import WakatimeTokens
-from ..wakatime.auth import refresh_access_token
 
 # ========== HEADER DEF. ==========
 
@@ -22,49 +29,134 @@ BEARER_SCHEME = HTTPBearer()
 
 # ========== CACHE STUFF ==========
 
+# Every distinct JWT (or user) we see gets an entry in these, so they're capped to keep
+# memory flat no matter how many tokens get thrown at us.
+AUTH_CACHE_MAX_SIZE = 10_000
 
-USER_ID_CACHE: Cache[UUID] = Cache()
-WAKATIME_TOKEN_CACHE: Cache[WakatimeTokens] = Cache()
+# The longest we'll go without re-verifying a JWT, even if its `exp` claim is further
+# out than this. (Tokens issued before `exp` was added don't expire at all)
+USER_ID_CACHE_TTL = timedelta(hours=1)
 
 
-def clear_caches_for_token(jwt_token: str) -> None:
+def dump_wakatime_tokens(tokens: WakatimeTokens) -> str:
+    return json.dumps({**tokens, "user_id": str(tokens["user_id"])})
+
+
+def load_wakatime_tokens(s: str) -> WakatimeTokens:
+    data = json.loads(s)
+    return WakatimeTokens(**{**data, "user_id": UUID(data["user_id"])})
+
+
+# NOTE: These can end up in the shared cache backend, so the wakatime tokens get
+#       encrypted on their way there. (WakatimeTokens is a plain TypedDict, which pydantic
+#       can't handle before python 3.12, so it gets (de)serialized by hand)
+WAKATIME_TOKENS_CODEC: CacheCodec[WakatimeTokens] = encrypted_codec(
+    CacheCodec(dumps=dump_wakatime_tokens, loads=load_wakatime_tokens)
+)
+
+USER_ID_CACHE: SharedCache[UUID] = SharedCache(
+    "auth.user_id",
+    codec=pydantic_codec(UUID),
+    max_size=AUTH_CACHE_MAX_SIZE,
+    default_ttl=USER_ID_CACHE_TTL,
+)
+WAKATIME_TOKEN_CACHE: SharedCache[WakatimeTokens] = SharedCache(
+    "auth.wakatime_tokens",
+    codec=WAKATIME_TOKENS_CODEC,
+    max_size=AUTH_CACHE_MAX_SIZE,
+)
+
+
+def get_cache_key_for_token(jwt_token: str) -> str:
+    """
+    The auth caches are keyed by a hash of the JWT rather than the JWT itself, so
+    that nobody can lift a working token out of the shared cache.
+    """
+    return hashlib.sha256(jwt_token.encode("utf-8")).hexdigest()
+
+
+async def clear_caches_for_token(jwt_token: str, user_id: UUID) -> None:
+    """
+    Removes any instance of the provided JWT (and the user's wakatime tokens)
+    from the auth caches (on every worker)
+    """
+    await USER_ID_CACHE.remove(get_cache_key_for_token(jwt_token))
+    await forget_wakatime_tokens(user_id)
+
+
+async def forget_wakatime_tokens(user_id: UUID) -> None:
     """
-    Removes any instance of the provided JWT from the auth caches
+    Removes the user's wakatime tokens from the cache (on every worker), call
+    this whenever they change.
     """
-    USER_ID_CACHE.remove(jwt_token)
-    WAKATIME_TOKEN_CACHE.remove(jwt_token)
+    await WAKATIME_TOKEN_CACHE.remove(str(user_id))
 
 
 # ========== SHARED FUNCTIONS ==========
 
 
+# How long a JWT issued by /login is good for
+JWT_EXPIRES_AFTER = timedelta(days=30)
+
+
+@cache
+def get_jwt_secret() -> str:
+    """
+    The secret JWTs are signed with, it doesn't change while we're running so
+    we only need to look it up once.
+    """
+    return get_required_env("JWT_SECRET")
+
+
 class CodeCrunchrJWTPayload(TypedDict):
     user_id: str
+    # When the token expires (as a unix timestamp), None for older tokens without one
+    exp: int | None
 
 
 def decode_jwt_payload(jwt_token: str) -> CodeCrunchrJWTPayload:
     # Decode the payload _AND VERIFY_ that the token came from our login procedure.
+    # (This also checks the `exp` claim if the token has one)
     try:
         decoded_payload = pyjwt.decode(
             jwt_token,
-            key=get_required_env("JWT_SECRET"),
-            algorithms="HS256",
-            verify=True,
+            key=get_jwt_secret(),
+            algorithms=["HS256"],
+        )
+    except pyjwt.ExpiredSignatureError:
+        raise HTTPException(
+            status_code=401, detail="JWT has expired, please log back in!"
         )
     except Exception as _:
         raise HTTPException(status_code=400, detail="Invalid JWT provided")
 
-    return CodeCrunchrJWTPayload(user_id=decoded_payload["user_id"])
+    return CodeCrunchrJWTPayload(
+        user_id=decoded_payload["user_id"], exp=decoded_payload.get("exp")
+    )
+
+
+class AuthContext(TypedDict):
+    """
+    Everything we know about who made the request, after their JWT has been verified.
+    """
+
+    user_id: UUID
+    # What the user id cache knows this JWT by (see `get_cache_key_for_token`)
+    cache_key: str
 
 
 # ========== DEPENDENCIES ==========
 
 
-async def get_current_user_id(
+async def get_auth_context(
     token: "AuthHeaderDependencyType",
-) -> UUID:
+) -> AuthContext:
     """
-    Gets the current user's id from the token provided in the authorization header.
+    Verifies the JWT in the authorization header and works out who the user is.
+
+    FastAPI only runs this once per request no matter how many other dependencies
+    need it, and the verified user id is cached (until the JWT expires) so that
+    later requests with the same JWT don't need to verify it again.
     """
 
     # I hate this.
@@ -72,97 +164,103 @@ async def get_current_user_id(
 
     # Extract the JWT from the header
     jwt_token = token.credentials
+    cache_key = get_cache_key_for_token(jwt_token)
 
     # Check to see if we already have the jwt cached to avoid extra work
-    cached_id = USER_ID_CACHE.get(jwt_token)
+    cached_id = await USER_ID_CACHE.get(cache_key)
 
     if cached_id:
-        return cached_id
+        return AuthContext(user_id=cached_id, cache_key=cache_key)
 
     decoded_payload = decode_jwt_payload(jwt_token)
     user_id = UUID(decoded_payload["user_id"])
 
-    # TODO: Caches should expire
-    USER_ID_CACHE.add(key=jwt_token, item=user_id, expires_at=None)
+    # Don't keep the token around for any longer than it's actually valid for
+    expires_at = datetime.now() + USER_ID_CACHE_TTL
+
+    if decoded_payload["exp"] is not None:
+        expires_at = min(expires_at, datetime.fromtimestamp(decoded_payload["exp"]))
+
+    await USER_ID_CACHE.add(key=cache_key, item=user_id, expires_at=expires_at)
+
+    return AuthContext(user_id=user_id, cache_key=cache_key)
+
 
-    return user_id
+async def get_current_user_id(
+    auth: "AuthContextDependencyType",
+) -> UUID:
+    """
+    Gets the current user's id from the token provided in the authorization header.
+    """
+    return auth["user_id"]
 
 
 async def get_current_user_wakatime_tokens(
-    token: "AuthHeaderDependencyType",
+    auth: "AuthContextDependencyType",
+    session: SessionDependencyType,
 ) -> WakatimeTokens:
+    """
+    Gets the current user's (decrypted) wakatime tokens, refreshing them if they've expired.
+
+    The credentials are looked up through the request's session, so this doesn't cost
+    the handler another connection from the pool.
+    """
     # I hate this too.
     global WAKATIME_TOKEN_CACHE
 
-    # Get the jwt token
-    jwt_token = token.credentials
+    # The JWT has already been verified at this point
+    user_id = auth["user_id"]
 
     # Check cache...
-    cached_wakatime_tokens = WAKATIME_TOKEN_CACHE.get(jwt_token)
+    cached_wakatime_tokens = await WAKATIME_TOKEN_CACHE.get(str(user_id))
 
     # Cache hit? return that
     if cached_wakatime_tokens:
         return cached_wakatime_tokens
 
-    # No cache? decode payload and get user id
-    decoded_payload = decode_jwt_payload(jwt_token)
-    user_id = UUID(decoded_payload["user_id"])
-
     # Look for OAuth2Credentials attached to this user id
     stmt = select(OAuth2Credentials).where(OAuth2Credentials.user_id == user_id)
 
-    async with get_db_session() as session:
-        creds_resp = await session.scalar(stmt)
+    creds_resp = await session.scalar(stmt)
 
-        # If the user does not have credentials, then throw an error.
-        # (This should never happen)
-        if creds_resp is None:
-            raise HTTPException(
-                status_code=500,
-                detail="Failed to get wakatime credentials, please relog?",
-            )
+    # If the user does not have credentials, then throw an error.
+    # (This should never happen)
+    if creds_resp is None:
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to get wakatime credentials, please relog?",
+        )
 
-        # Decrypt the access token and refresh token
-        decrypted_access_token = tokens_utils.decrypt(creds_resp.access_token)
-        decrypted_refresh_token = tokens_utils.decrypt(creds_resp.refresh_token)
-
-        # If the access token is expired, refresh it.
-        if is_oauth_expired(creds_resp):
-            new_tokens = await refresh_access_token(creds_resp.refresh_token)
-
-            if new_tokens.status_code >= 300:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Failed to validate tokens, please log back in!",
-                )
-
-            decrypted_access_token = new_tokens.unwrap()["access_token"]
-            decrypted_refresh_token = new_tokens.unwrap()["refresh_token"]
-
-            await update_oauth_tokens(
-                session=session,
-                user_id=user_id,
-                access_token=decrypted_access_token,
-                refresh_token=decrypted_refresh_token,
-                expires_at=new_tokens.unwrap()["expires_at"],
-                skip_encryption=False,
-            )
+    needs_refresh = is_oauth_expired(creds_resp)
+    expires_at = creds_resp.expires_at
 
-            await session.commit()
+    # Decrypt the access token and refresh token
+    if not needs_refresh:
+        tokens_obj = WakatimeTokens(
+            user_id=user_id,
+            access_token=tokens_utils.decrypt(creds_resp.access_token),
+            refresh_token=tokens_utils.decrypt(creds_resp.refresh_token),
+        )
 
-    # Create a dict containing both tokens
-    tokens_obj = WakatimeTokens(
-        user_id=user_id,
-        access_token=decrypted_access_token,
-        refresh_token=decrypted_refresh_token,
-    )
+    # If the access token is expired, refresh it. (The renewal job should normally get to
+    # them first, this is just in case it didn't.) If a bunch of requests show up at once,
+    # they all wait on the same refresh, which runs (and commits) in its own session.
+    if needs_refresh:
+        try:
+            tokens_obj, expires_at = await refresh_oauth_credentials(user_id)
+        except ValueError:
+            raise HTTPException(
+                status_code=400,
+                detail="Failed to validate tokens, please log back in!",
+            )
 
     # Add the dict to the cache so we don't have to do all this
-    # rigamaroll again to get it
-    WAKATIME_TOKEN_CACHE.add(
-        jwt_token,
+    # rigamaroll again to get it. (Using the new expiry if we just refreshed them,
+    # otherwise they'd be thrown out of the cache right away)
+    await WAKATIME_TOKEN_CACHE.add(
+        str(user_id),
         tokens_obj,
-        expires_at=(creds_resp.expires_at - OAUTH_EARLY_EXPIRY_DELTA),
+        expires_at=(expires_at - OAUTH_EARLY_EXPIRY_DELTA),
     )
 
     # return those sweet juicy decrypted tokens
@@ -174,6 +272,7 @@ async def get_current_user_wakatime_tokens(
 AuthHeaderDependencyType = Annotated[
     HTTPAuthorizationCredentials, Depends(BEARER_SCHEME)
 ]
+AuthContextDependencyType = Annotated[AuthContext, Depends(get_auth_context)]
 TokenDependencyType = Annotated[
     WakatimeTokens, Depends(get_current_user_wakatime_tokens)
 ]
@@ -0,0 +1,57 @@
+from fastapi import Depends
+from typing import Annotated, AsyncIterator
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..db import get_database_singleton
+
+# ========== DEPENDENCIES ==========
+
+
+async def get_request_session() -> AsyncIterator[AsyncSession]:
+    """
+    The database session for the current request.
+
+    FastAPI only runs this once per request, so the auth dependencies and the handler
+    all end up sharing the same session (and transaction). The session doesn't check
+    a connection out of the pool until it runs its first query, so requests that never
+    touch the database never check one out at all.
+
+    Everything gets committed once the handler returns, or rolled back if it raised.
+    (Handlers can still commit early if something else has to see their changes first,
+    but anything after that needs another connection from the pool)
+
+    NOTE: Requests that have to recache durations from wakatime use more than one
+          connection. The recache writes through sessions of its own (see
+          `recache_user_durations()`), since it's shared with every other request
+          waiting on the same days, and its weekly chunks get written in parallel.
+    """
+    sessionmaker = get_database_singleton().sessionmaker
+
+    # le sanity check numero three
+    if sessionmaker is None:
+        raise ValueError(
+            "Failed to get request session: session maker is not initialized"
+        )
+
+    session = sessionmaker()
+
+    try:
+        yield session
+
+        # Doesn't do anything (or touch the pool) if the session was never used
+        await session.commit()
+    except Exception as _:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
+
+# ========== DEPENDENCY TYPES ==========
+
+# NOTE: This is function scoped so that the commit happens *before* the response gets
+#       sent, otherwise the client could be told something worked when it didn't.
+SessionDependencyType = Annotated[
+    AsyncSession, Depends(get_request_session, scope="function")
+]
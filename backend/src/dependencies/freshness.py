@@ -0,0 +1,35 @@
+from fastapi import Depends, Query
+from typing import Annotated
+from datetime import timedelta
+
+# The freshest data a client is allowed to ask for. Anything below this gets bumped
+# up to it, so a client spamming pull-to-refresh can't hammer wakatime for us.
+MIN_MAX_STALENESS = timedelta(seconds=30)
+
+
+def get_max_staleness(
+    max_staleness: Annotated[
+        int | None,
+        Query(
+            ge=0,
+            description="How old (in seconds) today's coding data is allowed to be before it gets "
+            f"refreshed from wakatime. Values under {int(MIN_MAX_STALENESS.total_seconds())} "
+            "seconds are treated as that minimum.",
+        ),
+    ] = None,
+) -> timedelta | None:
+    """
+    Reads the client's freshness budget from the `max_staleness` query parameter.
+
+    Returns None if the client didn't send one, so each endpoint can fall back on
+    its own default.
+    """
+    if max_staleness is None:
+        return None
+
+    return max(timedelta(seconds=max_staleness), MIN_MAX_STALENESS)
+
+
+# ========== DEPENDENCY TYPES ==========
+
+MaxStalenessDependencyType = Annotated[timedelta | None, Depends(get_max_staleness)]
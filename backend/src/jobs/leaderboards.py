@@ -1,20 +1,95 @@
 from ..db import get_session
-from ..db.models import WeeklyLeaderboard, WakatimeDuration
+from ..db.models import WeeklyLeaderboard, WeeklyDurationRollup
 from ..db.helpers import (
+    CREDENTIAL_LOOKUP_BATCH_SIZE,
     wakatime_token_lookup_generator,
-    get_user_ids_with_incomplete_durations,
     evil_duration_fetching_function,
 )
-from ..wakatime import WakatimeStartEndTimeframe
+from ..db.refresh import (
+    DEFAULT_ACTIVE_WITHIN,
+    DEFAULT_REFRESH_INTERVALS,
+    PlannedRefresh,
+    RefreshTier,
+    plan_duration_refreshes,
+)
+from ..wakatime import WakatimeStartEndTimeframe, WakatimeTokens
+from ..wakatime.ratelimit import request_priority, RequestPriority
+from ..db.leaderboards import invalidate_leaderboard_caches
+from ..utils.env import get_optional_env
 
+from pydantic import BaseModel, Field
 from sqlalchemy import delete, insert, literal, select, func as db_funcs
+from typing import Any
 from logging import getLogger
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 import asyncio
 
-MAX_CONCURRENT_LEADERBOARD_JOBS = 4
 LOGGER = getLogger(__name__)
 
+# Maps the settings on `LeaderboardRefreshSettings` to the environment variables
+# that can be used to override them.
+SETTINGS_ENV_VARS = {
+    "workers": "LEADERBOARD_REFRESH_WORKERS",
+    "queue_size": "LEADERBOARD_REFRESH_QUEUE_SIZE",
+    "batch_size": "LEADERBOARD_REFRESH_BATCH_SIZE",
+    "user_timeout": "LEADERBOARD_REFRESH_USER_TIMEOUT",
+    "active_within": "LEADERBOARD_ACTIVE_WITHIN",
+    "active_refresh_interval": "LEADERBOARD_ACTIVE_REFRESH_INTERVAL",
+    "idle_refresh_interval": "LEADERBOARD_IDLE_REFRESH_INTERVAL",
+}
+
+# Every leaderboard job that's currently running, so they can be cancelled on shutdown
+RUNNING_LEADERBOARD_JOBS: set[asyncio.Task] = set()
+
+
+class LeaderboardRefreshSettings(BaseModel):
+    """
+    Everything that can be tuned about refreshing everyone's durations before the
+    leaderboard gets rebuilt.
+    """
+
+    # How many users get refreshed at once
+    workers: int = Field(default=4, gt=0)
+
+    # How many users can be waiting on a worker, looking up more users waits until
+    # there's room
+    queue_size: int = Field(default=16, gt=0)
+
+    # How many users get planned (and have their tokens looked up) at a time, each batch
+    # in a session of its own
+    batch_size: int = Field(default=CREDENTIAL_LOOKUP_BATCH_SIZE, gt=0)
+
+    # How long (in seconds) a single user's refresh can take before we give up on it
+    user_timeout: float = Field(default=120.0, gt=0)
+
+    # Anyone who has coded within this long (in seconds) is refreshed every
+    # `active_refresh_interval` seconds, everyone else every `idle_refresh_interval`
+    active_within: float = Field(default=DEFAULT_ACTIVE_WITHIN.total_seconds(), gt=0)
+    active_refresh_interval: float = Field(
+        default=DEFAULT_REFRESH_INTERVALS[RefreshTier.ACTIVE].total_seconds(), gt=0
+    )
+    idle_refresh_interval: float = Field(
+        default=DEFAULT_REFRESH_INTERVALS[RefreshTier.IDLE].total_seconds(), gt=0
+    )
+
+    @classmethod
+    def from_env(cls, **overrides: Any) -> "LeaderboardRefreshSettings":
+        """
+        Builds the settings from any environment variables that are set,
+        `overrides` take priority over the environment.
+        """
+        values: dict[str, Any] = {}
+
+        for setting, env_key in SETTINGS_ENV_VARS.items():
+            env_value = get_optional_env(env_key)
+
+            if env_value is not None:
+                values[setting] = env_value
+
+        values.update(overrides)
+
+        return cls.model_validate(values)
+
 
 async def leaderboard_job() -> None:
     """
@@ -23,6 +98,25 @@ async def leaderboard_job() -> None:
 
     LOGGER.info("Recalculating weekly leaderboards...")
 
+    # Keep track of ourselves so we can be cancelled if the app shuts down part way
+    job = asyncio.current_task()
+
+    if job is not None:
+        RUNNING_LEADERBOARD_JOBS.add(job)
+
+    try:
+        # Any requests this job makes to wakatime get queued behind the ones coming
+        # from users actually waiting on the app.
+        with request_priority(RequestPriority.BACKGROUND):
+            await _rebuild_weekly_leaderboard()
+    finally:
+        RUNNING_LEADERBOARD_JOBS.discard(job)  # type: ignore[arg-type]
+
+    # Make sure nobody gets served the old leaderboard out of the cache
+    await invalidate_leaderboard_caches()
+
+
+async def _rebuild_weekly_leaderboard() -> None:
     # First we need to figure out when "this" week actually is. We're building a timeframe
     # here because most of the functions down the line use it
     today = date.today()
@@ -32,58 +126,17 @@ async def leaderboard_job() -> None:
         start=start_of_week.strftime(r"%Y-%m-%d"), end=today.strftime(r"%Y-%m-%d")
     )
 
-    async with get_session() as session:
-        # This will gather all the users that we need to recache
-        # NOTE: incomplete_today_check will check any record for today against
-        # the refresh threshold to see if it is out of date.
-        users_to_recache = await get_user_ids_with_incomplete_durations(
-            session=session,
-            timeframe=timeframe,
-            incomplete_today_check=True,
-            today_refresh_threshold=timedelta(hours=1),
-        )
-
-        # We need to keep track of two things for the next part:
-        # 1. How many concurrent requests are actually happening, we use a semaphore
-        #    to do this, which will help keep us from flooding Wakatime or our database
-        # 2. We need to keep track of all of our tasks and whether or not they are
-        #    actually completed or not, as only then can we move onto calculating the
-        #    leaderboard.
-        semaphore = asyncio.Semaphore(MAX_CONCURRENT_LEADERBOARD_JOBS)
-        fetch_tasks = []
-
-        # This wakatime_token_lookup_generator is an async generator that will provide us with
-        # user tokens straight from the database -- or in the event that a token is expired,
-        # will provide us with fresh tokens.
-        # TODO: The refreshing bit doesn't work, but it doesn't really matter, as the waka tokens dont expire for a year
-        async for tokens in wakatime_token_lookup_generator(
-            session=session,
-            user_ids=users_to_recache,
-            expired_oauth_behaviour="skip",
-            skip_missing_credentials=True,
-        ):
-            # We wrap the evil_duration_fetching_function with a context manager for the
-            # semaphore, which will release() when the inner coroutine is completed
-            async def evil_wrapped_with_semaphore():
-                async with semaphore:
-                    await evil_duration_fetching_function(
-                        session=session, tokens=tokens, timeframe=timeframe
-                    )
-
-            # We create a task and tell asyncio to start it right away. It returns a handle that
-            # we keep track of in an array. This way we're not waiting on any specific job, but ALL
-            # incomplete jobs
-            fetching_task = asyncio.create_task(evil_wrapped_with_semaphore())
-
-            fetch_tasks.append(fetching_task)
+    refreshed, failed = await _refresh_weekly_durations(timeframe)
 
-        # Waiting for all of the incomplete coroutines to finish
-        await asyncio.gather(*fetch_tasks)
-
-        # Commit any new durations to the database. If we got to this point, none of the above
-        # code should have errored and we don't want to lose that data
-        await session.flush()
+    if failed:
+        LOGGER.warning(
+            f"Failed to refresh durations for {failed}/{refreshed + failed} users, "
+            "they'll be ranked on whatever we already had for them"
+        )
 
+    # The leaderboard gets rebuilt in its own transaction, using whatever durations
+    # made it into the database above.
+    async with get_session() as session:
         # Delete all the pre-existing records for this week
         await session.execute(
             delete(WeeklyLeaderboard).where(
@@ -91,23 +144,8 @@ async def leaderboard_job() -> None:
             )
         )
 
-        # This is just a func we use twice in the aggregation to add all of the
-        # WakatimeDurations' totals together
-        total_seconds_sum = db_funcs.sum(WakatimeDuration.total_seconds)
-
         # The select() statement in here is what is getting inserted into the
         # WeeklyLeaderboards table.
-        crazy_aggregation_stmt = (
-            select(
-                literal(start_of_week).label("week_start"),
-                WakatimeDuration.user_id.label("user_id"),
-                total_seconds_sum.label("total"),
-                db_funcs.rank().over(order_by=total_seconds_sum).label("rank"),
-            )
-            .where(WakatimeDuration.date.between(start_of_week, today))
-            .group_by(WakatimeDuration.user_id)
-        )
-
         stmt = insert(WeeklyLeaderboard).from_select(
             [
                 WeeklyLeaderboard.week_start,
@@ -115,7 +153,7 @@ async def leaderboard_job() -> None:
                 WeeklyLeaderboard.total,
                 WeeklyLeaderboard.rank,
             ],
-            crazy_aggregation_stmt,
+            select_weekly_leaderboard_totals(start_of_week),
         )
 
         await session.execute(stmt)
@@ -124,4 +162,169 @@ async def leaderboard_job() -> None:
         # changes and close the database
         await session.commit()
 
-        LOGGER.info("Weekly leaderboard successfully recalculated!")
+    LOGGER.info("Weekly leaderboard successfully recalculated!")
+
+
+async def _refresh_weekly_durations(
+    timeframe: WakatimeStartEndTimeframe,
+    settings: LeaderboardRefreshSettings | None = None,
+) -> tuple[int, int]:
+    """
+    Recaches the durations in `timeframe` for everyone who's due a refresh (active
+    users hourly, idle users daily), and returns how many users were (refreshed, failed).
+
+    The users get planned (and have their tokens looked up) a batch at a time, and are
+    put onto a small queue that a fixed number of workers take them off of one at a time.
+    Whenever the queue is full the lookup just waits, so only about a batch of users is
+    ever in memory at once no matter how many there are.
+    """
+    settings = settings or LeaderboardRefreshSettings.from_env()
+
+    # `None` tells a worker that there's nobody left
+    queue: asyncio.Queue[WakatimeTokens | None] = asyncio.Queue(
+        maxsize=settings.queue_size
+    )
+
+    refreshed = 0
+    failed = 0
+
+    async def produce() -> None:
+        # Everyone's planned as of the same moment, no matter how long it takes to get
+        # through them all
+        now = datetime.now()
+        after: PlannedRefresh | None = None
+        tier_counts = {tier: 0 for tier in RefreshTier}
+
+        while True:
+            # NOTE: Nothing in here holds a session open while it waits on the queue, which
+            #       can take hours. Each batch is planned and looked up in a short session
+            #       of its own, and picks up right where the last one left off.
+            async with get_session() as session:
+                # This will gather the next batch of users that we need to recache, starting
+                # with whoever coded most recently
+                planned = await plan_duration_refreshes(
+                    session=session,
+                    timeframe=timeframe,
+                    now=now,
+                    active_within=timedelta(seconds=settings.active_within),
+                    refresh_intervals={
+                        RefreshTier.ACTIVE: timedelta(
+                            seconds=settings.active_refresh_interval
+                        ),
+                        RefreshTier.IDLE: timedelta(
+                            seconds=settings.idle_refresh_interval
+                        ),
+                    },
+                    after=after,
+                    limit=settings.batch_size,
+                )
+
+                # This wakatime_token_lookup_generator is an async generator that will provide us
+                # with user tokens straight from the database. Anyone whose token has expired is
+                # skipped until they log in again (wakatime tokens last a year, so that's rare).
+                batch = [
+                    tokens
+                    async for tokens in wakatime_token_lookup_generator(
+                        session=session,
+                        user_ids=[p["user_id"] for p in planned],
+                        expired_oauth_behaviour="skip",
+                        skip_missing_credentials=True,
+                    )
+                ]
+
+            if not planned:
+                break
+
+            for p in planned:
+                tier_counts[p["tier"]] += 1
+
+            for tokens in batch:
+                # This waits whenever the queue is full, so we never get too far ahead
+                # of the workers
+                await queue.put(tokens)
+
+            after = planned[-1]
+
+        LOGGER.info(
+            f"Planned duration refreshes for {sum(tier_counts.values())} users ("
+            + ", ".join(f"{count} {tier.value}" for tier, count in tier_counts.items())
+            + ")"
+        )
+
+        for _ in range(settings.workers):
+            await queue.put(None)
+
+    async def refresh(tokens: WakatimeTokens) -> bool:
+        try:
+            # NOTE: Giving up only stops *us* from waiting, any recache that was started
+            #       is shared with whoever else needs it, so it carries on without us.
+            async with asyncio.timeout(settings.user_timeout):
+                # Every user gets their own short-lived session (and connection), so
+                # nobody's queries end up queued behind somebody else's, and a failure
+                # only throws away that one user's durations.
+                async with get_session() as session:
+                    await evil_duration_fetching_function(
+                        session=session, tokens=tokens, timeframe=timeframe
+                    )
+
+                    await session.commit()
+        except TimeoutError:
+            LOGGER.warning(
+                f"Timed out refreshing durations for user: {tokens['user_id']}"
+            )
+            return False
+        except Exception:
+            LOGGER.exception(
+                f"Failed to refresh durations for user: {tokens['user_id']}"
+            )
+            return False
+
+        return True
+
+    async def work() -> None:
+        nonlocal refreshed, failed
+
+        while (tokens := await queue.get()) is not None:
+            if await refresh(tokens):
+                refreshed += 1
+            else:
+                failed += 1
+
+    # If anything in here is cancelled (e.g., the app is shutting down), or the producer
+    # fails, everything else in the group gets cancelled along with it.
+    async with asyncio.TaskGroup() as group:
+        group.create_task(produce())
+
+        for _ in range(settings.workers):
+            group.create_task(work())
+
+    return refreshed, failed
+
+
+async def cancel_leaderboard_jobs() -> None:
+    """
+    Cancels any leaderboard job that's still running and waits for it to stop, this
+    should be called on shutdown before the database goes away.
+    """
+    jobs = list(RUNNING_LEADERBOARD_JOBS)
+
+    for job in jobs:
+        job.cancel()
+
+    await asyncio.gather(*jobs, return_exceptions=True)
+
+
+def select_weekly_leaderboard_totals(start_of_week: date):
+    """
+    Builds the (crazy) aggregation statement that ranks every user by their coding time
+    for the week starting on `start_of_week`.
+
+    The totals come straight out of the weekly rollups, so there's nothing to sum up.
+    """
+
+    return select(
+        literal(start_of_week).label("week_start"),
+        WeeklyDurationRollup.user_id.label("user_id"),
+        WeeklyDurationRollup.total_seconds.label("total"),
+        db_funcs.rank().over(order_by=WeeklyDurationRollup.total_seconds).label("rank"),
+    ).where(WeeklyDurationRollup.week_start == start_of_week)
@@ -0,0 +1,91 @@
+from ..db import get_session
+from ..db.models import OAuth2Credentials
+from ..db.helpers import refresh_oauth_credentials
+from ..dependencies.auth import forget_wakatime_tokens
+from ..wakatime.ratelimit import request_priority, RequestPriority
+
+from sqlalchemy import select
+from logging import getLogger
+from datetime import datetime, timedelta
+from uuid import UUID
+import asyncio
+
+# Tokens that expire within this window get renewed. This needs to be longer than how
+# often the job runs, so that nobody's tokens can expire in between runs.
+OAUTH_RENEWAL_WINDOW = timedelta(minutes=30)
+
+# Tokens that expired longer ago than this are left alone, if we haven't been able to
+# renew them by now then we're not going to. (This also skips revoked tokens)
+OAUTH_RENEWAL_GIVE_UP_AFTER = timedelta(days=7)
+
+# How many users' tokens are renewed per batch, and how many of those at once
+OAUTH_RENEWAL_BATCH_SIZE = 100
+MAX_CONCURRENT_OAUTH_RENEWALS = 4
+
+LOGGER = getLogger(__name__)
+
+
+async def oauth_renewal_job() -> None:
+    """
+    Should run every 10 minutes or so to renew wakatime tokens before they expire,
+    so that requests don't have to wait on wakatime to refresh them.
+    """
+
+    # These aren't for anybody who's waiting, so they can wait behind those who are.
+    with request_priority(RequestPriority.BACKGROUND):
+        await _renew_expiring_oauth_credentials()
+
+
+async def _renew_expiring_oauth_credentials() -> None:
+    now = datetime.now()
+
+    # Find everyone whose tokens are (about to be) expired
+    stmt = (
+        select(OAuth2Credentials.user_id)
+        .where(OAuth2Credentials.provider == "wakatime")
+        .where(
+            OAuth2Credentials.expires_at.between(
+                now - OAUTH_RENEWAL_GIVE_UP_AFTER, now + OAUTH_RENEWAL_WINDOW
+            )
+        )
+        .order_by(OAuth2Credentials.expires_at)
+    )
+
+    async with get_session() as session:
+        user_ids = list(await session.scalars(stmt))
+
+    if not user_ids:
+        return
+
+    LOGGER.info(f"Renewing wakatime tokens for {len(user_ids)} users...")
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_OAUTH_RENEWALS)
+
+    async def renew(user_id: UUID) -> bool:
+        async with semaphore:
+            try:
+                await refresh_oauth_credentials(
+                    user_id, pos_offset=OAUTH_RENEWAL_WINDOW
+                )
+            except Exception:
+                LOGGER.exception(f"Failed to renew wakatime tokens for user: {user_id}")
+                return False
+
+            # Make sure nobody keeps using the tokens we just replaced
+            await forget_wakatime_tokens(user_id)
+
+            return True
+
+    renewed = 0
+
+    # Go through them a batch at a time so we don't pile thousands of tasks up at once
+    for i in range(0, len(user_ids), OAUTH_RENEWAL_BATCH_SIZE):
+        batch = user_ids[i : i + OAUTH_RENEWAL_BATCH_SIZE]
+        results = await asyncio.gather(*[renew(user_id) for user_id in batch])
+
+        renewed += sum(results)
+
+    LOGGER.info(f"Renewed wakatime tokens for {renewed}/{len(user_ids)} users!")
+
+
+__all__ = ["oauth_renewal_job"]
@@ -0,0 +1,36 @@
+from ..db import get_connection
+from ..db.partitions import create_monthly_partitions, PARTITION_MONTHS_AHEAD
+
+from logging import getLogger
+from datetime import date
+
+LOGGER = getLogger(__name__)
+
+
+async def partition_maintenance_job() -> None:
+    """
+    Should run once a day or so to make sure the partitions for the next few months
+    exist before anything needs to be put in them.
+
+    Failures are re-raised, since durations can't be written at all once the partitions
+    run out.
+    """
+
+    LOGGER.info("Checking for missing duration partitions...")
+
+    try:
+        async with get_connection() as connection:
+            await create_monthly_partitions(
+                connection,
+                start=date.today().replace(day=1),
+                months=PARTITION_MONTHS_AHEAD + 1,
+            )
+    except Exception:
+        LOGGER.critical(
+            "Failed to create the duration partitions for the next "
+            f"{PARTITION_MONTHS_AHEAD} months! Durations for months without one "
+            "can't be saved.",
+            exc_info=True,
+        )
+
+        raise
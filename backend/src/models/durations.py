@@ -14,10 +14,17 @@ class DurationResponseModel(BaseModel):
 
     last_cached_at: datetime
 
+    # True when this is today's duration and it's being refreshed in the
+    # background (only happens when stale data was allowed).
+    is_stale: bool = False
+
 
 class BulkDurationResponseModel(BaseModel):
     durations: list[DurationResponseModel]
 
+    # True when any of the durations are stale
+    is_stale: bool = False
+
 
 __all__ = [
     "LanguageBreakdownModel",
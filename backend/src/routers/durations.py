@@ -1,12 +1,17 @@
 from typing import Annotated
 
 from fastapi.routing import APIRouter
-from fastapi import HTTPException, Path
+from fastapi import HTTPException, Path, Query
 from datetime import date, datetime
 
-from ..db import get_session as get_db_session
-from ..db.helpers import evil_duration_fetching_function
+from ..db.helpers import (
+    evil_duration_fetching_function,
+    is_duration_stale,
+    DEFAULT_DURATION_REFRESH_THRESHOLD,
+)
 from ..dependencies.auth import TokenDependencyType
+from ..dependencies.database import SessionDependencyType
+from ..dependencies.freshness import MaxStalenessDependencyType
 from ..wakatime import WakatimeISOWeekTimeframe, WakatimeSingleDayTimeframe
 from ..models.durations import (
     DurationResponseModel,
@@ -16,9 +21,24 @@ from ..models.durations import (
 
 router = APIRouter(tags=["durations"])
 
+# Lets the client take whatever we have cached for today straight away, rather than
+# waiting on wakatime for a fresh copy. The fresh copy gets pulled in the background.
+AllowStaleQueryType = Annotated[
+    bool,
+    Query(
+        description="Return today's cached duration right away (flagged with `is_stale`) "
+        "and refresh it in the background, instead of waiting on wakatime"
+    ),
+]
+
 
 @router.get("/durations/week")
-async def get_durations_for_current_week(tokens: TokenDependencyType):
+async def get_durations_for_current_week(
+    tokens: TokenDependencyType,
+    session: SessionDependencyType,
+    max_staleness: MaxStalenessDependencyType,
+    allow_stale: AllowStaleQueryType = False,
+):
     """
     Returns the user's durations for the current week
     """
@@ -27,81 +47,110 @@ async def get_durations_for_current_week(tokens: TokenDependencyType):
     # We just hand off this request to the other request handler using the
     # current date, nothing complicated :/
     return await get_durations_for_week(
-        iso_week=iso_date.week, year=iso_date.year, tokens=tokens
+        iso_week=iso_date.week,
+        year=iso_date.year,
+        tokens=tokens,
+        session=session,
+        max_staleness=max_staleness,
+        allow_stale=allow_stale,
     )
 
 
 @router.get("/durations/week/{year}/{iso_week}")
 async def get_durations_for_week(
-    tokens: TokenDependencyType, year: int, iso_week: int = Path(ge=1, le=52)
+    tokens: TokenDependencyType,
+    session: SessionDependencyType,
+    max_staleness: MaxStalenessDependencyType,
+    year: int,
+    iso_week: int = Path(ge=1, le=52),
+    allow_stale: AllowStaleQueryType = False,
 ) -> BulkDurationResponseModel:
     """
     Returns the user's durations for the provided week.
     """
 
-    async with get_db_session() as session:
-        try:
-            # Ah yes, the evil duration fetching function...
-            user_durations = await evil_duration_fetching_function(
-                session=session,
-                tokens=tokens,
-                timeframe=WakatimeISOWeekTimeframe(iso_week=iso_week, year=year),
-            )
-        except ValueError:
-            raise HTTPException(
-                status_code=500, detail="Failed to fetch new durations from wakatime."
-            )
-
-        # If we retrieved less than one result from the duration fetching function, then
-        # we must have no coding data for the week yet, so return an empty bulk duration model
-        # NOTE: We need to return this otherwise SQLAlchemy gets mad because `duration.languages`
-        #       tries to get eagerly loaded and fails, because the duration fetching function
-        #       does evil tomfoolery to spoof that value using cached data when necessary.
-        if len(user_durations) < 1:
-            return BulkDurationResponseModel(durations=[])
-
-        # Construct a new list to hold all the durations responses
-        # (one for each day of the week)
-        duration_responses = [
-            DurationResponseModel(
-                date=duration.date,
-                languages=[
-                    LanguageBreakdownModel(
-                        name=lang.language, total_seconds=lang.total_seconds
-                    )
-                    for lang in duration.languages
-                ],
-                last_cached_at=duration.last_cached_at,
-                total_seconds=duration.total_seconds,
-            )
-            for duration in user_durations
-        ]
-
-        # hahaha dont forget to commit the changes like I did when I first
-        # wrote this function smh...
-        await session.commit()
-
-        return BulkDurationResponseModel(durations=duration_responses)
+    if max_staleness is None:
+        max_staleness = DEFAULT_DURATION_REFRESH_THRESHOLD
+
+    try:
+        # Ah yes, the evil duration fetching function...
+        user_durations = await evil_duration_fetching_function(
+            session=session,
+            tokens=tokens,
+            timeframe=WakatimeISOWeekTimeframe(iso_week=iso_week, year=year),
+            today_refresh_threshold=max_staleness,
+            stale_while_revalidate=allow_stale,
+        )
+    except ValueError:
+        raise HTTPException(
+            status_code=500, detail="Failed to fetch new durations from wakatime."
+        )
+
+    # If we retrieved less than one result from the duration fetching function, then
+    # we must have no coding data for the week yet, so return an empty bulk duration model
+    # NOTE: We need to return this otherwise SQLAlchemy gets mad because `duration.languages`
+    #       tries to get eagerly loaded and fails, because the duration fetching function
+    #       does evil tomfoolery to spoof that value using cached data when necessary.
+    if len(user_durations) < 1:
+        return BulkDurationResponseModel(durations=[])
+
+    # Construct a new list to hold all the durations responses
+    # (one for each day of the week)
+    duration_responses = [
+        DurationResponseModel(
+            date=duration.date,
+            languages=[
+                LanguageBreakdownModel(
+                    name=lang.language, total_seconds=lang.total_seconds
+                )
+                for lang in duration.languages
+            ],
+            last_cached_at=duration.last_cached_at,
+            total_seconds=duration.total_seconds,
+            is_stale=is_duration_stale(duration, today_refresh_threshold=max_staleness),
+        )
+        for duration in user_durations
+    ]
+
+    # NOTE: Any recached durations get committed along with the rest of the request
+    return BulkDurationResponseModel(
+        durations=duration_responses,
+        is_stale=any(d.is_stale for d in duration_responses),
+    )
 
 
 @router.get("/durations/day")
-async def get_duration_for_today(tokens: TokenDependencyType) -> DurationResponseModel:
+async def get_duration_for_today(
+    tokens: TokenDependencyType,
+    session: SessionDependencyType,
+    max_staleness: MaxStalenessDependencyType,
+    allow_stale: AllowStaleQueryType = False,
+) -> DurationResponseModel:
     """
     Returns the user's durations for today.
     """
     today = date.today()
 
     return await get_durations_for_day(
-        tokens=tokens, year=today.year, month=today.month, day=today.day
+        tokens=tokens,
+        session=session,
+        year=today.year,
+        month=today.month,
+        day=today.day,
+        max_staleness=max_staleness,
+        allow_stale=allow_stale,
     )
 
 
 @router.get("/durations/day/{year}/{month}/{day}")
 async def get_durations_for_day(
     tokens: TokenDependencyType,
+    session: SessionDependencyType,
+    max_staleness: MaxStalenessDependencyType,
     year: int,
     month: Annotated[int, Path(ge=1, le=12)],
     day: Annotated[int, Path(ge=1, le=31)],
+    allow_stale: AllowStaleQueryType = False,
 ) -> DurationResponseModel:
     """
     Returns a single duration response for the provided day
@@ -110,52 +159,52 @@ async def get_durations_for_day(
     # Construct a date object from args
     date_object = date(year=year, month=month, day=day)
 
-    async with get_db_session() as session:
-        try:
-            durations_list = await evil_duration_fetching_function(
-                session=session,
-                tokens=tokens,
-                timeframe=WakatimeSingleDayTimeframe(day=date_object),
-            )
-
-        except ValueError:
-            # A ValueError usually gets raised by the above call if the response
-            # from wakatime is non-OK on a recache.
-            raise HTTPException(
-                status_code=500, detail="Failed to fetch new durations from wakatime."
-            )
-
-        # If we got an empty list from the evil_duration_fetching function, that means
-        # that there was no coding done during that day.
-        if len(durations_list) != 1:
-            return DurationResponseModel(
-                date=date_object,
-                total_seconds=0,
-                languages=[],
-                last_cached_at=datetime.now(tz=None),
-            )
-
-        # Since we know the length has to be one, then we know
-        # we can get the single duration
-        duration = durations_list[0]
-
-        # We construct the model here because we need to do it BEFORE
-        # committing so we dont lose access to the `WakatimeDuration`
-        # sqlalchemy model.
-        resp_model = DurationResponseModel(
-            date=duration.date,
-            languages=[
-                LanguageBreakdownModel(
-                    name=lang.language, total_seconds=lang.total_seconds
-                )
-                for lang in duration.languages
-            ],
-            total_seconds=duration.total_seconds,
-            last_cached_at=duration.last_cached_at,
+    if max_staleness is None:
+        max_staleness = DEFAULT_DURATION_REFRESH_THRESHOLD
+
+    try:
+        durations_list = await evil_duration_fetching_function(
+            session=session,
+            tokens=tokens,
+            timeframe=WakatimeSingleDayTimeframe(day=date_object),
+            today_refresh_threshold=max_staleness,
+            stale_while_revalidate=allow_stale,
         )
 
-        # The nefarious aforementioned commit.
-        await session.commit()
+    except ValueError:
+        # A ValueError usually gets raised by the above call if the response
+        # from wakatime is non-OK on a recache.
+        raise HTTPException(
+            status_code=500, detail="Failed to fetch new durations from wakatime."
+        )
+
+    # If we got an empty list from the evil_duration_fetching function, that means
+    # that there was no coding done during that day.
+    if len(durations_list) != 1:
+        return DurationResponseModel(
+            date=date_object,
+            total_seconds=0,
+            languages=[],
+            last_cached_at=datetime.now(tz=None),
+        )
+
+    # Since we know the length has to be one, then we know
+    # we can get the single duration
+    duration = durations_list[0]
+
+    # We construct the model here because we need to do it BEFORE the
+    # request's session commits, otherwise we lose access to the `WakatimeDuration`
+    # sqlalchemy model.
+    resp_model = DurationResponseModel(
+        date=duration.date,
+        languages=[
+            LanguageBreakdownModel(name=lang.language, total_seconds=lang.total_seconds)
+            for lang in duration.languages
+        ],
+        total_seconds=duration.total_seconds,
+        last_cached_at=duration.last_cached_at,
+        is_stale=is_duration_stale(duration, today_refresh_threshold=max_staleness),
+    )
 
     return resp_model
 
@@ -1,97 +1,147 @@
 from typing import Annotated
+from uuid import UUID
 
 from fastapi import Body, HTTPException, Path
 from fastapi.routing import APIRouter
 from fastapi.responses import PlainTextResponse
-from sqlalchemy import delete, select, func as db_func, bindparam, case, Float, update
+from sqlalchemy import delete, select, func as db_func, case, Float, update
 from sqlalchemy.dialects.postgresql import insert
-from datetime import date
-
-from src.db.models import Goals, WakatimeDuration, GoalEnum
-from src.db import get_session
-from src.dependencies.auth import UserIDDependencyType
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, timedelta
+
+from src.caching.memoize import memoize
+from src.db.models import Goals, WakatimeDuration, WeeklyDurationRollup, GoalEnum
+from src.db import run_read
+from src.db.helpers import evil_duration_fetching_function, get_week_start
+from src.dependencies.auth import (
+    UserIDDependencyType,
+    AuthContextDependencyType,
+    get_current_user_wakatime_tokens,
+)
+from src.dependencies.database import SessionDependencyType
+from src.dependencies.freshness import MaxStalenessDependencyType
 from src.models.goals import GoalResponseModel, GoalCreationRequest, GoalUpdateRequest
+from src.wakatime import WakatimeISOWeekTimeframe
 
 router = APIRouter(tags=["goals"])
 
 # A limit on the maximum number of goals a user can have set
 MAX_COUNT_OF_USER_GOALS = 8
 
+# How long a user's goal progress gets cached for
+GOAL_PROGRESS_CACHE_TTL = timedelta(seconds=30)
+
 
 @router.get("/goals")
 async def get_goals(
-    user_id: UserIDDependencyType,
+    auth: AuthContextDependencyType,
+    session: SessionDependencyType,
+    max_staleness: MaxStalenessDependencyType,
 ) -> list[GoalResponseModel]:
+    """
+    Returns the user's goals, along with how far along they are on each of them.
+
+    If `max_staleness` is provided, this week's coding data is refreshed from wakatime
+    first if it is older than that, otherwise progress is worked out from whatever
+    coding data is already cached.
+    """
 
-    # TODO: If a user has not queried their durations recently the database may not be able
-    #       to accurately determine if they've "reached" a goal or not. -- i.e., progress
-    #       will not be properly shown.
-
-    date_binding = bindparam("date")
-    user_binding = bindparam("user_id")
-
-    # We define a common table expression here to handle retrieving the aggregate durations
-    # for the user, that way we can calculate how close a user has come to completing their goal
-    # (or how many times over they have completed it)
-    duration_totals_cte = (
-        select(
-            WakatimeDuration.user_id,
-            # we coalesce here in case sum() returns a null value from having no rows to add.
-            # this column gets labelled as "daily_goal_seconds", we'll refer to it later.
-            db_func.coalesce(
-                # take the sum of all the seconds
-                db_func.sum(WakatimeDuration.total_seconds)
-                # then we filter here by date (only rows matching this filter will be summed)
-                .filter(WakatimeDuration.date == date_binding),
-                # coalesce default
-                0,
-            ).label("daily_goal_seconds"),
-            # very similar to above, but for weekly-scoped goals, labelled as "weekly_goal_seconds"
-            db_func.coalesce(
-                db_func.sum(WakatimeDuration.total_seconds)
-                # This filter here checks to see if the date of the duration we're pulling is
-                # older than the start of the week for the provided date (truncate pushes date_binding to monday)
-                .filter(
-                    WakatimeDuration.date >= db_func.date_trunc("week", date_binding)
+    user_id = auth["user_id"]
+
+    # NOTE: If a user has not queried their durations recently (and doesn't send a
+    #       max_staleness) the database may not be able to accurately determine if they've
+    #       "reached" a goal or not. -- i.e., progress will not be properly shown.
+
+    # Bring this week's durations up to the freshness the client asked for, which
+    # covers both the daily and weekly goals.
+    if max_staleness is not None:
+        # We only need the user's wakatime tokens if we're refreshing
+        tokens = await get_current_user_wakatime_tokens(auth, session)
+        iso_date = date.today().isocalendar()
+
+        try:
+            await evil_duration_fetching_function(
+                session=session,
+                tokens=tokens,
+                timeframe=WakatimeISOWeekTimeframe(
+                    iso_week=iso_date.week, year=iso_date.year
                 ),
-                0,
-            ).label("weekly_goal_seconds"),
+                today_refresh_threshold=max_staleness,
+            )
+        except ValueError:
+            raise HTTPException(
+                status_code=500,
+                detail="Failed to fetch new durations from wakatime.",
+            )
+
+        # The durations might have just changed, so any cached progress is out of date.
+        # (This reads from the primary, since the replica might not have the new
+        # durations yet)
+        return await get_goals_with_progress.refresh(
+            user_id, date.today(), primary=True
         )
-        .where(WakatimeDuration.user_id == user_binding)
-        .group_by(WakatimeDuration.user_id)
-        .cte("duration_totals")
+
+    return await get_goals_with_progress(user_id, date.today())
+
+
+# Progress only moves as durations get recached, so it's fine for it to lag a little.
+# Anything that changes the goals themselves refreshes the user's entry right away.
+@memoize(
+    ttl=GOAL_PROGRESS_CACHE_TTL,
+    key=lambda user_id, today, **_: f"{user_id}:{today}",
+)
+async def get_goals_with_progress(
+    user_id: UUID, today: date, *, primary: bool = False
+) -> list[GoalResponseModel]:
+    """
+    Gets all of the user's goals and works out their progress as of `today` from
+    the durations we have in the database.
+
+    This reads from the read replica (if there is one), unless `primary` is set.
+
+    NOTE: This always uses a session of its own, never the request's. Concurrent
+          callers share the call, so it can't belong to any one request.
+    """
+
+    # We work out how much the user has coded today and this week, that way we can calculate
+    # how close a user has come to completing their goal (or how many times over they have
+    # completed it). We coalesce here in case there's nothing to add up yet.
+    daily_goal_seconds = (
+        select(db_func.coalesce(db_func.sum(WakatimeDuration.total_seconds), 0))
+        .where(WakatimeDuration.user_id == user_id)
+        .where(WakatimeDuration.date == today)
+        .scalar_subquery()
     )
 
-    # This statement specifically decides which of either the weekly or daily columns should be selected.
+    # The week's total comes straight out of the weekly rollup, rather than summing up
+    # every day of the week.
+    weekly_goal_seconds = (
+        select(db_func.coalesce(db_func.sum(WeeklyDurationRollup.total_seconds), 0))
+        .where(WeeklyDurationRollup.user_id == user_id)
+        .where(WeeklyDurationRollup.week_start == get_week_start(today))
+        .scalar_subquery()
+    )
+
+    # This statement specifically decides which of either the weekly or daily totals should be selected.
     # This feels like more of an *expression* than a statement, but it basically lets us conditionally calculate
     # the progress based on goal scopes.
     progress_stmt = case(
         (
             Goals.timeframe == GoalEnum.DAILY,
-            duration_totals_cte.c.daily_goal_seconds.cast(Float)
-            / (Goals.minutes * 60)
-            * 100,
+            daily_goal_seconds.cast(Float) / (Goals.minutes * 60) * 100,
         ),
         (
             Goals.timeframe == GoalEnum.WEEKLY,
-            duration_totals_cte.c.weekly_goal_seconds.cast(Float)
-            / (Goals.minutes * 60)
-            * 100,
+            weekly_goal_seconds.cast(Float) / (Goals.minutes * 60) * 100,
         ),
     ).label("goal_progress_percentage")
 
     # The actual statement we're using to query all this data.
-    # We join the CTE we made earlier, and then use the progress statement we defined to
-    # pull only the data we need from it (conditionally based off of goal scope).
-    stmt = (
-        select(Goals, progress_stmt)
-        .join(duration_totals_cte, duration_totals_cte.c.user_id == Goals.user_id)
-        .where(Goals.user_id == user_binding)
-    )
+    stmt = select(Goals, progress_stmt).where(Goals.user_id == user_id)
 
-    async with get_session() as session:
+    async def read(session: AsyncSession) -> list[GoalResponseModel]:
         # Here we pass through the bindings we made and execute the statement
-        resp = await session.execute(stmt, {"date": date.today(), "user_id": user_id})
+        resp = await session.execute(stmt)
 
         # Return data array
         ret_data = []
@@ -107,13 +157,16 @@ async def get_goals(
                 )
             )
 
-    # Finally, return allat
-    return ret_data
+        # Finally, return allat
+        return ret_data
+
+    return await run_read(read, primary=primary)
 
 
 @router.post("/goals")
 async def create_new_goal(
     user_id: UserIDDependencyType,
+    session: SessionDependencyType,
     payload: GoalCreationRequest = Body(
         examples=[GoalCreationRequest(timeframe=GoalEnum.WEEKLY, minutes=180)]
     ),
@@ -128,23 +181,23 @@ async def create_new_goal(
         {"user_id": user_id, "timeframe": payload.timeframe, "minutes": payload.minutes}
     )
 
-    async with get_session() as session:
-        # Before we create a new goal, we restrict the user to having only a certain number of goals set.
-        goal_count = await session.scalar(
-            select(db_func.count()).select_from(Goals).where(Goals.user_id == user_id)
+    # Before we create a new goal, we restrict the user to having only a certain number of goals set.
+    goal_count = await session.scalar(
+        select(db_func.count()).select_from(Goals).where(Goals.user_id == user_id)
+    )
+
+    # NOTE: COUNT() doesn't return NULL here ever, so this is just a condition to appease
+    #       the type-hinting gods.
+    if goal_count is not None and goal_count >= MAX_COUNT_OF_USER_GOALS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maximum number of goals is {MAX_COUNT_OF_USER_GOALS}",
         )
 
-        # NOTE: COUNT() doesn't return NULL here ever, so this is just a condition to appease
-        #       the type-hinting gods.
-        if goal_count is not None and goal_count >= MAX_COUNT_OF_USER_GOALS:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Maximum number of goals is {MAX_COUNT_OF_USER_GOALS}",
-            )
+    # If the user has less than the maximum number of goals, let them have their new goal
+    await session.execute(stmt)
 
-        # If the user has less than the maximum number of goals, let them have their new goal
-        await session.execute(stmt)
-        await session.commit()
+    await refresh_goals_after_write(user_id, session)
 
     return PlainTextResponse(status_code=200)
 
@@ -152,6 +205,7 @@ async def create_new_goal(
 @router.patch("/goals/{goal_id}")
 async def update_goal(
     user_id: UserIDDependencyType,
+    session: SessionDependencyType,
     goal_id: Annotated[int, Path()],
     payload: GoalUpdateRequest = Body(default=GoalUpdateRequest()),
 ) -> PlainTextResponse:
@@ -185,24 +239,25 @@ async def update_goal(
         .returning(Goals.id)
     )
 
-    async with get_session() as session:
-        update_result = await session.scalar(update_query)
+    update_result = await session.scalar(update_query)
 
-        # If we failed to match any rows, then either:
-        #   - the user doesn't own the goal
-        #   - the goal doesn't exist at all
-        # we should return a 404.
-        if update_result is None:
-            raise HTTPException(status_code=404)
+    # If we failed to match any rows, then either:
+    #   - the user doesn't own the goal
+    #   - the goal doesn't exist at all
+    # we should return a 404.
+    if update_result is None:
+        raise HTTPException(status_code=404)
 
-        await session.commit()
+    await refresh_goals_after_write(user_id, session)
 
-        return PlainTextResponse(status_code=200, content="Goal updated successfully")
+    return PlainTextResponse(status_code=200, content="Goal updated successfully")
 
 
 @router.delete("/goals/{goal_id}")
 async def delete_goal(
-    user_id: UserIDDependencyType, goal_id: Annotated[int, Path()]
+    user_id: UserIDDependencyType,
+    session: SessionDependencyType,
+    goal_id: Annotated[int, Path()],
 ) -> PlainTextResponse:
     """
     Deletes the goal using the provided id.
@@ -218,12 +273,25 @@ async def delete_goal(
         .returning(Goals.id)
     )
 
-    async with get_session() as session:
-        delete_result = await session.scalar(stmt)
+    delete_result = await session.scalar(stmt)
 
-        if delete_result is None:
-            raise HTTPException(status_code=404)
+    if delete_result is None:
+        raise HTTPException(status_code=404)
 
-        await session.commit()
+    await refresh_goals_after_write(user_id, session)
 
     return PlainTextResponse(status_code=200, content="Goal deleted successfully")
+
+
+async def refresh_goals_after_write(user_id: UUID, session: AsyncSession) -> None:
+    """
+    Commits the change that was just made, then re-caches the user's goal progress
+    from the primary, so that the user sees their change right away even if the read
+    replica hasn't caught up to it yet.
+    """
+
+    # The cache is shared with every worker, so only ever fill it from what's actually
+    # been committed. (If this fails, nothing gets cached and the request errors out)
+    await session.commit()
+
+    await get_goals_with_progress.refresh(user_id, date.today(), primary=True)
@@ -2,16 +2,10 @@ from fastapi import HTTPException
 from fastapi.routing import APIRouter
 from uuid import UUID
 from datetime import date
-from sqlalchemy import select
 
 from ..dependencies.auth import UserIDDependencyType
-from ..db.models import WeeklyLeaderboard, WakatimeUserProfile
-from ..db import get_session
-from ..models.leaderboards import (
-    LeaderboardRanking,
-    LeaderboardResponse,
-    WakatimeProfile,
-)
+from ..db.leaderboards import get_weekly_leaderboard, get_weekly_leaderboard_placement
+from ..models.leaderboards import LeaderboardRanking, LeaderboardResponse
 
 router = APIRouter(tags=["leaderboards"])
 
@@ -27,42 +21,7 @@ async def get_leaderboard(
         year=today.year, week=today.isocalendar().week, day=1
     )
 
-    async with get_session() as session:
-        stmt = (
-            select(WeeklyLeaderboard, WakatimeUserProfile)
-            .where(WeeklyLeaderboard.week_start == current_week_start)
-            .order_by(WeeklyLeaderboard.rank)
-            .limit(100)
-            .join(
-                WakatimeUserProfile,
-                WakatimeUserProfile.user_id == WeeklyLeaderboard.user_id,
-                isouter=True,
-            )
-        )
-
-        res = await session.execute(stmt)
-
-        return LeaderboardResponse(
-            leaderboard=[
-                LeaderboardRanking(
-                    user_id=leaderboard_placement.user_id,
-                    rank=leaderboard_placement.rank,
-                    total_seconds=leaderboard_placement.total,
-                    profile=None
-                    if profile is None
-                    else WakatimeProfile(
-                        user_id=str(profile.user_id),
-                        display_name=profile.display_name,
-                        full_name=profile.full_name,
-                        username=profile.username,
-                        is_photo_public=profile.is_photo_public,
-                        photo_url=profile.photo_url,
-                        last_cached_at=profile.last_cached_at,
-                    ),
-                )
-                for leaderboard_placement, profile in res
-            ]
-        )
+    return await get_weekly_leaderboard(current_week_start)
 
 
 @router.get("/leaderboard/placement")
@@ -88,50 +47,15 @@ async def get_leaderboard_placement_for_user(
         year=today.year, week=today.isocalendar().week, day=1
     )
 
-    async with get_session() as session:
-        # Select the user's current leaderboard placement for this week,
-        # as well as their profile
-        stmt = (
-            select(WeeklyLeaderboard, WakatimeUserProfile)
-            .where(WeeklyLeaderboard.week_start == current_week_start)
-            .where(WeeklyLeaderboard.user_id == user_id)
-            .join(
-                WakatimeUserProfile,
-                WakatimeUserProfile.user_id == user_id,
-                isouter=True,
-            )
-        )
+    placement = await get_weekly_leaderboard_placement(current_week_start, user_id)
 
-        # NOTE: Can use scalars() here because the join() gets voided
-        res = (await session.execute(stmt)).one_or_none()
-
-        if res is None:
-            raise HTTPException(
-                status_code=404,
-                detail="User has not been calculated in the leaderboard yet. Check back later",
-            )
-
-        # Unpack the response (it is basically a tuple)
-        leaderboard_placement, profile = res
-        profile: WakatimeUserProfile
-
-        # Build the leaderboard ranking response and return it
-        return LeaderboardRanking(
-            user_id=leaderboard_placement.user_id,
-            rank=leaderboard_placement.rank,
-            total_seconds=leaderboard_placement.total,
-            profile=None
-            if profile is None
-            else WakatimeProfile(
-                user_id=str(profile.user_id),
-                display_name=profile.display_name,
-                full_name=profile.full_name,
-                username=profile.username,
-                is_photo_public=profile.is_photo_public,
-                photo_url=profile.photo_url,
-                last_cached_at=profile.last_cached_at,
-            ),
+    if placement is None:
+        raise HTTPException(
+            status_code=404,
+            detail="User has not been calculated in the leaderboard yet. Check back later",
         )
 
+    return placement
+
 
 __all__ = ["router"]
@@ -1,9 +1,27 @@
+from fastapi import Depends, HTTPException
 from fastapi.responses import JSONResponse
 from fastapi.routing import APIRouter
 
+from ..wakatime.client import get_wakatime_client
+from ..db import get_database_singleton
+from ..dependencies.auth import USER_ID_CACHE, WAKATIME_TOKEN_CACHE
+from ..caching.memoize import MEMOIZED_FUNCTIONS
+from ..caching.backends import get_cache_backend
+from ..utils.env import get_optional_env
+
 router = APIRouter(tags=["debug"])
 
 
+def require_debug_endpoints() -> None:
+    """
+    The /debug endpoints show how the app is doing on the inside (pool stats, cache keys
+    and so on), which nobody outside should see. So they don't exist unless
+    DEBUG_ENDPOINTS is set to true.
+    """
+    if (get_optional_env("DEBUG_ENDPOINTS") or "").lower() != "true":
+        raise HTTPException(status_code=404)
+
+
 @router.get("/ping")
 async def ping_ping() -> JSONResponse:
     """
@@ -16,4 +34,50 @@ async def ping_ping() -> JSONResponse:
     return JSONResponse({"api_ok": True})
 
 
+@router.get("/debug/wakatime", dependencies=[Depends(require_debug_endpoints)])
+async def get_wakatime_rate_limiter_stats() -> JSONResponse:
+    """
+    Returns how backed up the queue of requests to wakatime is, and how long
+    requests have had to wait to get sent out.
+    """
+
+    return JSONResponse(dict(get_wakatime_client().limiter.stats()))
+
+
+@router.get("/debug/database", dependencies=[Depends(require_debug_endpoints)])
+async def get_database_pool_stats() -> JSONResponse:
+    """
+    Returns how many database connections are in use, and how long requests
+    have had to wait to get one. (And how far behind the read replica is, if there is one)
+    """
+    db = get_database_singleton()
+    replica_stats = db.replica_stats()
+
+    return JSONResponse(
+        {
+            "primary": dict(db.pool_stats()),
+            "replica": None if replica_stats is None else dict(replica_stats),
+        }
+    )
+
+
+@router.get("/debug/caches", dependencies=[Depends(require_debug_endpoints)])
+async def get_cache_stats() -> JSONResponse:
+    """
+    Returns how full the in-memory caches are, along with their hit/miss/eviction counts.
+    """
+
+    return JSONResponse(
+        {
+            "backend": get_cache_backend().name,
+            "user_id": dict(USER_ID_CACHE.stats()),
+            "wakatime_tokens": dict(WAKATIME_TOKEN_CACHE.stats()),
+            "memoized": {
+                name: dict(memoized.stats())
+                for name, memoized in MEMOIZED_FUNCTIONS.items()
+            },
+        }
+    )
+
+
 __all__ = ["router"]
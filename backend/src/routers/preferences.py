@@ -3,11 +3,13 @@ from fastapi.responses import JSONResponse, Response
 from fastapi.routing import APIRouter
 from sqlalchemy import select, delete
 from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
 
 from src.dependencies.auth import UserIDDependencyType
+from src.dependencies.database import SessionDependencyType
 from src.db.models import UserPreferences
-from src.db import get_session
+from src.db import run_read
 
 router = APIRouter(tags=["preferences"])
 
@@ -22,7 +24,9 @@ async def get_user_preferences(user_id: UserIDDependencyType) -> JSONResponse:
 
     stmt = select(UserPreferences).where(UserPreferences.user_id == user_id)
 
-    async with get_session() as session:
+    # NOTE: This can come from the read replica, so a change that was *just* made may
+    #       take a moment to show up.
+    async def read(session: AsyncSession) -> JSONResponse:
         resp = await session.scalar(stmt)
 
         if resp is None:
@@ -30,10 +34,13 @@ async def get_user_preferences(user_id: UserIDDependencyType) -> JSONResponse:
 
         return JSONResponse(resp.preferences)
 
+    return await run_read(read)
+
 
 @router.post("/preferences")
 async def update_user_preferences(
     user_id: UserIDDependencyType,
+    session: SessionDependencyType,
     payload: dict = Body(
         default={}, examples=[{"some_preference": True, "other_preference": 69}]
     ),
@@ -61,24 +68,22 @@ async def update_user_preferences(
         },
     )
 
-    async with get_session() as session:
-        await session.execute(stmt_with_conflict_clause)
-        await session.commit()
+    await session.execute(stmt_with_conflict_clause)
 
     # De bluetooth device has connected successfullay
     return Response(status_code=200, content="User preferences updated successfully!")
 
 
 @router.delete("/preferences")
-async def reset_user_preferences(user_id: UserIDDependencyType) -> Response:
+async def reset_user_preferences(
+    user_id: UserIDDependencyType, session: SessionDependencyType
+) -> Response:
     """
     Resets a user's preferences payload (by deleting it entirely).
     """
 
     stmt = delete(UserPreferences).where(UserPreferences.user_id == user_id)
 
-    async with get_session() as session:
-        await session.execute(stmt)
-        await session.commit()
+    await session.execute(stmt)
 
     return Response(status_code=200, content="Your user preferences have been cleared!")
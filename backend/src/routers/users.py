@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from fastapi.routing import APIRouter
 from fastapi import HTTPException, Query
 from fastapi.responses import Response
@@ -8,34 +8,40 @@ import jwt as pyjwt
 from logging import getLogger
 
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..caching.memoize import memoize
+from ..db import run_read
 from ..db.models import User, WakatimeUserProfile
 from ..db.helpers import (
     update_oauth_tokens,
     recache_wakatime_profile,
     force_oauth_tokens_to_expire,
 )
-from ..db import get_session as get_db_session
-
 from ..models import users as user_models
 
-from ..utils.env import get_required_env
-
 from ..dependencies.auth import (
     clear_caches_for_token,
+    forget_wakatime_tokens,
+    get_jwt_secret,
+    JWT_EXPIRES_AFTER,
     TokenDependencyType,
     AuthHeaderDependencyType,
 )
+from ..dependencies.database import SessionDependencyType
+from ..wakatime import WakatimeTokens
 from ..wakatime.auth import get_access_tokens, revoke_token
 
 router = APIRouter()
 
 LOGGER = getLogger(__name__)
 RECACHE_OLD_WAKA_PROFILE_AFTER = timedelta(days=1)
+PROFILE_CACHE_TTL = timedelta(minutes=5)
 
 
 @router.post("/login", tags=["auth"])
 async def post_user_login(
+    session: SessionDependencyType,
     code: Annotated[
         str,
         Query(
@@ -64,49 +70,54 @@ async def post_user_login(
     token_resp = wrapped_token_resp.unwrap()
 
     # Now we need to check and see if there's already a user that matches `user_uuid` in our db.
-    async with get_db_session() as session:
-        matched_users = await session.scalar(
-            select(User).where(User.id == token_resp["user_id"])
-        )
+    matched_users = await session.scalar(
+        select(User).where(User.id == token_resp["user_id"])
+    )
 
-        # If we cannot find any users that match the user_uuid, then we must have a new user!
-        if matched_users is None:
-            LOGGER.info(f"New user created with id: {token_resp['user_id']}")
-
-            session.add(User(id=token_resp["user_id"]))
-
-        # Update the user's oauth tokens with the new ones we just got
-        # (This function will insert them if they don't already exist)
-        await update_oauth_tokens(
-            session=session,
-            user_id=token_resp["user_id"],
-            access_token=token_resp["access_token"],
-            refresh_token=token_resp["refresh_token"],
-            expires_at=token_resp["expires_at"],
-            skip_encryption=False,
-        )
+    # If we cannot find any users that match the user_uuid, then we must have a new user!
+    if matched_users is None:
+        LOGGER.info(f"New user created with id: {token_resp['user_id']}")
+
+        session.add(User(id=token_resp["user_id"]))
+
+    # Update the user's oauth tokens with the new ones we just got
+    # (This function will insert them if they don't already exist)
+    await update_oauth_tokens(
+        session=session,
+        user_id=token_resp["user_id"],
+        access_token=token_resp["access_token"],
+        refresh_token=token_resp["refresh_token"],
+        expires_at=token_resp["expires_at"],
+        skip_encryption=False,
+    )
 
-        LOGGER.debug(
-            f"Got stale or non-existent tokens for user with id {token_resp['user_id']}, refreshed them!"
-        )
+    LOGGER.debug(
+        f"Got stale or non-existent tokens for user with id {token_resp['user_id']}, refreshed them!"
+    )
 
-        # We've made sure our user exists, and our credentials are updated
-        # Lets get out of john and commit ts twin
-        await session.commit()
+    # We've made sure our user exists, and our credentials are updated
+    # Lets get out of john and commit ts twin (right now, so that nobody
+    # can re-cache the old tokens after we forget them below)
+    await session.commit()
+
+    # Any tokens we had cached for the user are the old ones now
+    await forget_wakatime_tokens(token_resp["user_id"])
 
     # Now it's JWT time...
 
-    # This is the payload, it just holds data that tells us who our user is.
-    token_payload = {"user_id": str(token_resp["user_id"])}
+    # This is the payload, it just holds data that tells us who our user is, and
+    # when the token stops being valid.
+    token_payload = {
+        "user_id": str(token_resp["user_id"]),
+        "exp": datetime.now(tz=timezone.utc) + JWT_EXPIRES_AFTER,
+    }
 
     # We then use the secret key defined in env to encode the payload and attach
     # a signature to it that we validate in our custom authn middleware.
     # NOTE: The token payload is NOT "encrypted", so don't slap random secret junk in there
     #       because we only really use an attached header signature thingy to validate the
     #       origin of the token
-    token = pyjwt.encode(
-        payload=token_payload, key=get_required_env("JWT_SECRET"), algorithm="HS256"
-    )
+    token = pyjwt.encode(payload=token_payload, key=get_jwt_secret(), algorithm="HS256")
 
     LOGGER.debug(
         f"Successful login, created a new JWT for user with id: {token_payload['user_id']}"
@@ -118,7 +129,9 @@ async def post_user_login(
 
 @router.post("/revoke_token", tags=["auth"])
 async def post_user_revoke_token(
-    auth_header: AuthHeaderDependencyType, tokens: TokenDependencyType
+    auth_header: AuthHeaderDependencyType,
+    tokens: TokenDependencyType,
+    session: SessionDependencyType,
 ):
     """
     Revokes the user's wakatime tokens, which can force a re-authentication.
@@ -142,14 +155,11 @@ async def post_user_revoke_token(
         )
 
     # Clear our auth caches for the user
-    clear_caches_for_token(auth_header.credentials)
+    await clear_caches_for_token(auth_header.credentials, user_id)
 
     # Set the tokens as expired in the database
-    async with get_db_session() as session:
-        await force_oauth_tokens_to_expire(session, user_id)
-
-        # Save db changes so the token *actually* expires...
-        await session.commit()
+    # (This gets committed along with the rest of the request, so the token *actually* expires)
+    await force_oauth_tokens_to_expire(session, user_id)
 
     LOGGER.debug(
         f"Wakatime tokens successfully revoked for user with id: {user_id} (revoke request)"
@@ -162,60 +172,20 @@ async def post_user_revoke_token(
 @router.get("/user", tags=["users"], name="Get current user profile")
 async def get_current_user_profile(
     tokens: TokenDependencyType,
+    session: SessionDependencyType,
 ) -> user_models.UserProfileResponse:
     """
     Returns the current user's profile.
     """
 
-    # First we need to check and see whether or not the user has already been cached
-    stmt = select(WakatimeUserProfile).where(
-        WakatimeUserProfile.user_id == tokens["user_id"]
-    )
-
     LOGGER.debug(f"Getting user profile data for user id: {tokens['user_id']}")
 
-    async with get_db_session() as session:
-        # `resp` now holds the currently cached data (if any)
-        resp = await session.scalar(stmt)
-
-        # If there is no cached data, or the cached data is old, then recache the data
-        if (
-            resp is None
-            or resp.last_cached_at + RECACHE_OLD_WAKA_PROFILE_AFTER
-            <= datetime.now(tz=None)
-        ):
-            LOGGER.debug(
-                f"User profile ({tokens['user_id']}) is stale or has never been pulled"
-            )
-
-            # This function returns the newly created instance of `WakatimeUserProfile`
-            resp = await recache_wakatime_profile(session, tokens, "current")
-
-        # Build a response model, we need to do this here before we commit otherwise we lose
-        # access to the data
-        response_model = user_models.UserProfileResponse(
-            user_id=str(resp.user_id),
-            wakatime=user_models.WakatimeProfile(
-                user_id=str(resp.user_id),
-                display_name=resp.display_name,
-                full_name=resp.full_name,
-                username=resp.username,
-                photo_url=resp.photo_url,
-                is_photo_public=resp.is_photo_public,
-                last_cached_at=resp.last_cached_at,
-            ),
-        )
-
-        # Save after the recache
-        await session.commit()
-
-    # Return the response model we built earlier
-    return response_model
+    return await get_user_profile(tokens["user_id"], tokens, session)
 
 
 @router.get("/user/{user_id}", tags=["users"])
 async def get_user_user(
-    tokens: TokenDependencyType, user_id: UUID
+    tokens: TokenDependencyType, session: SessionDependencyType, user_id: UUID
 ) -> user_models.UserProfileResponse:
     """
     Returns the provided user's profile.
@@ -223,67 +193,138 @@ async def get_user_user(
     Caveat: They need to have an account with our service in order for us to
     do a request to query their data. For privacy's sake
     """
-    codecrunchr_user_stmt = select(User).where(User.id == user_id)
+
+    LOGGER.debug(f"Getting user profile data for user id: {user_id}")
+
+    return await get_user_profile(user_id, tokens, session)
+
+
+# The profile only gets recached from wakatime once a day, so there's no point
+# in hitting the database for it on every request. Keyed by the profile's user
+# id only, whether it's read from the primary doesn't change what it is.
+@memoize(
+    ttl=PROFILE_CACHE_TTL,
+    max_size=10_000,
+    key=lambda user_id, **_: str(user_id),
+)
+async def get_stored_user_profile(
+    user_id: UUID, *, primary: bool = False
+) -> user_models.UserProfileResponse | None:
+    """
+    Gets the wakatime profile we have stored for a CodeCrunchr user, or None if we
+    don't have one for them (or they don't exist at all).
+
+    This reads from the read replica (if there is one), unless `primary` is set.
+
+    NOTE: This always uses a session of its own, never the request's. Concurrent
+          callers share the call, so it can't belong to any one request.
+    """
     waka_profile_stmt = select(WakatimeUserProfile).where(
         WakatimeUserProfile.user_id == user_id
     )
 
-    LOGGER.debug(f"Getting user profile data for user id: {tokens['user_id']}")
+    async def read(session: AsyncSession) -> user_models.UserProfileResponse | None:
+        waka_profile = await session.scalar(waka_profile_stmt)
 
-    async with get_db_session() as session:
-        # Try to fetch the user
-        user = await session.scalar(codecrunchr_user_stmt)
+        if waka_profile is None:
+            return None
 
-        # If we fail to find a user with the provided UUID, then raise a 404
-        if user is None:
+        # Build a response model, we need to do this here before the session closes
+        # otherwise we lose access to the data
+        return build_user_profile_response(waka_profile)
+
+    return await run_read(read, primary=primary)
+
+
+async def get_user_profile(
+    user_id: UUID, tokens: WakatimeTokens, session: AsyncSession
+) -> user_models.UserProfileResponse:
+    """
+    Gets a CodeCrunchr user's profile, recaching it from wakatime with `tokens`
+    if it's old (or has never been pulled).
+
+    Any recache goes through `session`, and gets committed right away so that the
+    cached profile can be refreshed from it.
+    """
+
+    profile = await get_stored_user_profile(user_id)
+
+    # If the cached data is recent enough, then we're done here
+    if (
+        profile is not None
+        and profile.wakatime.last_cached_at + RECACHE_OLD_WAKA_PROFILE_AFTER
+        > datetime.now(tz=None)
+    ):
+        return profile
+
+    # Try to fetch the user
+    user = await session.scalar(select(User).where(User.id == user_id))
+
+    # If we fail to find a user with the provided UUID, then raise a 404
+    if user is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"User with id `{user_id}` not found on CodeCrunchr",
+        )
+
+    LOGGER.debug(f"User profile ({user_id}) is stale or has never been pulled")
+
+    try:
+        # This function returns the newly created instance of `WakatimeUserProfile`
+        waka_profile = await recache_wakatime_profile(
+            session,
+            tokens,
+            "current" if user_id == tokens["user_id"] else user_id,
+        )
+    except ValueError:
+        # Wakatime wouldn't give us their profile (e.g., it's private), so make do
+        # with whatever we had cached for them, if anything.
+        if profile is None:
             raise HTTPException(
                 status_code=404,
-                detail=f"User with id `{user_id}` not found on CodeCrunchr",
+                detail=f"User with id `{user_id}` has no wakatime profile we can see",
             )
 
-        # At this point, we know we have a valid user
-        # We then copy the same protocol as the get_current_user_profile() func
-        waka_profile = await session.scalar(waka_profile_stmt)
-
-        # If there is no cached data, or the cached data is old, then recache the data
-        if (
-            waka_profile is None
-            or waka_profile.last_cached_at + RECACHE_OLD_WAKA_PROFILE_AFTER
-            <= datetime.now(tz=None)
-        ):
-            LOGGER.debug(
-                f"User profile ({tokens['user_id']}) is stale or has never been pulled"
-            )
+        LOGGER.warning(
+            f"Failed to recache the wakatime profile for user {user_id}, "
+            "serving the cached one"
+        )
 
-            # This function returns the newly created instance of `WakatimeUserProfile`
-            waka_profile = await recache_wakatime_profile(session, tokens, "current")
+        return profile
 
-        # Build a response model, we need to do this here before we commit otherwise we lose
-        # access to the data
-        response_model = user_models.UserProfileResponse(
-            user_id=str(waka_profile.user_id),
-            wakatime=user_models.WakatimeProfile(
-                user_id=str(waka_profile.user_id),
-                display_name=waka_profile.display_name,
-                full_name=waka_profile.full_name,
-                username=waka_profile.username,
-                photo_url=waka_profile.photo_url,
-                is_photo_public=waka_profile.is_photo_public,
-                last_cached_at=waka_profile.last_cached_at,
-            ),
-        )
+    # Build the response before committing, otherwise we lose access to the data
+    response_model = build_user_profile_response(waka_profile)
 
-        # Save after the recache
-        await session.commit()
+    # The cached profile is shared with every worker, so only refresh it once the new
+    # one has actually been committed. (from the primary, the replica might be behind)
+    await session.commit()
+    await get_stored_user_profile.refresh(user_id, primary=True)
 
-    # Return the response model we built earlier
     return response_model
 
 
+def build_user_profile_response(
+    waka_profile: WakatimeUserProfile,
+) -> user_models.UserProfileResponse:
+    return user_models.UserProfileResponse(
+        user_id=str(waka_profile.user_id),
+        wakatime=user_models.WakatimeProfile(
+            user_id=str(waka_profile.user_id),
+            display_name=waka_profile.display_name,
+            full_name=waka_profile.full_name,
+            username=waka_profile.username,
+            photo_url=waka_profile.photo_url,
+            is_photo_public=waka_profile.is_photo_public,
+            last_cached_at=waka_profile.last_cached_at,
+        ),
+    )
+
+
 @router.delete("/user", tags=["users"])
 async def delete_user_user(
     auth_header: AuthHeaderDependencyType,
     tokens: TokenDependencyType,
+    session: SessionDependencyType,
 ):
     """
     Deletes the current user and any assoc. data from CodeCrunchr.
@@ -292,7 +333,7 @@ async def delete_user_user(
     user_id = tokens["user_id"]
 
     # Clear caches
-    clear_caches_for_token(auth_header.credentials)
+    await clear_caches_for_token(auth_header.credentials, user_id)
 
     LOGGER.debug(f"Auth caches were cleared for user id: {user_id} (account deletion)")
 
@@ -310,22 +351,25 @@ async def delete_user_user(
     )
 
     # Delete user in db, cascade all other tables
-    async with get_db_session() as session:
-        user = await session.get(User, user_id)
+    user = await session.get(User, user_id)
 
-        # Sanity check, this should never happen, if it does something SERIOUSLY went wrong
-        if not user:
-            raise HTTPException(
-                status_code=404, detail="Cannot delete user, user doesn't exist???"
-            )
+    # Sanity check, this should never happen, if it does something SERIOUSLY went wrong
+    if not user:
+        raise HTTPException(
+            status_code=404, detail="Cannot delete user, user doesn't exist???"
+        )
+
+    # Delete the user
+    # Provided I set the database up correctly, this *should* also trigger
+    # an ON CASCADE clause, deleting the rest of the data associated with this user.
+    await session.delete(user)
 
-        # Delete the user
-        # Provided I set the database up correctly, this *should* also trigger
-        # an ON CASCADE clause, deleting the rest of the data associated with this user.
-        await session.delete(user)
+    # Commit so that the user *actually* gets deleted. (right now, before
+    # we forget their cached profile)
+    await session.commit()
 
-        # Commit so that the user *actually* gets deleted.
-        await session.commit()
+    # Don't keep serving the profile of a user that doesn't exist anymore
+    await get_stored_user_profile.invalidate(str(user_id))
 
     LOGGER.info(f"User with id {user_id} has been deleted!")
 
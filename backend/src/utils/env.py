@@ -25,4 +25,18 @@ def get_required_env(key: str) -> str:
     return tmp
 
 
-__all__ = ["EnvVarRequired", "get_required_env"]
+def get_optional_env(key: str, default: str | None = None) -> str | None:
+    """
+    Pulls `key` from .env, if it doesn't exist (or is blank), then `default` is returned.
+    """
+    tmp = getenv(key, None)
+
+    # Blank values in .env files are treated the same as unset ones, that way
+    # the .env.example file can be copied over without breaking any defaults
+    if tmp is None or tmp.strip() == "":
+        return default
+
+    return tmp
+
+
+__all__ = ["EnvVarRequired", "get_required_env", "get_optional_env"]
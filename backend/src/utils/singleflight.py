@@ -0,0 +1,70 @@
+from typing import Awaitable, Callable, Generic, Hashable, ItemsView, TypeVar
+import asyncio
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class SingleFlight(Generic[K, V]):
+    """
+    Makes sure that only one coroutine is running for a given key at a time.
+
+    Anyone who asks for a key that is already in flight just waits on the
+    result of the one that is already running instead of starting their own.
+    """
+
+    _in_flight: dict[K, "asyncio.Task[V]"]
+
+    def __init__(self) -> None:
+        self._in_flight = {}
+
+    def start(self, key: K, fn: Callable[[], Awaitable[V]]) -> "asyncio.Task[V]":
+        """
+        Returns the task that is in flight for `key`, starting one with `fn`
+        if there isn't one yet.
+        """
+        task = self._in_flight.get(key)
+
+        if task is not None:
+            return task
+
+        async def run() -> V:
+            return await fn()
+
+        task = asyncio.create_task(run())
+        self._in_flight[key] = task
+
+        # Once the task is done, the next caller for this key starts a fresh one
+        def forget(finished: "asyncio.Task[V]") -> None:
+            if self._in_flight.get(key) is finished:
+                del self._in_flight[key]
+
+            # Any exception has already been handed to whoever was waiting, this
+            # just stops asyncio complaining about it if everyone gave up waiting.
+            if not finished.cancelled():
+                finished.exception()
+
+        task.add_done_callback(forget)
+
+        return task
+
+    async def do(self, key: K, fn: Callable[[], Awaitable[V]]) -> V:
+        """
+        Runs `fn` for `key` (or joins the run that's already happening)
+        and returns its result.
+        """
+        # Shielded so that one caller giving up (e.g., their request was cancelled)
+        # doesn't cancel the work for everybody else who's waiting on it.
+        return await asyncio.shield(self.start(key, fn))
+
+    def items(self) -> ItemsView[K, "asyncio.Task[V]"]:
+        return self._in_flight.items()
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._in_flight
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+
+__all__ = ["SingleFlight"]
@@ -19,3 +19,11 @@ def decrypt(s: str) -> str:
     the `encrypt()` method in this module.
     """
     return FERNET.decrypt(s.encode("utf-8")).decode("utf-8")
+
+
+def decrypt_many(values: list[str]) -> list[str]:
+    """
+    Same as `decrypt()`, but for a whole list of strings at once.
+    (Handy for running a big batch of decryptions off in a thread)
+    """
+    return [decrypt(s) for s in values]
@@ -1,5 +1,4 @@
 from datetime import datetime
-import aiohttp
 from urllib.parse import parse_qs
 from uuid import UUID
 from typing import TypedDict
@@ -10,6 +9,7 @@ from . import (
     WAKA_REDIRECT_URI,
     WakatimeAPIResponse,
 )
+from .client import get_wakatime_client
 
 
 class AccessTokensResponse(TypedDict):
@@ -22,19 +22,19 @@ class AccessTokensResponse(TypedDict):
 async def get_access_tokens(
     oauth_code: str,
 ) -> WakatimeAPIResponse[AccessTokensResponse]:
-    async with aiohttp.ClientSession() as cs:
-        async with cs.post(
-            "https://wakatime.com/oauth/token",
-            data={
-                "client_id": WAKA_CLIENT_ID,
-                "client_secret": WAKA_CLIENT_SECRET,
-                "redirect_uri": WAKA_REDIRECT_URI,
-                "grant_type": "authorization_code",
-                "code": oauth_code,
-            },
-        ) as resp:
-            resp_status = resp.status
-            raw_resp_text = await resp.text()
+    async with get_wakatime_client().request(
+        "POST",
+        "/oauth/token",
+        data={
+            "client_id": WAKA_CLIENT_ID,
+            "client_secret": WAKA_CLIENT_SECRET,
+            "redirect_uri": WAKA_REDIRECT_URI,
+            "grant_type": "authorization_code",
+            "code": oauth_code,
+        },
+    ) as resp:
+        resp_status = resp.status
+        raw_resp_text = await resp.text()
 
     parsed_text_resp = parse_qs(raw_resp_text)
 
@@ -56,19 +56,19 @@ async def get_access_tokens(
 async def refresh_access_token(
     refresh_token: str,
 ) -> WakatimeAPIResponse[AccessTokensResponse]:
-    async with aiohttp.ClientSession() as cs:
-        async with cs.post(
-            "https://wakatime.com/oauth/token",
-            data={
-                "client_id": WAKA_CLIENT_ID,
-                "client_secret": WAKA_CLIENT_SECRET,
-                "redirect_uri": WAKA_REDIRECT_URI,
-                "grant_type": "refresh_token",
-                "refresh_token": refresh_token,
-            },
-        ) as resp:
-            resp_status = resp.status
-            raw_resp_text = await resp.text()
+    async with get_wakatime_client().request(
+        "POST",
+        "/oauth/token",
+        data={
+            "client_id": WAKA_CLIENT_ID,
+            "client_secret": WAKA_CLIENT_SECRET,
+            "redirect_uri": WAKA_REDIRECT_URI,
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+        },
+    ) as resp:
+        resp_status = resp.status
+        raw_resp_text = await resp.text()
 
     if resp_status == 400:
         return WakatimeAPIResponse(status_code=400, response=None)
@@ -98,16 +98,16 @@ async def revoke_token(token: str, *, all: bool = False) -> WakatimeAPIResponse[
     associated with the user who owns the provided token.
     """
 
-    async with aiohttp.ClientSession() as cs:
-        async with cs.post(
-            "https://wakatime.com/oauth/revoke",
-            data={
-                "client_id": WAKA_CLIENT_ID,
-                "client_secret": WAKA_CLIENT_SECRET,
-                "token": token,
-                "all": all,
-            },
-        ) as resp:
-            status_code = resp.status
+    async with get_wakatime_client().request(
+        "POST",
+        "/oauth/revoke",
+        data={
+            "client_id": WAKA_CLIENT_ID,
+            "client_secret": WAKA_CLIENT_SECRET,
+            "token": token,
+            "all": all,
+        },
+    ) as resp:
+        status_code = resp.status
 
     return WakatimeAPIResponse(status_code=status_code, response=None)
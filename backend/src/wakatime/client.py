@@ -0,0 +1,239 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Any
+from logging import getLogger
+
+from pydantic import BaseModel, Field
+import aiohttp
+
+from ..utils.env import get_optional_env
+from .ratelimit import WakatimeRateLimiter, parse_retry_after
+
+LOGGER = getLogger(__name__)
+
+DEFAULT_WAKA_BASE_URL = "https://wakatime.com"
+
+# Maps the settings on `WakatimeClientSettings` to the environment variables
+# that can be used to override them.
+SETTINGS_ENV_VARS = {
+    "base_url": "WAKA_BASE_URL",
+    "total_timeout": "WAKA_HTTP_TIMEOUT",
+    "connect_timeout": "WAKA_HTTP_CONNECT_TIMEOUT",
+    "max_connections": "WAKA_HTTP_MAX_CONNECTIONS",
+    "max_connections_per_host": "WAKA_HTTP_MAX_CONNECTIONS_PER_HOST",
+    "dns_cache_ttl": "WAKA_HTTP_DNS_CACHE_TTL",
+    "keepalive_timeout": "WAKA_HTTP_KEEPALIVE_TIMEOUT",
+    "rate_limit": "WAKA_RATE_LIMIT",
+    "rate_limit_burst": "WAKA_RATE_LIMIT_BURST",
+    "max_throttled_retries": "WAKA_MAX_THROTTLED_RETRIES",
+    "max_retry_after": "WAKA_MAX_RETRY_AFTER",
+}
+
+
+class WakatimeClientSettings(BaseModel):
+    """
+    Everything that can be tuned on the shared wakatime http client.
+    """
+
+    # Where all the requests are sent, swap this out to point the client
+    # at a stand-in server when testing.
+    base_url: str = DEFAULT_WAKA_BASE_URL
+
+    # Timeouts (in seconds) for a whole request, and for establishing a connection
+    total_timeout: float = Field(default=30.0, gt=0)
+    connect_timeout: float = Field(default=10.0, gt=0)
+
+    # Connection pool limits
+    max_connections: int = Field(default=100, gt=0)
+    max_connections_per_host: int = Field(default=16, gt=0)
+
+    # How long (in seconds) resolved hostnames and idle connections are kept around
+    dns_cache_ttl: int = Field(default=300, ge=0)
+    keepalive_timeout: float = Field(default=30.0, gt=0)
+
+    # How many requests per second we let out to wakatime (on average), and
+    # how many can go out at once after a quiet period
+    rate_limit: float = Field(default=8.0, gt=0)
+    rate_limit_burst: int = Field(default=10, gt=0)
+
+    # How many times a request that got a 429 is retried, and the longest
+    # Retry-After (in seconds) we're willing to wait on before giving up
+    max_throttled_retries: int = Field(default=2, ge=0)
+    max_retry_after: float = Field(default=30.0, ge=0)
+
+    @classmethod
+    def from_env(cls, **overrides: Any) -> "WakatimeClientSettings":
+        """
+        Builds the settings from any environment variables that are set,
+        `overrides` take priority over the environment.
+        """
+        values: dict[str, Any] = {}
+
+        for setting, env_key in SETTINGS_ENV_VARS.items():
+            env_value = get_optional_env(env_key)
+
+            if env_value is not None:
+                values[setting] = env_value
+
+        values.update(overrides)
+
+        return cls.model_validate(values)
+
+
+class WakatimeClient(object):
+    """
+    Owns the single long-lived aiohttp session that every request to wakatime
+    goes through, so we can reuse connections instead of doing a brand new
+    TCP+TLS handshake for every request.
+
+    Every request also has to get past the rate limiter first, so we don't
+    get our app throttled by wakatime.
+
+    Works the same way as the `DatabaseSingleton`, use `get_wakatime_client()`
+    to get the instance.
+    """
+
+    settings: WakatimeClientSettings
+    session: aiohttp.ClientSession | None
+    limiter: WakatimeRateLimiter
+
+    def __init__(self, settings: WakatimeClientSettings) -> None:
+        self.settings = settings
+
+        self.limiter = WakatimeRateLimiter(
+            rate=settings.rate_limit, burst=settings.rate_limit_burst
+        )
+
+        # The connector holds the pool of keep-alive connections
+        connector = aiohttp.TCPConnector(
+            limit=settings.max_connections,
+            limit_per_host=settings.max_connections_per_host,
+            use_dns_cache=settings.dns_cache_ttl > 0,
+            ttl_dns_cache=settings.dns_cache_ttl or None,
+            keepalive_timeout=settings.keepalive_timeout,
+        )
+
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=settings.total_timeout,
+                connect=settings.connect_timeout,
+            ),
+        )
+
+    def url(self, path: str) -> str:
+        """
+        Joins `path` onto the configured base url.
+        """
+        return f"{self.settings.base_url.rstrip('/')}/{path.lstrip('/')}"
+
+    @asynccontextmanager
+    async def request(
+        self, method: str, path: str, **kwargs: Any
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        Returns a context manager for a request to wakatime, `path` is relative
+        to the base url (e.g., "/api/v1/users/current").
+
+        The request waits its turn in the rate limiter (see `request_priority()`),
+        and if wakatime responds with a 429 it is retried after the Retry-After
+        has passed. If we run out of retries, the 429 response is handed back.
+
+        Any extra kwargs are passed straight through to aiohttp.
+        """
+        if self.session is None:
+            raise ValueError("Failed to make request: wakatime client is closed")
+
+        attempt = 0
+
+        while True:
+            await self.limiter.acquire()
+
+            resp = await self.session.request(method, self.url(path), **kwargs)
+
+            if resp.status != 429:
+                break
+
+            # Every request in the queue needs to back off, not just this one
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+            self.limiter.throttle(retry_after)
+
+            if (
+                attempt >= self.settings.max_throttled_retries
+                or retry_after > self.settings.max_retry_after
+            ):
+                break
+
+            resp.release()
+            attempt += 1
+
+        try:
+            yield resp
+        finally:
+            resp.release()
+
+    async def close(self) -> None:
+        """
+        Closes the session along with any pooled connections.
+        """
+        if self.session is None:
+            raise ValueError("Wakatime client cannot close: client is already closed")
+
+        await self.session.close()
+
+        self.session = None
+
+
+def get_wakatime_client() -> WakatimeClient:
+    client = getattr(WakatimeClient, "instance", None)
+
+    if not client:
+        raise ValueError("Failed to get wakatime client: instance not initialized")
+
+    return client
+
+
+#
+#       LIFESPAN FUNCTIONS
+#
+
+
+def start_wakatime_client(**overrides: Any) -> WakatimeClient:
+    """
+    Creates the shared wakatime client. Any settings passed in as kwargs
+    take priority over the environment (e.g., `base_url` for tests).
+
+    This needs to be called from inside a running event loop.
+    """
+
+    LOGGER.info("Starting wakatime client...")
+
+    if hasattr(WakatimeClient, "instance"):
+        raise ValueError("Cannot start wakatime client: it's already running")
+
+    client = WakatimeClient(WakatimeClientSettings.from_env(**overrides))
+
+    setattr(WakatimeClient, "instance", client)
+
+    LOGGER.info(f"Wakatime client started! (base url: {client.settings.base_url})")
+
+    return client
+
+
+async def shutdown_wakatime_client() -> None:
+    """
+    Closes the shared wakatime client.
+    """
+    LOGGER.info("Shutting down wakatime client...")
+
+    await get_wakatime_client().close()
+
+    delattr(WakatimeClient, "instance")
+
+
+__all__ = [
+    "WakatimeClient",
+    "WakatimeClientSettings",
+    "get_wakatime_client",
+    "start_wakatime_client",
+    "shutdown_wakatime_client",
+]
@@ -0,0 +1,255 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from enum import IntEnum
+from itertools import count
+from typing import Iterator, TypedDict
+from logging import getLogger
+import asyncio
+import heapq
+import time
+
+LOGGER = getLogger(__name__)
+
+# How long we back off for when wakatime sends a 429 without a usable Retry-After header
+DEFAULT_RETRY_AFTER_SECONDS = 5.0
+
+
+class RequestPriority(IntEnum):
+    """
+    Lower values get served first when requests are queued up.
+    """
+
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+# The priority is tracked with a context variable so that it follows a request down through
+# every function call (and any tasks spawned from it) without having to pass it around.
+CURRENT_REQUEST_PRIORITY: ContextVar[RequestPriority] = ContextVar(
+    "wakatime_request_priority", default=RequestPriority.INTERACTIVE
+)
+
+
+@contextmanager
+def request_priority(priority: RequestPriority) -> Iterator[None]:
+    """
+    Any requests made to wakatime inside of this context manager (including from tasks
+    created inside of it) are queued with the provided priority.
+    """
+    token = CURRENT_REQUEST_PRIORITY.set(priority)
+
+    try:
+        yield
+    finally:
+        CURRENT_REQUEST_PRIORITY.reset(token)
+
+
+def parse_retry_after(value: str | None) -> float:
+    """
+    Turns a Retry-After header (either a number of seconds or an HTTP date)
+    into a number of seconds to wait.
+    """
+    if not value:
+        return DEFAULT_RETRY_AFTER_SECONDS
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER_SECONDS
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    return max((retry_at - datetime.now(tz=timezone.utc)).total_seconds(), 0.0)
+
+
+class RateLimiterStats(TypedDict):
+    queue_depth: int
+    queue_depth_by_priority: dict[str, int]
+    tokens_available: float
+    throttled_for_seconds: float
+    total_acquired: int
+    total_throttled: int
+    average_wait_seconds: float
+    max_wait_seconds: float
+
+
+class WakatimeRateLimiter(object):
+    """
+    A token bucket that every outbound request to wakatime has to take a token from.
+
+    The bucket refills at `rate` tokens per second and holds at most `burst` tokens.
+    When the bucket is empty, requests wait in a queue ordered by their priority
+    (then by arrival). A 429 from wakatime empties the bucket and holds the whole
+    queue until the Retry-After has passed.
+    """
+
+    def __init__(self, *, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._throttled_until = 0.0
+
+        # Heap of (priority, arrival order, future)
+        self._waiters: list[tuple[int, int, asyncio.Future[None]]] = []
+        self._arrivals = count()
+        self._dispatch_handle: asyncio.TimerHandle | asyncio.Handle | None = None
+
+        # Stats
+        self._total_acquired = 0
+        self._total_throttled = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(float(self.burst), self._tokens + elapsed * self.rate)
+
+    def _record_wait(self, waited: float) -> None:
+        self._total_acquired += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+
+    def _schedule_dispatch(self, delay: float = 0.0) -> None:
+        # Only ever keep one dispatch pending, the dispatcher reschedules itself
+        # for as long as there are still requests waiting.
+        if self._dispatch_handle is not None:
+            return
+
+        loop = asyncio.get_running_loop()
+
+        if delay <= 0:
+            self._dispatch_handle = loop.call_soon(self._dispatch)
+        else:
+            self._dispatch_handle = loop.call_later(delay, self._dispatch)
+
+    def _dispatch(self) -> None:
+        self._dispatch_handle = None
+
+        now = time.monotonic()
+        self._refill(now)
+
+        while self._waiters and now >= self._throttled_until and self._tokens >= 1:
+            _, _, waiter = heapq.heappop(self._waiters)
+
+            # The waiter gave up (its request was cancelled), skip it
+            if waiter.done():
+                continue
+
+            self._tokens -= 1
+            waiter.set_result(None)
+
+        # Throw out any cancelled waiters so they don't keep the dispatcher alive
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+
+        if not self._waiters:
+            return
+
+        # Wake back up once we're either no longer throttled, or we have a token again
+        if now < self._throttled_until:
+            delay = self._throttled_until - now
+        else:
+            delay = (1 - self._tokens) / self.rate
+
+        self._schedule_dispatch(delay)
+
+    async def acquire(self, priority: RequestPriority | None = None) -> float:
+        """
+        Waits until a request is allowed to be sent, returns how long
+        (in seconds) the request had to wait for.
+        """
+        if priority is None:
+            priority = CURRENT_REQUEST_PRIORITY.get()
+
+        enqueued_at = time.monotonic()
+        self._refill(enqueued_at)
+
+        # Fast path, nobody is waiting in line and we have a token to spare
+        if (
+            not self._waiters
+            and enqueued_at >= self._throttled_until
+            and self._tokens >= 1
+        ):
+            self._tokens -= 1
+            self._record_wait(0.0)
+            return 0.0
+
+        waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), waiter))
+        self._schedule_dispatch()
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # If we got cancelled right after being handed a token, give it back
+            if waiter.done() and not waiter.cancelled():
+                self._tokens = min(float(self.burst), self._tokens + 1)
+                self._schedule_dispatch()
+            raise
+
+        waited = time.monotonic() - enqueued_at
+        self._record_wait(waited)
+
+        return waited
+
+    def throttle(self, retry_after: float) -> None:
+        """
+        Stops any requests from going out for `retry_after` seconds, this should
+        be called whenever wakatime tells us to slow down.
+        """
+        now = time.monotonic()
+
+        self._total_throttled += 1
+        self._tokens = 0.0
+        self._last_refill = now
+        self._throttled_until = max(self._throttled_until, now + retry_after)
+
+        LOGGER.warning(
+            f"Wakatime is throttling us, holding {self.queue_depth()} queued requests for {retry_after:.1f}s"
+        )
+
+    def queue_depth(self, priority: RequestPriority | None = None) -> int:
+        return sum(
+            1
+            for p, _, waiter in self._waiters
+            if not waiter.done() and (priority is None or p == priority)
+        )
+
+    def stats(self) -> RateLimiterStats:
+        now = time.monotonic()
+        self._refill(now)
+
+        return RateLimiterStats(
+            queue_depth=self.queue_depth(),
+            queue_depth_by_priority={
+                p.name.lower(): self.queue_depth(p) for p in RequestPriority
+            },
+            tokens_available=self._tokens,
+            throttled_for_seconds=max(self._throttled_until - now, 0.0),
+            total_acquired=self._total_acquired,
+            total_throttled=self._total_throttled,
+            average_wait_seconds=(
+                self._total_wait / self._total_acquired if self._total_acquired else 0.0
+            ),
+            max_wait_seconds=self._max_wait,
+        )
+
+
+__all__ = [
+    "RequestPriority",
+    "request_priority",
+    "parse_retry_after",
+    "RateLimiterStats",
+    "WakatimeRateLimiter",
+]
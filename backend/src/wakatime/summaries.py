@@ -2,7 +2,6 @@ from typing import Literal, Union
 from uuid import UUID
 
 from pydantic import BaseModel
-import aiohttp
 
 from . import (
     WakatimeAPIResponse,
@@ -10,6 +9,7 @@ from . import (
     WakatimeTimeframeType,
     validate_timeframe,
 )
+from .client import get_wakatime_client
 
 
 class SummaryMetadataModel(BaseModel):
@@ -130,6 +130,68 @@ class SummaryResponseModel(BaseModel):
     end: str
 
 
+# The "lean" models only hold the fields that we actually store in the database (plus
+# the date each day is for).
+# Everything else in the response (projects, editors, machines, etc.) gets skipped over
+# while parsing instead of being validated and turned into objects we never look at.
+
+
+class LeanGrandTotalModel(BaseModel):
+    total_seconds: float
+
+
+class LeanLanguageModel(BaseModel):
+    name: str
+    total_seconds: float
+
+
+class LeanRangeModel(BaseModel):
+    date: str
+
+
+class LeanSummarySections(BaseModel):
+    grand_total: LeanGrandTotalModel
+    languages: list[LeanLanguageModel]
+    range: LeanRangeModel
+
+
+class LeanSummaryResponseModel(BaseModel):
+    data: list[LeanSummarySections]
+
+    start: str
+    end: str
+
+
+# Either of the summary models can be pushed into the database
+SummaryResponseType = Union[SummaryResponseModel, LeanSummaryResponseModel]
+
+
+async def _request_summaries(
+    tokens: WakatimeTokens,
+    user: Union[Literal["current"], UUID],
+    timeframe: WakatimeTimeframeType,
+) -> tuple[int, bytes]:
+    """
+    Requests the summaries from wakatime and returns the status code along
+    with the raw (unparsed) response body.
+    """
+
+    # Ensure the timeframe is formatted correctly.
+    if not validate_timeframe(timeframe):
+        raise ValueError("Invalid timeframe format supplied")
+
+    async with get_wakatime_client().request(
+        "GET",
+        f"/api/v1/users/{user}/summaries",
+        headers={"Authorization": f"Bearer {tokens['access_token']}"},
+        params={**timeframe.model_dump()},
+    ) as resp:
+        status_code = resp.status
+        resp_json = await resp.read()
+
+    return status_code, resp_json
+
+
 async def get_summaries(
     tokens: WakatimeTokens,
     user: Union[Literal["current"], UUID],
@@ -142,18 +204,7 @@ async def get_summaries(
     ourselves.
     """
 
-    # Ensure the timeframe is formatted correctly.
-    if not validate_timeframe(timeframe):
-        raise ValueError("Invalid timeframe format supplied")
-
-    async with aiohttp.ClientSession() as cs:
-        async with cs.get(
-            f"https://wakatime.com/api/v1/users/{user}/summaries",
-            headers={"Authorization": f"Bearer {tokens['access_token']}"},
-            params={**timeframe.model_dump()},
-        ) as resp:
-            status_code = resp.status
-            resp_json = await resp.read()
+    status_code, resp_json = await _request_summaries(tokens, user, timeframe)
 
     # If we don't get an OK response, then we must have an error.
     if status_code != 200:
@@ -166,4 +217,27 @@ async def get_summaries(
     )
 
 
-__all__ = ["get_summaries"]
+async def get_lean_summaries(
+    tokens: WakatimeTokens,
+    user: Union[Literal["current"], UUID],
+    timeframe: WakatimeTimeframeType,
+) -> WakatimeAPIResponse[LeanSummaryResponseModel]:
+    """
+    Same as `get_summaries()`, but only parses the fields we store in the database
+    (the grand total, the language breakdowns and the start/end of the range).
+
+    Use this one whenever the summaries are only being recached.
+    """
+
+    status_code, resp_json = await _request_summaries(tokens, user, timeframe)
+
+    if status_code != 200:
+        return WakatimeAPIResponse(status_code=status_code, response=None)
+
+    return WakatimeAPIResponse(
+        status_code=status_code,
+        response=LeanSummaryResponseModel.model_validate_json(resp_json),
+    )
+
+
+__all__ = ["get_summaries", "get_lean_summaries", "SummaryResponseType"]
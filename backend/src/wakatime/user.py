@@ -1,9 +1,9 @@
 from uuid import UUID
 
 from pydantic import BaseModel
-import aiohttp
 
 from . import WakatimeTokens
+from .client import get_wakatime_client
 
 
 class UserCityModel(BaseModel):
@@ -60,12 +60,12 @@ async def get_current_user(tokens: WakatimeTokens) -> UserResponse:
     Returns information about the current user (who owns the WakatimeTokens)
     """
 
-    async with aiohttp.ClientSession() as cs:
-        async with cs.get(
-            "https://wakatime.com/api/v1/users/current",
-            headers={"Authorization": f"Bearer {tokens['access_token']}"},
-        ) as resp:
-            resp_json = await resp.read()
+    async with get_wakatime_client().request(
+        "GET",
+        "/api/v1/users/current",
+        headers={"Authorization": f"Bearer {tokens['access_token']}"},
+    ) as resp:
+        resp_json = await resp.read()
 
     user_resp_model = UserResponseModel.model_validate_json(resp_json)
 
@@ -78,15 +78,15 @@ async def get_user(tokens: WakatimeTokens, uuid: UUID) -> UserResponse | None:
     user with the provided UUID exists
     """
 
-    async with aiohttp.ClientSession() as cs:
-        async with cs.get(
-            f"https://wakatime.com/api/v1/users/{str(uuid)}",
-            headers={"Authorization": f"Bearer {tokens['access_token']}"},
-        ) as resp:
-            if resp.status != 200:
-                return None
+    async with get_wakatime_client().request(
+        "GET",
+        f"/api/v1/users/{str(uuid)}",
+        headers={"Authorization": f"Bearer {tokens['access_token']}"},
+    ) as resp:
+        if resp.status != 200:
+            return None
 
-            resp_json = await resp.read()
+        resp_json = await resp.read()
 
     user_resp_model = UserResponseModel.model_validate_json(resp_json)
 
@@ -0,0 +1,203 @@
+"""
+Makes sure the hot duration queries keep getting served straight out of their
+covering indexes. (So if someone changes a query or drops an index, we find out
+here instead of in production)
+"""
+
+from datetime import date, datetime, timedelta
+from typing import Any, AsyncGenerator
+from uuid import UUID, uuid4
+import json
+import random
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete, insert, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db import get_connection, get_database_singleton
+from src.db.helpers import select_user_durations
+from src.db.models import User, WakatimeDuration
+from src.db.partitions import add_months, create_monthly_partitions
+from src.db.refresh import select_planned_refreshes
+from src.jobs.leaderboards import select_weekly_leaderboard_totals
+from src.wakatime import WakatimeStartEndTimeframe
+
+# Enough rows that the planner actually has to pick between the indexes
+SEEDED_USER_COUNT = 300
+SEEDED_DAY_COUNT = 60
+
+COVERING_USER_DATE_INDEX = "unique_date_user_id"
+COVERING_DATE_USER_INDEX = "idx_durations_date_user_id"
+WEEKLY_ROLLUP_INDEX = "codecrunchr_weekly_duration_rollups_pkey"
+
+
+@pytest_asyncio.fixture(scope="module", loop_scope="session")
+async def seeded_user_ids(
+    initialized_test_db: None,
+) -> AsyncGenerator[list[UUID], None]:
+    user_ids = [uuid4() for _ in range(SEEDED_USER_COUNT)]
+    today = date.today()
+    now = datetime.now()
+
+    async with get_connection() as connection:
+        # The test database might have been migrated a while ago, so make sure there
+        # are partitions for all of the seeded days
+        await create_monthly_partitions(
+            connection, start=add_months(today, -2), months=3
+        )
+
+        await connection.execute(
+            insert(User), [{"id": user_id} for user_id in user_ids]
+        )
+        await connection.execute(
+            insert(WakatimeDuration),
+            [
+                {
+                    "user_id": user_id,
+                    "date": today - timedelta(days=day),
+                    "total_seconds": random.uniform(0, 3600 * 8),
+                    "last_cached_at": now - timedelta(minutes=random.randint(0, 120)),
+                }
+                for user_id in user_ids
+                for day in range(SEEDED_DAY_COUNT)
+            ],
+        )
+
+    # Index-only scans need the visibility map to be up to date, and the planner needs
+    # stats for the new rows. (VACUUM can't run inside of a transaction)
+    engine = get_database_singleton().engine
+    assert engine is not None
+
+    async with engine.connect() as connection:
+        connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+        await connection.execute(text("VACUUM ANALYZE codecrunchr_wakatime_durations"))
+
+    yield user_ids
+
+    async with get_connection() as connection:
+        await connection.execute(delete(User).where(User.id.in_(user_ids)))
+
+
+async def plan_nodes(session: AsyncSession, stmt: Any) -> list[dict[str, Any]]:
+    """
+    Returns every node in the plan for `stmt`.
+    """
+
+    # Only for this transaction: we want to know whether the right index *can* serve
+    # the query, not whether a seq scan (or a bitmap scan, which reads the heap too)
+    # happens to be cheaper on a small test table.
+    await session.execute(text("SET LOCAL enable_seqscan = off"))
+    await session.execute(text("SET LOCAL enable_bitmapscan = off"))
+
+    sql = stmt.compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    )
+
+    connection = await session.connection()
+    result = await connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}")
+    plan = result.scalar_one()
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    nodes = []
+    to_visit = [plan[0]["Plan"]]
+
+    while to_visit:
+        node = to_visit.pop()
+        nodes.append(node)
+        to_visit.extend(node.get("Plans", []))
+
+    return nodes
+
+
+async def explain(session: AsyncSession, stmt: Any) -> list[tuple[str, str | None]]:
+    """
+    Returns the (node type, index name) of every node in the plan for `stmt`.
+
+    The tables are partitioned, so the scans are really on each partition's copy of the
+    index, these get swapped out for the name of the index they're a partition of.
+    """
+    nodes = []
+
+    for node in await plan_nodes(session, stmt):
+        index_name = node.get("Index Name")
+
+        if index_name is not None:
+            index_name = await session.scalar(
+                # (indexes on tables that aren't partitioned have no root, so they keep their name)
+                text(
+                    "SELECT coalesce(pg_partition_root(CAST(:name AS regclass)), "
+                    "CAST(:name AS regclass))::text"
+                ),
+                {"name": index_name},
+            )
+
+        nodes.append((node["Node Type"], index_name))
+
+    return nodes
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_cached_user_durations_use_index_only_scan(
+    test_db: AsyncSession, seeded_user_ids: list[UUID]
+):
+    today = date.today()
+    stmt = select_user_durations(seeded_user_ids[0], today - timedelta(days=6), today)
+
+    nodes = await explain(test_db, stmt)
+
+    assert ("Index Only Scan", COVERING_USER_DATE_INDEX) in nodes, nodes
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_planned_refreshes_use_index_only_scan(
+    test_db: AsyncSession, seeded_user_ids: list[UUID]
+):
+    today = date.today()
+    timeframe = WakatimeStartEndTimeframe(
+        start=(today - timedelta(days=6)).strftime(r"%Y-%m-%d"),
+        end=today.strftime(r"%Y-%m-%d"),
+    )
+    stmt = select_planned_refreshes(timeframe)
+
+    nodes = await explain(test_db, stmt)
+
+    assert ("Index Only Scan", COVERING_DATE_USER_INDEX) in nodes, nodes
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_leaderboard_totals_use_weekly_rollup_index(
+    test_db: AsyncSession, seeded_user_ids: list[UUID]
+):
+    today = date.today()
+    stmt = select_weekly_leaderboard_totals(today - timedelta(days=today.weekday()))
+
+    nodes = await explain(test_db, stmt)
+
+    # This reads the weekly rollups now, so it's just a scan of one week's worth of rows
+    assert any(
+        node_type in ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+        and index_name == WEEKLY_ROLLUP_INDEX
+        for node_type, index_name in nodes
+    ), nodes
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_week_range_only_scans_its_own_partitions(
+    test_db: AsyncSession, seeded_user_ids: list[UUID]
+):
+    today = date.today()
+    stmt = select_user_durations(seeded_user_ids[0], today - timedelta(days=6), today)
+
+    relations = {
+        node["Relation Name"]
+        for node in await plan_nodes(test_db, stmt)
+        if "Relation Name" in node
+    }
+
+    # A week can only ever span two months
+    assert 1 <= len(relations) <= 2, relations
+    assert all(r.startswith("codecrunchr_wakatime_durations_") for r in relations)
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import jwt as pyjwt
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from src.dependencies import auth
+
+
+def make_header(**claims) -> HTTPAuthorizationCredentials:
+    token = pyjwt.encode(claims, key=auth.get_jwt_secret(), algorithm="HS256")
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+
+@pytest.mark.asyncio
+async def test_jwt_is_only_verified_once(monkeypatch: pytest.MonkeyPatch):
+    decodes = []
+    real_decode = auth.decode_jwt_payload
+
+    def counting_decode(jwt_token: str):
+        decodes.append(jwt_token)
+        return real_decode(jwt_token)
+
+    monkeypatch.setattr(auth, "decode_jwt_payload", counting_decode)
+
+    user_id = uuid4()
+    header = make_header(
+        user_id=str(user_id), exp=datetime.now(tz=timezone.utc) + timedelta(minutes=5)
+    )
+
+    first = await auth.get_auth_context(header)
+    second = await auth.get_auth_context(header)
+
+    assert first["user_id"] == second["user_id"] == user_id
+    assert len(decodes) == 1
+
+    # The cached entry shouldn't outlive the token itself
+    cached = auth.USER_ID_CACHE.local.cached_items[first["cache_key"]]
+    assert cached.expires_at is not None
+    assert cached.expires_at <= datetime.now() + timedelta(minutes=5)
+
+
+@pytest.mark.asyncio
+async def test_expired_jwt_is_rejected():
+    header = make_header(
+        user_id=str(uuid4()), exp=datetime.now(tz=timezone.utc) - timedelta(minutes=1)
+    )
+
+    with pytest.raises(HTTPException) as exc_info:
+        await auth.get_auth_context(header)
+
+    assert exc_info.value.status_code == 401
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.caching import Cache
+
+
+def test_least_recently_used_item_is_evicted():
+    cache: Cache[int] = Cache(max_size=2)
+
+    cache.add("a", 1)
+    cache.add("b", 2)
+
+    # Touching "a" makes "b" the oldest one
+    assert cache.get("a") == 1
+    cache.add("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expired_items_are_not_served():
+    cache: Cache[int] = Cache()
+
+    cache.add("fresh", 1, ttl=timedelta(minutes=5))
+    cache.add("forever", 2)
+
+    # Sneak an expired item past `add`, which won't store one
+    cache.add("stale", 3)
+    cache.cached_items["stale"].expires_at = datetime.now() - timedelta(seconds=1)
+
+    assert cache.get("fresh") == 1
+    assert cache.get("forever") == 2
+    assert cache.get("stale") is None
+    assert "stale" not in cache.cached_items
+
+
+def test_clean_removes_every_expired_item():
+    cache: Cache[int] = Cache()
+
+    for i in range(10):
+        cache.add(str(i), i)
+        cache.cached_items[str(i)].expires_at = datetime.now() - timedelta(seconds=1)
+
+    cache.add("keep", 42)
+
+    assert cache.clean() == 10
+    assert len(cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_get_or_load_only_loads_on_miss():
+    loads = []
+
+    async def loader(key: str) -> int:
+        loads.append(key)
+        return len(key)
+
+    cache: Cache[int] = Cache(loader=loader)
+
+    assert await cache.get_or_load("abc") == 3
+    assert await cache.get_or_load("abc") == 3
+    assert loads == ["abc"]
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,84 @@
+from datetime import date
+
+from src.db.helpers import (
+    subtract_date_range,
+    group_into_date_ranges,
+    split_into_iso_weeks,
+    get_summary_days,
+)
+from src.wakatime.summaries import LeanSummaryResponseModel
+
+
+def test_subtract_date_range():
+    week = (date(2026, 3, 2), date(2026, 3, 8))
+
+    # Nothing in flight, fetch the whole thing
+    assert subtract_date_range(week, []) == [week]
+
+    # Today is already being fetched, so only fetch the rest of the week
+    assert subtract_date_range(week, [(date(2026, 3, 8), date(2026, 3, 8))]) == [
+        (date(2026, 3, 2), date(2026, 3, 7))
+    ]
+
+    # Something in the middle of the week splits it in two
+    assert subtract_date_range(week, [(date(2026, 3, 4), date(2026, 3, 5))]) == [
+        (date(2026, 3, 2), date(2026, 3, 3)),
+        (date(2026, 3, 6), date(2026, 3, 8)),
+    ]
+
+    # Fully covered, nothing left to do
+    assert subtract_date_range(week, [(date(2026, 3, 1), date(2026, 3, 9))]) == []
+
+
+def test_group_into_date_ranges():
+    assert group_into_date_ranges([]) == []
+
+    # Only monday and today (sunday) are missing, so only those get refetched
+    assert group_into_date_ranges([date(2026, 3, 2), date(2026, 3, 8)]) == [
+        (date(2026, 3, 2), date(2026, 3, 2)),
+        (date(2026, 3, 8), date(2026, 3, 8)),
+    ]
+
+    assert group_into_date_ranges(
+        [date(2026, 3, 2), date(2026, 3, 3), date(2026, 3, 4), date(2026, 3, 6)]
+    ) == [
+        (date(2026, 3, 2), date(2026, 3, 4)),
+        (date(2026, 3, 6), date(2026, 3, 6)),
+    ]
+
+
+def test_single_day_summary_in_utc():
+    # For users in UTC, the start and end of a single day fall on the same date
+    summary = LeanSummaryResponseModel.model_validate(
+        {
+            "data": [
+                {
+                    "grand_total": {"total_seconds": 60.0},
+                    "languages": [],
+                    "range": {"date": "2026-03-02"},
+                }
+            ],
+            "start": "2026-03-02T00:00:00Z",
+            "end": "2026-03-02T23:59:59Z",
+        }
+    )
+
+    assert get_summary_days(summary) == [date(2026, 3, 2)]
+
+
+def test_split_into_iso_weeks():
+    # Wednesday to the following tuesday crosses one week boundary
+    assert split_into_iso_weeks(date(2026, 3, 4), date(2026, 3, 10)) == [
+        (date(2026, 3, 4), date(2026, 3, 8)),
+        (date(2026, 3, 9), date(2026, 3, 10)),
+    ]
+
+    # A single day is a single chunk
+    assert split_into_iso_weeks(date(2026, 3, 4), date(2026, 3, 4)) == [
+        (date(2026, 3, 4), date(2026, 3, 4))
+    ]
+
+    # A whole year is split into every (partial) ISO week it touches
+    year = split_into_iso_weeks(date(2025, 1, 1), date(2025, 12, 31))
+    assert len(year) == 53
+    assert all((end - start).days < 7 for start, end in year)
@@ -0,0 +1,189 @@
+from datetime import date, timedelta
+from typing import AsyncGenerator
+from uuid import uuid4
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db.helpers import get_month_start, get_week_start, update_user_durations
+from src.db.models import (
+    MonthlyDurationRollup,
+    User,
+    WakatimeDuration,
+    WakatimeLanguageDuration,
+    WeeklyDurationRollup,
+    WeeklyLanguageRollup,
+)
+from src.db.partitions import create_monthly_partitions
+from src.jobs.leaderboards import select_weekly_leaderboard_totals
+from src.wakatime import WakatimeTokens
+from src.wakatime.summaries import LeanSummaryResponseModel
+
+
+def test_week_and_month_starts():
+    # 2026-10-17 is a saturday
+    assert get_week_start(date(2026, 10, 17)) == date(2026, 10, 12)
+    assert get_week_start(date(2026, 10, 12)) == date(2026, 10, 12)
+    assert get_month_start(date(2026, 10, 17)) == date(2026, 10, 1)
+
+
+def make_summary(days: dict[date, dict[str, float]]) -> LeanSummaryResponseModel:
+    """
+    Builds a summary out of each day's seconds per language.
+    """
+    return LeanSummaryResponseModel.model_validate(
+        {
+            "data": [
+                {
+                    "grand_total": {"total_seconds": sum(languages.values())},
+                    "languages": [
+                        {"name": name, "total_seconds": seconds}
+                        for name, seconds in languages.items()
+                    ],
+                    "range": {"date": day.isoformat()},
+                }
+                for day, languages in days.items()
+            ],
+            "start": "",
+            "end": "",
+        }
+    )
+
+
+@pytest_asyncio.fixture(scope="function", loop_scope="session")
+async def tokens(test_db: AsyncSession) -> AsyncGenerator[WakatimeTokens, None]:
+    user_id = uuid4()
+
+    test_db.add(User(id=user_id))
+    await test_db.flush()
+
+    yield WakatimeTokens(user_id=user_id, access_token="", refresh_token="")
+
+    await test_db.rollback()
+
+
+# Both ways of writing durations should end up with exactly the same thing
+@pytest.mark.parametrize("bulk", [False, True])
+@pytest.mark.asyncio(loop_scope="session")
+async def test_rewriting_durations_keeps_rollups_in_sync(
+    test_db: AsyncSession, tokens: WakatimeTokens, bulk: bool
+):
+    # The 30th and the 1st are in the same week, but not the same month
+    sep_30, oct_1 = date(2026, 9, 30), date(2026, 10, 1)
+    week = get_week_start(sep_30)
+
+    connection = await test_db.connection()
+    await create_monthly_partitions(connection, start=sep_30, months=2)
+
+    await update_user_durations(
+        test_db,
+        tokens,
+        make_summary({sep_30: {"python": 60.0, "go": 30.0}, oct_1: {"python": 10.0}}),
+        bulk=bulk,
+    )
+
+    # Then the same days get recached, with one of them changing (and gaining a language)
+    durations = await update_user_durations(
+        test_db,
+        tokens,
+        make_summary(
+            {sep_30: {"python": 60.0, "go": 30.0}, oct_1: {"python": 40.0, "rust": 5.0}}
+        ),
+        bulk=bulk,
+    )
+
+    assert [d.date for d in durations] == [sep_30, oct_1]
+    assert [d.total_seconds for d in durations] == [90.0, 45.0]
+
+    user_id = tokens["user_id"]
+
+    # (the languages only get loaded onto the returned durations outside of bulk mode)
+    if not bulk:
+        assert {
+            lang.language: lang.total_seconds for lang in durations[1].languages
+        } == {"python": 40.0, "rust": 5.0}
+
+    stored_languages = dict(
+        (
+            await test_db.execute(
+                select(
+                    WakatimeLanguageDuration.language,
+                    WakatimeLanguageDuration.total_seconds,
+                ).where(WakatimeLanguageDuration.parent_id == durations[1].id)
+            )
+        ).all()
+    )
+    assert stored_languages == {"python": 40.0, "rust": 5.0}
+
+    stored = await test_db.scalars(
+        select(WakatimeDuration).where(WakatimeDuration.user_id == user_id)
+    )
+    assert sorted(d.total_seconds for d in stored) == [45.0, 90.0]
+
+    weekly = await test_db.scalar(
+        select(WeeklyDurationRollup.total_seconds)
+        .where(WeeklyDurationRollup.user_id == user_id)
+        .where(WeeklyDurationRollup.week_start == week)
+    )
+    assert weekly == 135.0
+
+    monthly = dict(
+        (
+            await test_db.execute(
+                select(
+                    MonthlyDurationRollup.month_start,
+                    MonthlyDurationRollup.total_seconds,
+                ).where(MonthlyDurationRollup.user_id == user_id)
+            )
+        ).all()
+    )
+    assert monthly == {get_month_start(sep_30): 90.0, get_month_start(oct_1): 45.0}
+
+    languages = dict(
+        (
+            await test_db.execute(
+                select(
+                    WeeklyLanguageRollup.language, WeeklyLanguageRollup.total_seconds
+                ).where(WeeklyLanguageRollup.user_id == user_id)
+            )
+        ).all()
+    )
+    assert languages == {"python": 100.0, "go": 30.0, "rust": 5.0}
+
+    # Nothing from the week after should have been touched
+    assert (
+        await test_db.scalar(
+            select(WeeklyDurationRollup.total_seconds)
+            .where(WeeklyDurationRollup.user_id == user_id)
+            .where(WeeklyDurationRollup.week_start == week + timedelta(days=7))
+        )
+        is None
+    )
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+@pytest.mark.asyncio(loop_scope="session")
+async def test_week_without_any_coding_still_gets_a_rollup(
+    test_db: AsyncSession, tokens: WakatimeTokens, bulk: bool
+):
+    sep_30, oct_1 = date(2026, 9, 30), date(2026, 10, 1)
+    week = get_week_start(sep_30)
+
+    connection = await test_db.connection()
+    await create_monthly_partitions(connection, start=sep_30, months=2)
+
+    await update_user_durations(
+        test_db, tokens, make_summary({sep_30: {}, oct_1: {}}), bulk=bulk
+    )
+
+    # Otherwise they'd never show up on that week's leaderboard
+    rows = (
+        await test_db.execute(
+            select_weekly_leaderboard_totals(week).where(
+                WeeklyDurationRollup.user_id == tokens["user_id"]
+            )
+        )
+    ).all()
+    assert [row.total for row in rows] == [0.0]
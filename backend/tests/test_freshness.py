@@ -0,0 +1,71 @@
+from datetime import timedelta
+from uuid import uuid4
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.dependencies.auth import AuthContext, get_auth_context
+from src.dependencies.database import get_request_session
+from src.dependencies.freshness import MIN_MAX_STALENESS, get_max_staleness
+from src.routers import goals
+from src.wakatime import WakatimeTokens
+
+USER_ID = uuid4()
+
+
+def test_max_staleness_is_clamped_to_the_minimum():
+    assert get_max_staleness(None) is None
+    assert get_max_staleness(0) == MIN_MAX_STALENESS
+    assert get_max_staleness(5) == MIN_MAX_STALENESS
+    assert get_max_staleness(300) == timedelta(seconds=300)
+
+
+@pytest.fixture
+def client() -> TestClient:
+    async def fake_session():
+        yield None
+
+    app = FastAPI()
+    app.include_router(goals.router)
+    app.dependency_overrides[get_auth_context] = lambda: AuthContext(
+        user_id=USER_ID, cache_key=""
+    )
+    app.dependency_overrides[get_request_session] = fake_session
+
+    return TestClient(app)
+
+
+def test_goals_with_max_staleness_refresh_durations_first(
+    client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    calls = []
+
+    async def fake_tokens(auth, session):
+        return WakatimeTokens(
+            user_id=auth["user_id"], access_token="", refresh_token=""
+        )
+
+    async def fake_fetch(*, session, tokens, timeframe, today_refresh_threshold):
+        calls.append(("fetch", today_refresh_threshold))
+        return []
+
+    async def fake_refresh(user_id, today, *, primary):
+        calls.append(("refresh", user_id))
+        return []
+
+    monkeypatch.setattr(goals, "get_current_user_wakatime_tokens", fake_tokens)
+    monkeypatch.setattr(goals, "evil_duration_fetching_function", fake_fetch)
+    monkeypatch.setattr(goals.get_goals_with_progress, "refresh", fake_refresh)
+
+    # Anything under the minimum gets bumped up to it
+    resp = client.get("/goals", params={"max_staleness": 1})
+
+    assert resp.status_code == 200
+
+    # The week's durations get brought up to date, then the progress gets recalculated
+    assert calls == [("fetch", MIN_MAX_STALENESS), ("refresh", USER_ID)]
+
+
+def test_max_staleness_cant_be_negative(client: TestClient):
+    assert client.get("/goals", params={"max_staleness": -1}).status_code == 422
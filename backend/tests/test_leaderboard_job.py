@@ -0,0 +1,234 @@
+import asyncio
+from contextlib import asynccontextmanager
+from uuid import UUID, uuid4
+
+import pytest
+
+from src.db.refresh import PlannedRefresh, RefreshTier
+from src.jobs import leaderboards
+from src.wakatime import WakatimeStartEndTimeframe, WakatimeTokens
+
+TIMEFRAME = WakatimeStartEndTimeframe(start="2026-10-12", end="2026-10-17")
+
+
+class FakeSession(object):
+    def __init__(self) -> None:
+        self.committed = False
+        self.closed = False
+        self.looking_up = False
+
+    async def commit(self) -> None:
+        self.committed = True
+
+
+def patch_job(
+    monkeypatch: pytest.MonkeyPatch,
+    user_ids: list[UUID],
+    fetch,
+    lookup_sessions: list[FakeSession] | None = None,
+) -> list:
+    """
+    Swaps out the database and wakatime for fakes, returns the ids of the users that
+    have been handed to the workers so far (in order).
+
+    The sessions that tokens get looked up in are added to `lookup_sessions`.
+    """
+    produced: list[UUID] = []
+
+    @asynccontextmanager
+    async def fake_get_session():
+        session = FakeSession()
+
+        try:
+            yield session
+        finally:
+            session.closed = True
+
+    async def fake_plan(*, after=None, limit=None, **_):
+        start = 0 if after is None else user_ids.index(after["user_id"]) + 1
+        end = None if limit is None else start + limit
+
+        return [
+            PlannedRefresh(
+                user_id=user_id, tier=RefreshTier.ACTIVE, last_active_at=None
+            )
+            for user_id in user_ids[start:end]
+        ]
+
+    async def fake_token_lookup(*, session, user_ids, **_):
+        if lookup_sessions is not None:
+            lookup_sessions.append(session)
+
+        session.looking_up = True
+
+        for user_id in user_ids:
+            # Give the workers a chance to start
+            await asyncio.sleep(0)
+            produced.append(user_id)
+            yield WakatimeTokens(user_id=user_id, access_token="", refresh_token="")
+
+        session.looking_up = False
+
+    monkeypatch.setattr(leaderboards, "get_session", fake_get_session)
+    monkeypatch.setattr(leaderboards, "plan_duration_refreshes", fake_plan)
+    monkeypatch.setattr(
+        leaderboards, "wakatime_token_lookup_generator", fake_token_lookup
+    )
+    monkeypatch.setattr(leaderboards, "evil_duration_fetching_function", fetch)
+
+    return produced
+
+
+@pytest.mark.asyncio
+async def test_each_user_is_refreshed_in_their_own_session(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    user_ids = [uuid4() for _ in range(6)]
+    failing_user_id = user_ids[2]
+
+    refreshed_in: dict = {}
+
+    async def fake_fetch(*, session, tokens, timeframe):
+        await asyncio.sleep(0.01)
+
+        if tokens["user_id"] == failing_user_id:
+            raise ValueError("Failed to get durations")
+
+        refreshed_in[tokens["user_id"]] = session
+
+    patch_job(monkeypatch, user_ids, fake_fetch)
+
+    refreshed, failed = await leaderboards._refresh_weekly_durations(TIMEFRAME)
+
+    assert (refreshed, failed) == (5, 1)
+
+    # Everyone else still got refreshed (and committed), each in a session of their own
+    assert set(refreshed_in) == set(user_ids) - {failing_user_id}
+    assert len({id(session) for session in refreshed_in.values()}) == 5
+    assert all(session.committed for session in refreshed_in.values())
+
+
+@pytest.mark.asyncio
+async def test_workers_and_queue_stay_bounded(monkeypatch: pytest.MonkeyPatch):
+    user_ids = [uuid4() for _ in range(50)]
+    settings = leaderboards.LeaderboardRefreshSettings(
+        workers=3, queue_size=2, batch_size=5
+    )
+
+    finished = 0
+    in_flight = 0
+    most_in_flight = 0
+    furthest_ahead = 0
+
+    async def fake_fetch(*, session, tokens, timeframe):
+        nonlocal finished, in_flight, most_in_flight, furthest_ahead
+
+        in_flight += 1
+        most_in_flight = max(most_in_flight, in_flight)
+
+        # How many users have been looked up but aren't done with yet
+        furthest_ahead = max(furthest_ahead, len(produced) - finished)
+
+        await asyncio.sleep(0.001)
+
+        in_flight -= 1
+        finished += 1
+
+    produced = patch_job(monkeypatch, user_ids, fake_fetch)
+
+    assert await leaderboards._refresh_weekly_durations(TIMEFRAME, settings) == (50, 0)
+
+    assert most_in_flight == settings.workers
+
+    # The lookup never gets more than a batch (and a full queue) ahead of the workers
+    assert (
+        furthest_ahead <= settings.workers + settings.queue_size + settings.batch_size
+    )
+
+
+@pytest.mark.asyncio
+async def test_no_session_is_held_while_waiting_on_the_queue(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    user_ids = [uuid4() for _ in range(20)]
+    settings = leaderboards.LeaderboardRefreshSettings(
+        workers=1, queue_size=1, batch_size=4
+    )
+
+    lookup_sessions: list[FakeSession] = []
+    open_while_refreshing = 0
+
+    async def fake_fetch(*, session, tokens, timeframe):
+        nonlocal open_while_refreshing
+
+        # The producer is either looking up its next batch, or stuck waiting on the
+        # queue right now (and only the first of those should have a session open)
+        await asyncio.sleep(0.001)
+        open_while_refreshing += sum(
+            not s.closed and not s.looking_up for s in lookup_sessions
+        )
+
+    patch_job(monkeypatch, user_ids, fake_fetch, lookup_sessions)
+
+    assert await leaderboards._refresh_weekly_durations(TIMEFRAME, settings) == (20, 0)
+
+    # Every batch got a session of its own, which was closed before it was queued up
+    # (and one more to find out there was nobody left)
+    assert len(lookup_sessions) == 6
+    assert open_while_refreshing == 0
+
+
+@pytest.mark.asyncio
+async def test_slow_users_time_out(monkeypatch: pytest.MonkeyPatch):
+    user_ids = [uuid4() for _ in range(4)]
+    slow_user_id = user_ids[0]
+
+    async def fake_fetch(*, session, tokens, timeframe):
+        if tokens["user_id"] == slow_user_id:
+            await asyncio.sleep(60)
+
+    patch_job(monkeypatch, user_ids, fake_fetch)
+
+    settings = leaderboards.LeaderboardRefreshSettings(workers=2, user_timeout=0.05)
+
+    assert await leaderboards._refresh_weekly_durations(TIMEFRAME, settings) == (3, 1)
+
+
+@pytest.mark.asyncio
+async def test_cancelling_the_job_stops_everything(monkeypatch: pytest.MonkeyPatch):
+    user_ids = [uuid4() for _ in range(100)]
+    started = asyncio.Event()
+    cancelled = 0
+
+    async def fake_fetch(*, session, tokens, timeframe):
+        nonlocal cancelled
+
+        started.set()
+
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled += 1
+            raise
+
+    produced = patch_job(monkeypatch, user_ids, fake_fetch)
+
+    async def fake_rebuild():
+        await leaderboards._refresh_weekly_durations(
+            TIMEFRAME,
+            leaderboards.LeaderboardRefreshSettings(
+                workers=2, queue_size=4, batch_size=10
+            ),
+        )
+
+    monkeypatch.setattr(leaderboards, "_rebuild_weekly_leaderboard", fake_rebuild)
+
+    job = asyncio.create_task(leaderboards.leaderboard_job())
+    await started.wait()
+
+    await leaderboards.cancel_leaderboard_jobs()
+
+    assert job.cancelled()
+    assert cancelled == 2
+    assert len(produced) < len(user_ids)
+    assert not leaderboards.RUNNING_LEADERBOARD_JOBS
@@ -0,0 +1,95 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from src.caching.backends import CacheInvalidation, get_cache_backend
+from src.caching.memoize import memoize
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_only_call_once():
+    calls = []
+
+    @memoize(ttl=timedelta(minutes=1))
+    async def slow_square(n: int) -> int:
+        calls.append(n)
+        await asyncio.sleep(0.01)
+        return n * n
+
+    results = await asyncio.gather(*[slow_square(4) for _ in range(5)])
+
+    assert results == [16] * 5
+    assert calls == [4]
+
+    # It's in the cache now, so this shouldn't call it again either
+    assert await slow_square(4) == 16
+    assert calls == [4]
+    assert slow_square.stats()["hit_ratio"] > 0
+
+
+@pytest.mark.asyncio
+async def test_invalidate_by_key_prefix():
+    calls = []
+
+    @memoize(ttl=timedelta(minutes=1), key=lambda user, day, token: f"{user}:{day}")
+    async def goals(user: str, day: int, token: str) -> str:
+        calls.append((user, day))
+        return f"{user}-{day}"
+
+    await goals("alice", 1, "secret")
+    await goals("alice", 2, "other secret")
+    await goals("bob", 1, "secret")
+
+    # The token isn't part of the key, so this is a hit
+    await goals("alice", 1, "different")
+    assert len(calls) == 3
+
+    assert await goals.invalidate("alice") == 2
+
+    await goals("alice", 1, "secret")
+    await goals("bob", 1, "secret")
+    assert len(calls) == 4
+
+
+@pytest.mark.asyncio
+async def test_refresh_replaces_the_cached_result():
+    results = iter(["old", "new"])
+
+    @memoize(ttl=timedelta(minutes=1))
+    async def latest(n: int) -> str:
+        return next(results)
+
+    assert await latest(1) == "old"
+    assert await latest(1) == "old"
+
+    assert await latest.refresh(1) == "new"
+    assert await latest(1) == "new"
+
+
+@pytest.mark.asyncio
+async def test_invalidation_from_another_worker_during_a_load():
+    started = asyncio.Event()
+    finish = asyncio.Event()
+    results = iter(["old", "new"])
+
+    @memoize(ttl=timedelta(minutes=1))
+    async def latest(n: int) -> str:
+        started.set()
+        await finish.wait()
+        return next(results)
+
+    loading = asyncio.create_task(latest(1))
+    await started.wait()
+
+    # Another worker invalidates it while we're still loading (this is what the
+    # backend does when the invalidation reaches us)
+    get_cache_backend().notify_subscribers(
+        CacheInvalidation(namespace=latest.cache.namespace, key="", is_prefix=True)
+    )
+
+    finish.set()
+
+    # Whoever was already waiting gets what was loaded, but it doesn't get cached
+    assert await loading == "old"
+    assert await latest(1) == "new"
@@ -0,0 +1,138 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import AsyncGenerator
+from uuid import UUID, uuid4
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete
+
+from src.db import get_database_singleton, get_session, helpers
+from src.db.models import User
+from src.wakatime import WakatimeAPIResponse, WakatimeTokens
+from src.wakatime.auth import AccessTokensResponse
+
+
+@pytest.mark.asyncio
+async def test_concurrent_refreshes_are_coalesced(monkeypatch: pytest.MonkeyPatch):
+    refreshes = []
+
+    async def fake_refresh(user_id, *, pos_offset):
+        refreshes.append(user_id)
+        await asyncio.sleep(0.01)
+
+        tokens = WakatimeTokens(
+            user_id=user_id, access_token="new", refresh_token="new"
+        )
+        return tokens, datetime.now() + timedelta(days=365)
+
+    monkeypatch.setattr(helpers, "_refresh_oauth_credentials", fake_refresh)
+
+    user_id = uuid4()
+    results = await asyncio.gather(
+        *[helpers.refresh_oauth_credentials(user_id) for _ in range(10)]
+    )
+
+    assert len(refreshes) == 1
+    assert all(tokens["access_token"] == "new" for tokens, _ in results)
+
+
+@pytest_asyncio.fixture(loop_scope="session")
+async def expired_user(initialized_test_db: None) -> AsyncGenerator[UUID, None]:
+    user_id = uuid4()
+
+    # This has to actually be committed, the refresh reads it in sessions of its own
+    async with get_session() as session:
+        session.add(User(id=user_id))
+        await session.flush()
+
+        await helpers.update_oauth_tokens(
+            session,
+            user_id,
+            "old_access",
+            "old_refresh",
+            datetime.now() - timedelta(days=1),
+        )
+        await session.commit()
+
+    yield user_id
+
+    async with get_session() as session:
+        await session.execute(delete(User).where(User.id == user_id))
+        await session.commit()
+
+
+def refreshed_tokens(
+    user_id: UUID, token: str
+) -> WakatimeAPIResponse[AccessTokensResponse]:
+    return WakatimeAPIResponse(
+        status_code=200,
+        response=AccessTokensResponse(
+            user_id=user_id,
+            access_token=f"{token}_access",
+            refresh_token=f"{token}_refresh",
+            expires_at=datetime.now() + timedelta(days=365),
+        ),
+    )
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_no_connection_is_held_while_waiting_on_wakatime(
+    expired_user: UUID, monkeypatch: pytest.MonkeyPatch
+):
+    database = get_database_singleton()
+    checked_out = database.pool_stats()["checked_out"]
+    sent = []
+
+    async def fake_refresh_access_token(refresh_token):
+        sent.append(refresh_token)
+
+        # Nothing of ours is sitting in the pool (or locking the row) in the meantime
+        assert database.pool_stats()["checked_out"] == checked_out
+
+        return refreshed_tokens(expired_user, "new")
+
+    monkeypatch.setattr(helpers, "refresh_access_token", fake_refresh_access_token)
+
+    tokens, _ = await helpers._refresh_oauth_credentials(
+        expired_user, pos_offset=helpers.OAUTH_EARLY_EXPIRY_DELTA
+    )
+
+    assert sent == ["old_refresh"]
+    assert tokens["access_token"] == "new_access"
+
+    stored = await helpers.get_oauth_credentials(expired_user)
+    assert stored is not None
+    assert helpers.decrypt_oauth_credentials(stored) == tokens
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_refresh_from_another_worker_wins(
+    expired_user: UUID, monkeypatch: pytest.MonkeyPatch
+):
+    async def fake_refresh_access_token(refresh_token):
+        # Another worker refreshes them (and saves them) while we're waiting
+        async with get_session() as session:
+            await helpers.update_oauth_tokens(
+                session,
+                expired_user,
+                "theirs_access",
+                "theirs_refresh",
+                datetime.now() + timedelta(days=365),
+            )
+            await session.commit()
+
+        return refreshed_tokens(expired_user, "ours")
+
+    monkeypatch.setattr(helpers, "refresh_access_token", fake_refresh_access_token)
+
+    tokens, _ = await helpers._refresh_oauth_credentials(
+        expired_user, pos_offset=helpers.OAUTH_EARLY_EXPIRY_DELTA
+    )
+
+    # Their tokens are the ones that were saved first, so everyone uses those
+    assert tokens["access_token"] == "theirs_access"
+
+    stored = await helpers.get_oauth_credentials(expired_user)
+    assert stored is not None
+    assert helpers.decrypt_oauth_credentials(stored) == tokens
@@ -0,0 +1,75 @@
+from datetime import date
+from uuid import uuid4
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db.helpers import update_user_durations
+from src.db.models import User
+from src.db.partitions import (
+    MissingPartitionError,
+    add_months,
+    create_monthly_partitions,
+    is_partition_name,
+    partition_name,
+)
+from src.wakatime import WakatimeTokens
+from src.wakatime.summaries import LeanSummaryResponseModel
+
+
+def test_add_months_wraps_around_the_year():
+    assert add_months(date(2026, 11, 17), 0) == date(2026, 11, 1)
+    assert add_months(date(2026, 11, 1), 2) == date(2027, 1, 1)
+    assert add_months(date(2026, 1, 1), -1) == date(2025, 12, 1)
+
+
+def test_partition_names_are_recognized():
+    name = partition_name("codecrunchr_wakatime_durations", date(2026, 3, 1))
+
+    assert name == "codecrunchr_wakatime_durations_2026_03"
+    assert is_partition_name(name)
+    assert is_partition_name("codecrunchr_wakatime_language_durations_history")
+
+    # The partitioned tables themselves aren't partitions
+    assert not is_partition_name("codecrunchr_wakatime_durations")
+    assert not is_partition_name("codecrunchr_weekly_leaderboard_2026_03")
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_writing_past_the_last_partition_fails_loudly(test_db: AsyncSession):
+    user_id = uuid4()
+    tokens = WakatimeTokens(user_id=user_id, access_token="", refresh_token="")
+
+    # Way past anything the maintenance job would have made a partition for
+    day = date(2099, 1, 15)
+    summary = LeanSummaryResponseModel.model_validate(
+        {
+            "data": [
+                {
+                    "grand_total": {"total_seconds": 60.0},
+                    "languages": [{"name": "Python", "total_seconds": 60.0}],
+                    "range": {"date": day.isoformat()},
+                }
+            ],
+            "start": "",
+            "end": "",
+        }
+    )
+
+    test_db.add(User(id=user_id))
+    await test_db.flush()
+
+    for bulk in (False, True):
+        with pytest.raises(MissingPartitionError):
+            async with test_db.begin_nested():
+                await update_user_durations(test_db, tokens, summary, bulk=bulk)
+
+    # ... and once the partition exists, the same write goes through
+    connection = await test_db.connection()
+    await create_monthly_partitions(connection, start=day, months=1)
+
+    durations = await update_user_durations(test_db, tokens, summary)
+
+    assert [d.date for d in durations] == [day]
+
+    await test_db.rollback()
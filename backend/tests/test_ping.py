@@ -1,3 +1,4 @@
+import pytest
 from fastapi.testclient import TestClient
 
 
@@ -6,3 +7,19 @@ def test_ping(test_client: TestClient):
     resp = test_client.get("/ping")
 
     assert resp.status_code == 200
+
+
+def test_debug_endpoints_are_off_by_default(test_client: TestClient):
+    for endpoint in ("/debug/wakatime", "/debug/database", "/debug/caches"):
+        assert test_client.get(endpoint).status_code == 404
+
+
+def test_debug_endpoints_can_be_turned_on(
+    test_client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setenv("DEBUG_ENDPOINTS", "true")
+
+    resp = test_client.get("/debug/caches")
+
+    assert resp.status_code == 200
+    assert "memoized" in resp.json()
@@ -0,0 +1,205 @@
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+from uuid import UUID, uuid4
+import time
+
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db import helpers
+from src.db.models import (
+    OAuth2Credentials,
+    User,
+    WakatimeDuration,
+    WakatimeUserProfile,
+)
+from src.db.partitions import create_monthly_partitions
+from src.db.refresh import PlannedRefresh, RefreshTier, plan_duration_refreshes
+from src.wakatime import WakatimeStartEndTimeframe, WakatimeTokens
+
+# A saturday, so the week so far is the 12th to the 17th
+NOW = datetime(2026, 10, 17, 12, 0)
+TODAY = NOW.date()
+TIMEFRAME = WakatimeStartEndTimeframe(start="2026-10-12", end="2026-10-17")
+
+
+def week_of_durations(
+    user_id: UUID, *, cached_ago: timedelta, today_seconds: float = 0.0
+) -> list[dict]:
+    """
+    A row for each day of the week so far, with nothing on them except (maybe) today.
+    """
+    return [
+        dict(
+            user_id=user_id,
+            date=day,
+            total_seconds=today_seconds if day == TODAY else 0.0,
+            last_cached_at=NOW - cached_ago,
+        )
+        for day in (
+            TIMEFRAME.start_date + timedelta(days=n)
+            for n in range(TIMEFRAME.get_days_inclusive())
+        )
+    ]
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_users_are_planned_by_activity(test_db: AsyncSession):
+    users = {
+        name: uuid4()
+        for name in (
+            "coding",
+            "coding_fresh",
+            "heartbeat",
+            "idle_fresh",
+            "idle_stale",
+            "no_durations",
+            "no_credentials",
+        )
+    }
+
+    connection = await test_db.connection()
+    await create_monthly_partitions(connection, start=date(2026, 9, 1), months=2)
+
+    await test_db.execute(insert(User), [{"id": user_id} for user_id in users.values()])
+    await test_db.execute(
+        insert(OAuth2Credentials),
+        [
+            dict(
+                user_id=user_id,
+                provider="wakatime",
+                access_token="",
+                refresh_token="",
+                expires_at=NOW + timedelta(days=365),
+            )
+            for name, user_id in users.items()
+            if name != "no_credentials"
+        ],
+    )
+    await test_db.execute(
+        insert(WakatimeUserProfile),
+        [
+            dict(
+                user_id=users["heartbeat"],
+                display_name="",
+                full_name="",
+                username="",
+                photo_url="",
+                is_photo_public=False,
+                email="",
+                timezone="UTC",
+                last_heartbeat_at=NOW - timedelta(minutes=5),
+            )
+        ],
+    )
+    await test_db.execute(
+        insert(WakatimeDuration),
+        [
+            # Coding today, but their durations haven't been touched in a couple hours
+            *week_of_durations(
+                users["coding"], cached_ago=timedelta(hours=2), today_seconds=600
+            ),
+            # Coding today, and were just refreshed
+            *week_of_durations(
+                users["coding_fresh"],
+                cached_ago=timedelta(minutes=10),
+                today_seconds=600,
+            ),
+            # Nothing on any day, but their last heartbeat was a few minutes ago
+            *week_of_durations(users["heartbeat"], cached_ago=timedelta(hours=2)),
+            # Haven't coded all week, idle users only get refreshed once a day
+            *week_of_durations(users["idle_fresh"], cached_ago=timedelta(hours=5)),
+            *week_of_durations(users["idle_stale"], cached_ago=timedelta(days=1)),
+            *week_of_durations(users["no_credentials"], cached_ago=timedelta(days=1)),
+        ],
+    )
+
+    planned = [
+        p
+        for p in await plan_duration_refreshes(test_db, TIMEFRAME, now=NOW)
+        if p["user_id"] in users.values()
+    ]
+
+    # Most recently active first, then everyone we've never seen coding
+    assert [p["user_id"] for p in planned] == [
+        users["heartbeat"],
+        users["coding"],
+        *sorted([users["idle_stale"], users["no_durations"]]),
+    ]
+    assert [p["tier"] for p in planned] == [
+        RefreshTier.ACTIVE,
+        RefreshTier.ACTIVE,
+        RefreshTier.IDLE,
+        RefreshTier.IDLE,
+    ]
+    assert planned[0]["last_active_at"] == NOW - timedelta(minutes=5)
+    assert planned[1]["last_active_at"] == datetime(2026, 10, 17)
+
+    # Going through it a page at a time gets everyone, in the same order
+    paged: list[PlannedRefresh] = []
+
+    while page := await plan_duration_refreshes(
+        test_db,
+        TIMEFRAME,
+        now=NOW,
+        after=paged[-1] if paged else None,
+        limit=2,
+    ):
+        paged.extend(page)
+
+    assert [p for p in paged if p["user_id"] in users.values()] == planned
+
+    await test_db.rollback()
+
+
+@pytest.fixture
+def local_timezone(monkeypatch: pytest.MonkeyPatch):
+    """
+    Runs the test somewhere that isn't UTC. (UTC+5:30)
+    """
+    monkeypatch.setenv("TZ", "Asia/Kolkata")
+    time.tzset()
+
+    yield
+
+    monkeypatch.undo()
+    time.tzset()
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_heartbeats_are_stored_in_local_time(
+    test_db: AsyncSession, monkeypatch: pytest.MonkeyPatch, local_timezone: None
+):
+    user_id = uuid4()
+
+    async def fake_get_current_user(tokens):
+        return SimpleNamespace(
+            id=str(user_id),
+            display_name="",
+            full_name="",
+            username="",
+            photo="",
+            is_photo_public=False,
+            email="",
+            timezone="UTC",
+            last_heartbeat_at="2026-10-17T12:00:00Z",
+        )
+
+    monkeypatch.setattr(
+        helpers.waka_user_funcs, "get_current_user", fake_get_current_user
+    )
+
+    test_db.add(User(id=user_id))
+    await test_db.flush()
+
+    profile = await helpers.recache_wakatime_profile(
+        test_db,
+        WakatimeTokens(user_id=user_id, access_token="", refresh_token=""),
+        "current",
+    )
+
+    # The same moment as wakatime's, just without a timezone like everything else
+    assert profile.last_heartbeat_at == datetime(2026, 10, 17, 17, 30)
+
+    await test_db.rollback()
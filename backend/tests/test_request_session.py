@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from src.dependencies import database
+from src.dependencies.database import SessionDependencyType
+
+
+class FakeSession:
+    def __init__(self) -> None:
+        self.calls: list[str] = []
+        SESSIONS.append(self)
+
+    async def commit(self) -> None:
+        self.calls.append("commit")
+
+    async def rollback(self) -> None:
+        self.calls.append("rollback")
+
+    async def close(self) -> None:
+        self.calls.append("close")
+
+
+SESSIONS: list[FakeSession] = []
+
+
+@pytest.fixture
+def client(monkeypatch: pytest.MonkeyPatch) -> TestClient:
+    SESSIONS.clear()
+
+    monkeypatch.setattr(
+        database,
+        "get_database_singleton",
+        lambda: SimpleNamespace(sessionmaker=FakeSession),
+    )
+
+    async def auth_dependency(session: SessionDependencyType) -> int:
+        return id(session)
+
+    app = FastAPI()
+
+    @app.get("/shared")
+    async def shared(session: SessionDependencyType, auth=Depends(auth_dependency)):
+        return {"same_session": auth == id(session)}
+
+    @app.get("/fails")
+    async def fails(session: SessionDependencyType):
+        raise HTTPException(status_code=404)
+
+    return TestClient(app)
+
+
+def test_dependencies_share_one_session_that_commits_once(client: TestClient):
+    resp = client.get("/shared")
+
+    assert resp.json() == {"same_session": True}
+    assert len(SESSIONS) == 1
+    assert SESSIONS[0].calls == ["commit", "close"]
+
+
+def test_session_is_rolled_back_when_the_handler_raises(client: TestClient):
+    resp = client.get("/fails")
+
+    assert resp.status_code == 404
+    assert SESSIONS[0].calls == ["rollback", "close"]
@@ -0,0 +1,234 @@
+from datetime import datetime, timedelta
+from typing import AsyncGenerator
+from uuid import UUID, uuid4
+import asyncio
+import json
+import os
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.caching.backends import (
+    INVALIDATION_CHANNEL,
+    CacheBackend,
+    CacheInvalidation,
+    PostgresCacheBackend,
+)
+from src.caching.shared import SharedCache, pydantic_codec
+from src.db import get_database_singleton
+from src.dependencies.auth import WAKATIME_TOKENS_CODEC
+from src.wakatime import WakatimeTokens
+
+
+class DictCacheBackend(CacheBackend):
+    """
+    A stand-in for a shared backend that keeps everything in a dict, and tells
+    subscribers about deletions right away.
+    """
+
+    name = "dict"
+
+    def __init__(self) -> None:
+        self.items: dict[tuple[str, str], tuple[str, datetime | None]] = {}
+
+    async def get(self, namespace: str, key: str):
+        return self.items.get((namespace, key))
+
+    async def set(self, namespace, key, value, expires_at) -> None:
+        self.items[(namespace, key)] = (value, expires_at)
+
+    async def delete(
+        self, namespace: str, key: str, *, is_prefix: bool = False
+    ) -> None:
+        self.items = {
+            (ns, k): v
+            for (ns, k), v in self.items.items()
+            if ns != namespace or not (k.startswith(key) if is_prefix else k == key)
+        }
+
+        self.notify_subscribers(
+            CacheInvalidation(namespace=namespace, key=key, is_prefix=is_prefix)
+        )
+
+
+@pytest_asyncio.fixture
+async def shared_backend() -> AsyncGenerator[DictCacheBackend, None]:
+    backend = DictCacheBackend()
+    setattr(CacheBackend, "instance", backend)
+
+    yield backend
+
+    delattr(CacheBackend, "instance")
+
+
+@pytest.mark.asyncio
+async def test_items_are_shared_through_the_backend(shared_backend: DictCacheBackend):
+    cache: SharedCache[UUID] = SharedCache(
+        f"test.{uuid4()}", codec=pydantic_codec(UUID)
+    )
+    user_id = uuid4()
+
+    await cache.add("jwt-hash", user_id)
+
+    # Pretend we're a different worker that hasn't seen this key yet
+    cache.local.clear()
+
+    assert await cache.get("jwt-hash") == user_id
+    assert cache.stats()["shared_hits"] == 1
+
+    # Now it's been pulled into the local cache, so the backend isn't needed
+    assert await cache.get("jwt-hash") == user_id
+    assert cache.stats()["shared_hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_invalidations_reach_other_caches(shared_backend: DictCacheBackend):
+    namespace = f"test.{uuid4()}"
+    cache: SharedCache[int] = SharedCache(namespace, codec=pydantic_codec(int))
+
+    await cache.add("user:1:a", 1)
+    await cache.add("user:1:b", 2)
+    await cache.add("user:2:a", 3)
+
+    # Another worker removing the prefix should knock them out of our local cache too
+    await shared_backend.delete(namespace, "user:1:", is_prefix=True)
+
+    assert "user:1:a" not in cache
+    assert "user:1:b" not in cache
+    assert await cache.get("user:2:a") == 3
+
+
+class BrokenCacheBackend(DictCacheBackend):
+    """
+    A backend that's gone down.
+    """
+
+    async def get(self, namespace, key):
+        raise ConnectionError("cache backend is down")
+
+    async def set(self, namespace, key, value, expires_at) -> None:
+        raise ConnectionError("cache backend is down")
+
+    async def delete(self, namespace, key, *, is_prefix: bool = False) -> None:
+        raise ConnectionError("cache backend is down")
+
+
+@pytest.mark.asyncio
+async def test_backend_failures_dont_break_the_cache():
+    setattr(CacheBackend, "instance", BrokenCacheBackend())
+
+    try:
+        cache: SharedCache[int] = SharedCache(
+            f"test.{uuid4()}", codec=pydantic_codec(int)
+        )
+
+        await cache.add("a", 1)
+        await cache.add("b", 2)
+        assert await cache.get("a") == 1
+
+        # Removals still happen locally, they just can't reach the other workers
+        await cache.remove("a")
+        assert await cache.remove_prefix("b") == 1
+
+        assert "a" not in cache
+        assert "b" not in cache
+    finally:
+        delattr(CacheBackend, "instance")
+
+
+async def wait_for(condition, *, timeout: float = 5.0) -> None:
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_postgres_backend_relistens_after_losing_its_connection(
+    test_db: AsyncSession,
+):
+    namespace = f"test.{uuid4()}"
+    cache: SharedCache[int] = SharedCache(namespace)
+
+    backend = PostgresCacheBackend()
+    backend.reconnect_delay = timedelta(milliseconds=10)
+    await backend.start()
+
+    try:
+        lost_pid = backend._listen_driver_connection.get_server_pid()
+        await cache.add("a", 1)
+
+        # Something out of our hands kills the listening connection
+        await test_db.execute(select(func.pg_terminate_backend(lost_pid)))
+
+        await wait_for(
+            lambda: (
+                backend._listen_driver_connection is not None
+                and backend._listen_driver_connection.get_server_pid() != lost_pid
+            )
+        )
+
+        # Whatever was invalidated in the meantime never reached us, so it's all gone
+        assert "a" not in cache
+
+        # ... and invalidations make it through the new connection
+        await cache.add("b", 2)
+
+        payload = json.dumps(
+            CacheInvalidation(namespace=namespace, key="b", is_prefix=False)
+        )
+        await test_db.execute(select(func.pg_notify(INVALIDATION_CHANNEL, payload)))
+        await test_db.commit()
+
+        await wait_for(lambda: "b" not in cache)
+    finally:
+        await backend.close()
+
+
+@pytest.mark.asyncio(loop_scope="session")
+async def test_postgres_backend_listens_on_a_direct_url_behind_pgbouncer(
+    test_db: AsyncSession, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(get_database_singleton().settings, "pgbouncer", True)
+
+    # Notifications would never arrive through pgbouncer, so it won't even start
+    monkeypatch.delenv("CACHE_LISTEN_DATABASE_URL", raising=False)
+
+    with pytest.raises(ValueError):
+        await PostgresCacheBackend().start()
+
+    # ... unless it's given somewhere else to listen
+    monkeypatch.setenv("CACHE_LISTEN_DATABASE_URL", os.environ["TEST_DATABASE_URL"])
+
+    namespace = f"test.{uuid4()}"
+    cache: SharedCache[int] = SharedCache(namespace)
+
+    backend = PostgresCacheBackend()
+    await backend.start()
+
+    try:
+        assert backend._listen_engine is not get_database_singleton().engine
+
+        await cache.add("a", 1)
+
+        payload = json.dumps(
+            CacheInvalidation(namespace=namespace, key="a", is_prefix=False)
+        )
+        await test_db.execute(select(func.pg_notify(INVALIDATION_CHANNEL, payload)))
+        await test_db.commit()
+
+        await wait_for(lambda: "a" not in cache)
+    finally:
+        await backend.close()
+
+
+def test_wakatime_tokens_are_encrypted_in_the_backend():
+    tokens = WakatimeTokens(
+        user_id=uuid4(), access_token="sec_access", refresh_token="sec_refresh"
+    )
+
+    dumped = WAKATIME_TOKENS_CODEC.dumps(tokens)
+
+    assert "sec_access" not in dumped
+    assert WAKATIME_TOKENS_CODEC.loads(dumped) == tokens
@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from src.utils.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_one_run():
+    flights: SingleFlight[str, int] = SingleFlight()
+    runs = []
+
+    async def slow_fetch() -> int:
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return 42
+
+    results = await asyncio.gather(
+        *[flights.do("user:week", slow_fetch) for _ in range(5)]
+    )
+
+    assert results == [42] * 5
+    assert len(runs) == 1
+
+    # Once it's finished, the next call starts a fresh run
+    assert "user:week" not in flights
+    await flights.do("user:week", slow_fetch)
+    assert len(runs) == 2
+
+
+@pytest.mark.asyncio
+async def test_errors_are_shared_with_every_caller():
+    flights: SingleFlight[str, None] = SingleFlight()
+
+    async def broken_fetch() -> None:
+        await asyncio.sleep(0)
+        raise ValueError("Failed to get durations")
+
+    results = await asyncio.gather(
+        flights.do("key", broken_fetch),
+        flights.do("key", broken_fetch),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(r, ValueError) for r in results)
@@ -0,0 +1,86 @@
+import asyncio
+from datetime import date, datetime, timedelta
+from uuid import uuid4
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from src.db import helpers
+from src.db.models import WakatimeDuration
+from src.dependencies.auth import get_current_user_wakatime_tokens
+from src.dependencies.database import get_request_session
+from src.routers.durations import router
+from src.wakatime import WakatimeTokens
+
+TOKENS = WakatimeTokens(user_id=uuid4(), access_token="", refresh_token="")
+
+
+@pytest.fixture
+def app() -> FastAPI:
+    async def fake_session():
+        yield None
+
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_current_user_wakatime_tokens] = lambda: TOKENS
+    app.dependency_overrides[get_request_session] = fake_session
+
+    return app
+
+
+@pytest.mark.asyncio
+async def test_allow_stale_returns_cached_today_and_refreshes_once(
+    app: FastAPI, monkeypatch: pytest.MonkeyPatch
+):
+    today = date.today()
+
+    # What we have cached for today is an hour old
+    cached_today = WakatimeDuration(
+        user_id=TOKENS["user_id"],
+        date=today,
+        total_seconds=600.0,
+        last_cached_at=datetime.now() - timedelta(hours=1),
+        languages=[],
+    )
+
+    async def fake_cached_durations(**_):
+        return [cached_today], [(today, today)]
+
+    refresh_started = asyncio.Event()
+    finish_refresh = asyncio.Event()
+    refreshes = []
+
+    async def fake_recache(tokens, date_ranges):
+        refreshes.append(date_ranges)
+        refresh_started.set()
+        await finish_refresh.wait()
+
+    monkeypatch.setattr(helpers, "get_cached_user_durations", fake_cached_durations)
+    monkeypatch.setattr(helpers, "recache_user_durations_once", fake_recache)
+
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        responses = [
+            await client.get("/durations/day", params={"allow_stale": True})
+            for _ in range(3)
+        ]
+
+        await refresh_started.wait()
+
+        # Nobody waited on wakatime, everyone got the cached copy flagged as stale
+        for resp in responses:
+            assert resp.status_code == 200
+            assert resp.json()["total_seconds"] == 600.0
+            assert resp.json()["is_stale"] is True
+
+        # ... and there's only ever one refresh going for the user
+        assert TOKENS["user_id"] in helpers.BACKGROUND_TODAY_REFRESHES
+
+        finish_refresh.set()
+        await asyncio.gather(
+            *(task for _, task in helpers.BACKGROUND_TODAY_REFRESHES.items())
+        )
+
+    assert refreshes == [[(today, today)]]
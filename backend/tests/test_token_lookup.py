@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+
+from src.db import helpers
+from src.db.helpers import wakatime_token_lookup_generator
+from src.db.models import OAuth2Credentials
+from src.utils import tokens as tokens_utils
+from src.wakatime import WakatimeTokens
+
+
+class FakeSession:
+    """
+    Just enough of an AsyncSession to hand back credentials, while counting how
+    many queries were made.
+    """
+
+    def __init__(self, creds: list[OAuth2Credentials]) -> None:
+        self.creds = {c.user_id: c for c in creds}
+        self.queries = 0
+
+    async def scalars(self, stmt):
+        self.queries += 1
+        user_ids = stmt.compile().params["user_ids"]
+
+        return [self.creds[u] for u in user_ids if u in self.creds]
+
+
+def make_creds(user_id, *, expired: bool = False) -> OAuth2Credentials:
+    return OAuth2Credentials(
+        user_id=user_id,
+        provider="wakatime",
+        access_token=tokens_utils.encrypt(f"access-{user_id}"),
+        refresh_token=tokens_utils.encrypt(f"refresh-{user_id}"),
+        expires_at=datetime.now() + timedelta(days=-1 if expired else 365),
+    )
+
+
+@pytest.mark.asyncio
+async def test_credentials_are_loaded_in_batches():
+    user_ids = [uuid4() for _ in range(150)]
+    missing = user_ids[10]
+    expired = user_ids[20]
+
+    session = FakeSession(
+        [make_creds(u, expired=(u == expired)) for u in user_ids if u != missing]
+    )
+
+    tokens = [
+        t
+        async for t in wakatime_token_lookup_generator(
+            session,  # type: ignore[arg-type]
+            user_ids,
+            skip_missing_credentials=True,
+            expired_oauth_behaviour="skip",
+            batch_size=100,
+        )
+    ]
+
+    # One query per batch, rather than one per user
+    assert session.queries == 2
+
+    # Everyone but the missing/expired users, in the order they were asked for
+    expected = [u for u in user_ids if u not in (missing, expired)]
+    assert [t["user_id"] for t in tokens] == expected
+    assert all(t["access_token"] == f"access-{t['user_id']}" for t in tokens)
+
+
+@pytest.mark.asyncio
+async def test_refreshed_tokens_keep_their_place(monkeypatch: pytest.MonkeyPatch):
+    user_ids = [uuid4() for _ in range(6)]
+    expired = {user_ids[1], user_ids[4]}
+    broken = user_ids[1]
+
+    async def fake_refresh(user_id):
+        if user_id == broken:
+            raise ValueError("Wakatime won't refresh these tokens")
+
+        tokens = WakatimeTokens(
+            user_id=user_id, access_token="refreshed", refresh_token="refreshed"
+        )
+        return tokens, datetime.now() + timedelta(days=365)
+
+    monkeypatch.setattr(helpers, "refresh_oauth_credentials", fake_refresh)
+
+    session = FakeSession([make_creds(u, expired=(u in expired)) for u in user_ids])
+
+    tokens = [
+        t
+        async for t in wakatime_token_lookup_generator(
+            session,  # type: ignore[arg-type]
+            user_ids,
+            expired_oauth_behaviour="refresh",
+        )
+    ]
+
+    # Everyone stays in the order they were asked for, and the user whose refresh
+    # failed is left out without stopping everyone after them
+    assert [t["user_id"] for t in tokens] == [u for u in user_ids if u != broken]
+    assert tokens[3]["access_token"] == "refreshed"
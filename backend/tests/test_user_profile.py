@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+from uuid import UUID, uuid4
+
+import pytest
+from fastapi import HTTPException
+
+from src.db.models import User
+from src.models import users as user_models
+from src.routers import users
+from src.wakatime import WakatimeTokens
+
+
+class FakeSession:
+    """
+    Hands back each of `results` in turn, one per query.
+    """
+
+    def __init__(self, *results) -> None:
+        self.results = list(results)
+
+    async def scalar(self, stmt):
+        return self.results.pop(0)
+
+
+async def private_profile(session, tokens, user_id):
+    raise ValueError("No user found on Wakatime matching the provided user_id")
+
+
+def stored_profile(
+    user_id: UUID, *, cached_ago: timedelta
+) -> user_models.UserProfileResponse:
+    return user_models.UserProfileResponse(
+        user_id=str(user_id),
+        wakatime=user_models.WakatimeProfile(
+            user_id=str(user_id),
+            display_name="someone",
+            full_name="Someone",
+            username="someone",
+            photo_url="",
+            is_photo_public=False,
+            last_cached_at=datetime.now() - cached_ago,
+        ),
+    )
+
+
+@pytest.mark.asyncio
+async def test_recent_profile_is_served_without_the_request_session(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    user_id = uuid4()
+    tokens = WakatimeTokens(user_id=uuid4(), access_token="", refresh_token="")
+
+    async def fake_stored_profile(user_id):
+        return stored_profile(user_id, cached_ago=timedelta(hours=1))
+
+    monkeypatch.setattr(users, "get_stored_user_profile", fake_stored_profile)
+    monkeypatch.setattr(users, "recache_wakatime_profile", private_profile)
+
+    # Any query through the request's session would fail here
+    profile = await users.get_user_profile(user_id, tokens, FakeSession())  # type: ignore[arg-type]
+
+    assert profile.user_id == str(user_id)
+
+
+@pytest.mark.asyncio
+async def test_unrecachable_profile_falls_back_to_the_cached_one(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    user_id = uuid4()
+    tokens = WakatimeTokens(user_id=uuid4(), access_token="", refresh_token="")
+
+    # The cached profile is old enough that it would normally be recached
+    async def fake_stored_profile(user_id):
+        return stored_profile(user_id, cached_ago=timedelta(days=30))
+
+    monkeypatch.setattr(users, "get_stored_user_profile", fake_stored_profile)
+    monkeypatch.setattr(users, "recache_wakatime_profile", private_profile)
+
+    profile = await users.get_user_profile(
+        user_id,
+        tokens,
+        FakeSession(User(id=user_id)),  # type: ignore[arg-type]
+    )
+
+    assert profile.wakatime.username == "someone"
+
+
+@pytest.mark.asyncio
+async def test_unrecachable_profile_without_a_cached_one_is_a_404(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    user_id = uuid4()
+    tokens = WakatimeTokens(user_id=uuid4(), access_token="", refresh_token="")
+
+    async def no_stored_profile(user_id):
+        return None
+
+    monkeypatch.setattr(users, "get_stored_user_profile", no_stored_profile)
+    monkeypatch.setattr(users, "recache_wakatime_profile", private_profile)
+
+    with pytest.raises(HTTPException) as e:
+        await users.get_user_profile(
+            user_id,
+            tokens,
+            FakeSession(User(id=user_id)),  # type: ignore[arg-type]
+        )
+
+    assert e.value.status_code == 404
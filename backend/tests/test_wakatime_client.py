@@ -0,0 +1,110 @@
+from typing import AsyncGenerator
+from uuid import UUID
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from src.wakatime import WakatimeTokens
+from src.wakatime.client import (
+    start_wakatime_client,
+    shutdown_wakatime_client,
+    get_wakatime_client,
+)
+from src.wakatime.user import get_current_user, get_user
+
+FAKE_USER = {
+    "id": str(UUID(int=1)),
+    "bio": None,
+    "has_premium_features": False,
+    "display_name": "Fake User",
+    "full_name": "Fake User",
+    "email": "fake@example.com",
+    "photo": "https://example.com/photo.png",
+    "is_email_public": False,
+    "is_photo_public": True,
+    "is_email_confirmed": True,
+    "public_email": None,
+    "timezone": "America/Halifax",
+    "last_heartbeat_at": None,
+    "last_plugin": None,
+    "last_plugin_name": None,
+    "last_project": None,
+    "last_branch": None,
+    "plan": "free",
+    "username": "fake",
+    "website": "",
+    "human_readable_website": "",
+    "wonderfuldev_username": "",
+    "github_username": "",
+    "twitter_username": "",
+    "linkedin_username": "",
+    "city": {"country_code": "CA", "name": "Halifax", "state": "NS", "title": ""},
+    "logged_time_public": True,
+    "languages_used_public": True,
+    "editors_used_public": True,
+    "categories_used_public": True,
+    "os_used_public": True,
+    "is_hireable": False,
+    "created_at": "2026-01-01T00:00:00Z",
+    "modified_at": "2026-01-01T00:00:00Z",
+}
+
+
+# A stand-in for wakatime that keeps track of which client sockets
+# were used to make requests to it.
+@pytest_asyncio.fixture
+async def fake_wakatime() -> AsyncGenerator[list[tuple], None]:
+    seen_peers = []
+    throttled_once = []
+
+    async def current_user(request: web.Request) -> web.Response:
+        seen_peers.append(request.transport.get_extra_info("peername"))
+        return web.json_response({"data": FAKE_USER})
+
+    # Throttles the first request it gets, then behaves
+    async def throttled_user(request: web.Request) -> web.Response:
+        if not throttled_once:
+            throttled_once.append(True)
+            return web.Response(status=429, headers={"Retry-After": "0"})
+
+        return web.json_response({"data": FAKE_USER})
+
+    app = web.Application()
+    app.router.add_get("/api/v1/users/current", current_user)
+    app.router.add_get(f"/api/v1/users/{FAKE_USER['id']}", throttled_user)
+
+    server = TestServer(app)
+    await server.start_server()
+
+    start_wakatime_client(base_url=str(server.make_url("/")))
+
+    yield seen_peers
+
+    await shutdown_wakatime_client()
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_requests_reuse_pooled_connection(fake_wakatime: list[tuple]):
+    tokens = WakatimeTokens(user_id=UUID(int=1), access_token="", refresh_token="")
+
+    first = await get_current_user(tokens)
+    second = await get_current_user(tokens)
+
+    assert first.id == second.id == FAKE_USER["id"]
+
+    # Both requests should have been sent down the same keep-alive connection
+    assert len(fake_wakatime) == 2
+    assert fake_wakatime[0] == fake_wakatime[1]
+
+
+@pytest.mark.asyncio
+async def test_throttled_requests_are_retried(fake_wakatime: list[tuple]):
+    tokens = WakatimeTokens(user_id=UUID(int=1), access_token="", refresh_token="")
+
+    user = await get_user(tokens, UUID(FAKE_USER["id"]))
+
+    assert user is not None
+    assert get_wakatime_client().limiter.stats()["total_throttled"] == 1
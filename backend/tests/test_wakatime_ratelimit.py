@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+import pytest
+
+from src.wakatime.ratelimit import (
+    WakatimeRateLimiter,
+    RequestPriority,
+    request_priority,
+    parse_retry_after,
+    DEFAULT_RETRY_AFTER_SECONDS,
+)
+
+
+@pytest.mark.asyncio
+async def test_interactive_requests_jump_the_queue():
+    limiter = WakatimeRateLimiter(rate=50, burst=1)
+
+    # Use up the only token so everything after this has to queue
+    await limiter.acquire()
+
+    served = []
+
+    async def make_request(name: str, priority: RequestPriority):
+        with request_priority(priority):
+            await limiter.acquire()
+        served.append(name)
+
+    tasks = [
+        asyncio.create_task(make_request("job-1", RequestPriority.BACKGROUND)),
+        asyncio.create_task(make_request("job-2", RequestPriority.BACKGROUND)),
+        asyncio.create_task(make_request("user", RequestPriority.INTERACTIVE)),
+    ]
+
+    # Let them all get in line before any tokens come back
+    await asyncio.sleep(0)
+    assert limiter.queue_depth() == 3
+    assert limiter.queue_depth(RequestPriority.BACKGROUND) == 2
+
+    await asyncio.gather(*tasks)
+
+    assert served == ["user", "job-1", "job-2"]
+    assert limiter.stats()["total_acquired"] == 4
+
+
+@pytest.mark.asyncio
+async def test_throttle_holds_requests_until_retry_after():
+    limiter = WakatimeRateLimiter(rate=1000, burst=10)
+
+    limiter.throttle(0.2)
+
+    started = time.monotonic()
+    await limiter.acquire()
+
+    assert time.monotonic() - started >= 0.19
+    assert limiter.stats()["total_throttled"] == 1
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) == DEFAULT_RETRY_AFTER_SECONDS
+    assert parse_retry_after("not a date") == DEFAULT_RETRY_AFTER_SECONDS
+
+    # HTTP dates in the past mean we can go right away
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0